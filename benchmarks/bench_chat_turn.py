@@ -0,0 +1,229 @@
+# End-to-end latency of a chat turn, without a live model or a window.
+# Starts the mock Ollama server (mock_ollama.py), fills a temporary database
+# with generated data (insert.py) and drives N turns through AIHelper.chat_turn
+# (what MentalHealthApp.get_ai_response runs), then the writes and reads
+# handle_ai_response / update_stats make:
+#
+#   context          building the prompt (the DB reads), i.e. the reply call
+#                    minus its LLM time
+#   llm              the reply's client.chat call, streamed to the end
+#   first token      time from the turn's start to the first streamed token
+#                    (AIHelper.first_token_times); not added to the total
+#   local sentiment  SentimentAnalyzer.local_sentiment (VADER and TextBlob),
+#                    then the sentiment cache
+#   sentiment        waiting for SentimentAnalyzer.model_sentiment (its own
+#                    LLM call) after the reply is done, on turns the local
+#                    scores could not settle. With --separate the call runs
+#                    alongside the reply, as in the app, so this is only the
+#                    part that outlasts it; in combined mode it runs only on
+#                    turns whose reply had no trailer
+#   recommendations  AIHelper.activity_suggestions, on turns with a low mood
+#   persistence      add_chat_entry + add_mood_entry, until committed
+#   refresh          the queries update_stats runs (widget updates not included)
+#
+# Run from the repository root:
+#   python benchmarks/bench_chat_turn.py --turns 50 --latency 0.3 --tokens-per-second 40
+#
+# --no-stream drives AIHelper.get_response instead of stream_response, and
+# --separate asks for the sentiment in its own call instead of in the reply
+# (AI_SENTIMENT['combined'] in config.py). --trailer-rate makes the mock leave
+# the sentiment out of some replies, to measure the fallback, and --no-local
+# sends every message to the LLM (AI_SENTIMENT['local_first']). The sentiment
+# cache is kept in memory (--no-cache turns it off); messages repeat every
+# len(insert.CHAT_MESSAGES) turns.
+#
+# Needs the app's dependencies (ollama, textblob, nltk, pytz), but no network.
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ollama import Client  # type: ignore # noqa: E402
+import insert  # noqa: E402
+from ai_helper import AIHelper  # noqa: E402
+from config import AI_SENTIMENT  # noqa: E402
+from database import Database  # noqa: E402
+from mock_ollama import MockOllamaServer  # noqa: E402
+from sentiment import SentimentAnalyzer  # noqa: E402
+
+STAGES = ('local sentiment', 'context', 'llm', 'sentiment', 'recommendations', 'persistence', 'refresh')
+# Reported alongside the stages, but overlapping them.
+MARKERS = ('first token',)
+
+class TimedClient:
+    # Wraps an ollama Client and adds the time spent in chat(), including
+    # reading a streamed reply, to `elapsed`.
+    def __init__(self, client):
+        self.client = client
+        self.elapsed = 0.0
+
+    def chat(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.client.chat(*args, **kwargs)
+        finally:
+            self.elapsed += time.perf_counter() - started
+        return self._timed(response) if kwargs.get('stream') else response
+
+    def _timed(self, chunks):
+        chunks = iter(chunks)
+        while True:
+            started = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                self.elapsed += time.perf_counter() - started
+            yield chunk
+
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def refresh_stats(db):
+    # The reads MentalHealthApp.update_stats (and update_mood_trend) make.
+    db.get_total_points()
+    db.get_weekly_mood_average()
+    db.get_weekly_progress()
+    db.get_daily_mood_average()
+    db.get_weekly_mood_average()
+    db.get_mood_trend(7)
+
+def run_turn(message, helper, analyzer, db, current_mood, pool, stream=True, combined=True):
+    # Returns ({stage: seconds}, {marker: seconds}, new mood). The turn itself
+    # is AIHelper.chat_turn, the same code the app runs.
+    markers = {}
+    llm = helper.client
+    llm.elapsed = 0.0
+    streamed_before = len(helper.first_token_times)
+    turn = helper.chat_turn(message, analyzer, pool, stream=stream, combined=combined)
+    if len(helper.first_token_times) > streamed_before:
+        markers['first token'] = helper.first_token_times[-1]
+    timings = dict(turn['timings'])
+    reply = timings.pop('reply')
+    timings['llm'] = llm.elapsed
+    timings['context'] = reply - llm.elapsed
+
+    sentiment_score, mood, mood_impact = turn['sentiment']
+    current_mood = max(0.0, min(1.0, current_mood + mood_impact))
+    ai_response = turn['reply'] + turn['suggestions']
+
+    started = time.perf_counter()
+    db.add_chat_entry(message, ai_response, sentiment_score)
+    db.add_mood_entry(current_mood)
+    db.flush()
+    timings['persistence'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    refresh_stats(db)
+    timings['refresh'] = time.perf_counter() - started
+    return timings, markers, current_mood
+
+def percentile(samples, fraction):
+    return samples[max(0, math.ceil(fraction * len(samples)) - 1)]
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'count': len(samples),
+        'mean_ms': sum(samples) / len(samples) * 1000,
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p95_ms': percentile(samples, 0.95) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'max_ms': samples[-1] * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chat turns against a mock Ollama server")
+    parser.add_argument('--turns', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.2, help="mock seconds before the first token")
+    parser.add_argument('--tokens-per-second', type=float, default=40.0)
+    parser.add_argument('--reply-tokens', type=int, default=60)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--days', type=int, default=90, help="history in the generated database")
+    parser.add_argument('--events-per-day', type=float, default=8.0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-stream', action='store_true', help="use get_response instead of stream_response")
+    parser.add_argument('--separate', action='store_true', help="sentiment in its own LLM call")
+    parser.add_argument('--trailer-rate', type=float, default=1.0, help="mock replies carrying the sentiment")
+    parser.add_argument('--no-local', action='store_true', help="skip the local VADER/TextBlob tier")
+    parser.add_argument('--no-cache', action='store_true', help="turn the sentiment cache off")
+    parser.add_argument('--output', help="also write the results as JSON")
+    args = parser.parse_args()
+
+    with MockOllamaServer(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                          reply_tokens=args.reply_tokens, jitter=args.jitter, seed=args.seed,
+                          trailer_rate=args.trailer_rate) as server:
+        with quiet():
+            db = Database(backend='temp')
+            insert.load_fixture(db, args.days, args.seed, args.events_per_day)
+            helper = AIHelper()
+            helper.set_database(db)
+            helper.client = TimedClient(Client(host=server.url))
+            analyzer = SentimentAnalyzer(cache={'enabled': not args.no_cache, 'path': None})
+            analyzer.client = Client(host=server.url)
+            analyzer.local_first = AI_SENTIMENT['local_first'] and not args.no_local
+        combined = AI_SENTIMENT['combined'] and not args.separate
+        pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='sentiment')
+        try:
+            current_mood = db.get_daily_mood_average() or 0.5
+            samples = {stage: [] for stage in STAGES + MARKERS}
+            totals = []
+            for turn in range(args.turns):
+                message = insert.CHAT_MESSAGES[turn % len(insert.CHAT_MESSAGES)]
+                timings, markers, current_mood = run_turn(
+                    message, helper, analyzer, db, current_mood, pool, stream=not args.no_stream, combined=combined
+                )
+                for stage, seconds in list(timings.items()) + list(markers.items()):
+                    samples[stage].append(seconds)
+                totals.append(sum(timings.values()))
+        finally:
+            pool.shutdown()
+            with quiet():
+                db.close()
+        requests = server.requests
+        tiers = analyzer.tier_stats()
+        cache = analyzer.cache_stats()
+
+    total_mean = sum(totals) / len(totals)
+    results = {
+        'turns': args.turns,
+        'stream': not args.no_stream,
+        'combined': combined,
+        'sentiment_tiers': tiers,
+        'sentiment_cache': cache,
+        'mock': {
+            'latency': args.latency, 'tokens_per_second': args.tokens_per_second,
+            'reply_tokens': args.reply_tokens, 'jitter': args.jitter, 'requests': requests,
+        },
+        'total': summarize(totals),
+        'stages': {stage: summarize(values) for stage, values in samples.items() if values},
+    }
+
+    print(f"{args.turns} turns, mock latency {args.latency:g}s, {args.tokens_per_second:g} tokens/s, "
+          f"{requests} LLM requests, {tiers['escalation_rate']:.0%} of sentiment escalated to the LLM"
+          + (f", {cache['hit_ratio']:.0%} sentiment cache hits" if cache else ""))
+    print(f"  {'stage':<16} {'turns':>5} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'share':>6}")
+    for stage, stats in list(results['stages'].items()) + [('total', results['total'])]:
+        share = stats['mean_ms'] * stats['count'] / args.turns / (total_mean * 1000)
+        print(f"  {stage:<16} {stats['count']:>5} {stats['mean_ms']:>9.1f} {stats['p50_ms']:>9.1f} "
+              f"{stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f} "
+              + (f"{'-':>6}" if stage in MARKERS else f"{share:>6.0%}"))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.output}")
+
+if __name__ == "__main__":
+    main()
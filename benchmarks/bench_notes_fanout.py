@@ -0,0 +1,79 @@
+# Shows that get_day_activities / get_todays_activities return one row per
+# completion, however many notes the activity has collected.
+# For each size N it logs N completions of the same activity today, each
+# with one note, and compares the rows returned with what the old
+# `LEFT JOIN activity_notes ON activity_id` query would have produced (N * N).
+#
+# Run from the repository root:
+#   python benchmarks/bench_notes_fanout.py
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from database import Database  # noqa: E402
+
+SIZES = [10, 50, 100, 200, 400]
+
+OLD_JOIN_ROWS = '''
+    SELECT COUNT(*)
+    FROM user_progress p
+    JOIN activities a ON p.activity_id = a.id
+    LEFT JOIN activity_notes n ON n.activity_id = a.id
+    WHERE p.day_key = ?
+'''
+
+def run_size(n):
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            db = Database()
+            for i in range(n):
+                db.complete_activity('Deep Breathing')
+                db.add_activity_note('Deep Breathing', f"note {i}")
+            db.flush()
+
+            today = db._get_current_time()
+            started = time.perf_counter()
+            rows = db.get_day_activities(today)
+            day_ms = (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            todays = db.get_todays_activities()
+            today_ms = (time.perf_counter() - started) * 1000
+
+            conn = db._pool.acquire()
+            try:
+                old_rows = conn.execute(OLD_JOIN_ROWS, (db._day_key(today),)).fetchone()[0]
+            finally:
+                db._pool.release(conn)
+            db.close()
+        finally:
+            os.chdir(cwd)
+    return len(rows), len(todays), old_rows, day_ms, today_ms
+
+def main():
+    # Completion logging is chatty; keep the table readable.
+    stdout = sys.stdout
+    print(f"{'N':>6} {'day rows':>9} {'today rows':>11} {'old join':>9} {'day ms':>8} {'today ms':>9}")
+    failed = False
+    for n in SIZES:
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            day_rows, today_rows, old_rows, day_ms, today_ms = run_size(n)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        print(f"{n:>6} {day_rows:>9} {today_rows:>11} {old_rows:>9} {day_ms:>8.2f} {today_ms:>9.2f}")
+        failed = failed or day_rows != n or today_rows != n
+    if failed:
+        print("FAIL: result size is not one row per completion")
+        sys.exit(1)
+    print("OK: result size grows linearly with completions")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+# Times the Database query methods the UI calls on every refresh against
+# generated datasets of increasing size (see insert.py), cold and warm.
+#
+# - cold: a freshly opened Database per call (new connections, empty query
+#   cache, SQLite page cache empty; the OS file cache stays warm).
+# - warm: repeated calls on one open Database with the query cache turned
+#   off, so every call still runs its SQL.
+#
+# Results (p50/p95/p99/max in ms per scale, method and mode) are written as
+# JSON. Given --baseline, the run fails when a p50 got slower than the
+# baseline's by more than --threshold (and by more than --min-ms, so
+# sub-millisecond noise does not count).
+#
+# Run from the repository root; datasets are generated once per day and
+# seed and reused from --data-dir:
+#   python benchmarks/bench_queries.py --scales 1k,100k --output before.json
+#   python benchmarks/bench_queries.py --scales 1k,100k --baseline before.json
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import insert  # noqa: E402
+from database import Database  # noqa: E402
+
+# Approximate total rows per scale, and the days they are spread over.
+SCALES = {
+    '1k': (1_000, 30),
+    '100k': (100_000, 365),
+    '1m': (1_000_000, 730),
+    '10m': (10_000_000, 1825),
+}
+
+# Notes add NOTE_RATE of the completions on top of the day's events.
+ROWS_PER_EVENT = 1 + insert.EVENT_MIX['user_progress'] * insert.NOTE_RATE
+
+def _week_start(db):
+    today = db._get_current_time().replace(tzinfo=None)
+    return today - timedelta(days=today.weekday())
+
+METHODS = {
+    'get_mood_trend': lambda db: db.get_mood_trend(7),
+    'get_activities_for_week': lambda db: db.get_activities_for_week(_week_start(db)),
+    'get_todays_activities': lambda db: db.get_todays_activities(),
+    'get_day_activities': lambda db: db.get_day_activities(db._get_current_time() - timedelta(days=1)),
+    'get_stats_for_week': lambda db: db.get_stats_for_week(_week_start(db)),
+    'get_activity_recommendations': lambda db: db.get_activity_recommendations(0.4),
+}
+
+def percentile(samples, fraction):
+    # Nearest-rank percentile of an already sorted list.
+    return samples[max(0, math.ceil(fraction * len(samples)) - 1)]
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'runs': len(samples),
+        'p50_ms': percentile(samples, 0.50),
+        'p95_ms': percentile(samples, 0.95),
+        'p99_ms': percentile(samples, 0.99),
+        'max_ms': samples[-1],
+    }
+
+@contextlib.contextmanager
+def quiet():
+    # Migrations and bulk loads report progress; keep the table readable.
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def dataset(data_dir, scale, seed, rebuild=False):
+    rows, days = SCALES[scale]
+    path = os.path.join(data_dir, f"queries-{scale}-seed{seed}-{datetime.now():%Y%m%d}.db")
+    if rebuild or not os.path.exists(path):
+        for stale in (path, path + '-wal', path + '-shm'):
+            if os.path.exists(stale):
+                os.remove(stale)
+        print(f"Generating {scale} dataset at {path}...")
+        started = time.perf_counter()
+        with quiet():
+            insert.load_database(path, days, seed, rows / ROWS_PER_EVENT / (days + 1))
+        print(f"  done in {time.perf_counter() - started:.1f}s")
+    return path
+
+def table_counts(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {
+            table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            for table in ('user_progress', 'activity_notes', 'mood_tracking', 'chat_history')
+        }
+    finally:
+        conn.close()
+
+def open_database(path):
+    with quiet():
+        return Database(path, cache={'enabled': False})
+
+def close_database(db):
+    with quiet():
+        db.close()
+
+def time_call(method, db):
+    started = time.perf_counter()
+    method(db)
+    return (time.perf_counter() - started) * 1000
+
+def bench_scale(path, cold_runs, warm_runs):
+    results = {}
+    for name, method in METHODS.items():
+        cold = []
+        for _ in range(cold_runs):
+            db = open_database(path)
+            try:
+                cold.append(time_call(method, db))
+            finally:
+                close_database(db)
+
+        db = open_database(path)
+        try:
+            method(db)  # warm-up call, not recorded
+            warm = [time_call(method, db) for _ in range(warm_runs)]
+        finally:
+            close_database(db)
+        results[name] = {'cold': summarize(cold), 'warm': summarize(warm)}
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, threshold, min_ms):
+    # [(scale, method, mode, baseline p50, new p50)] for every p50 that
+    # regressed past the threshold. Entries missing on either side are skipped.
+    regressions = []
+    for scale, methods in results['scales'].items():
+        for name, modes in methods['methods'].items():
+            for mode, stats in modes.items():
+                try:
+                    before = baseline['scales'][scale]['methods'][name][mode]['p50_ms']
+                except KeyError:
+                    continue
+                after = stats['p50_ms']
+                if after > before * (1 + threshold) and after - before > min_ms:
+                    regressions.append((scale, name, mode, before, after))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Database query methods at several data scales")
+    parser.add_argument('--scales', default=','.join(SCALES), help=f"comma-separated, from {', '.join(SCALES)}")
+    parser.add_argument('--cold-runs', type=int, default=10)
+    parser.add_argument('--warm-runs', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'stacy-bench'))
+    parser.add_argument('--rebuild', action='store_true', help="regenerate datasets even if present")
+    parser.add_argument('--output', default='bench_queries.json')
+    parser.add_argument('--baseline', help="earlier --output file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.25, help="allowed p50 slowdown, as a fraction")
+    parser.add_argument('--min-ms', type=float, default=0.5, help="ignore slowdowns smaller than this")
+    args = parser.parse_args()
+
+    scales = [scale.strip().lower() for scale in args.scales.split(',') if scale.strip()]
+    unknown = [scale for scale in scales if scale not in SCALES]
+    if unknown:
+        parser.error(f"unknown scale(s): {', '.join(unknown)}")
+    os.makedirs(args.data_dir, exist_ok=True)
+
+    results = {
+        'commit': git_commit(),
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'cold_runs': args.cold_runs,
+        'warm_runs': args.warm_runs,
+        'scales': {},
+    }
+    for scale in scales:
+        path = dataset(args.data_dir, scale, args.seed, args.rebuild)
+        counts = table_counts(path)
+        print(f"\n{scale}: {sum(counts.values()):,} rows")
+        print(f"  {'method':<30} {'mode':<5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        methods = bench_scale(path, args.cold_runs, args.warm_runs)
+        for name, modes in methods.items():
+            for mode, stats in modes.items():
+                print(
+                    f"  {name:<30} {mode:<5} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} "
+                    f"{stats['p99_ms']:>8.2f} {stats['max_ms']:>8.2f}"
+                )
+        results['scales'][scale] = {'rows': counts, 'methods': methods}
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_ms)
+        for scale, name, mode, before, after in regressions:
+            print(f"REGRESSION {scale} {name} ({mode}): p50 {before:.2f} ms -> {after:.2f} ms")
+        if regressions:
+            print(f"FAIL: {len(regressions)} p50 slowdown(s) over {args.threshold:.0%} vs {args.baseline}")
+            sys.exit(1)
+        print(f"OK: no p50 slowdown over {args.threshold:.0%} vs {args.baseline} (commit {baseline.get('commit')})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+# A local stand-in for the Ollama server, for benchmarks and offline runs.
+# Speaks enough of the /api/chat protocol for the ollama client: non-streamed
+# replies as one JSON object, streamed replies as NDJSON chunks ending with a
+# "done" message. Replies are canned but shaped like the real ones the app
+# asks for (the sentiment JSON, activity JSON, or free text, plus the
+# sentiment trailer when the prompt asks for one), and timing is
+# configurable: a fixed delay before the first token, then tokens at a given
+# rate.
+#
+#   python benchmarks/mock_ollama.py --port 11434 --latency 0.3 --tokens-per-second 40
+#
+# or from Python:
+#   with MockOllamaServer(latency=0.3, tokens_per_second=40) as server:
+#       client = Client(host=server.url)
+
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Starts the sentiment trailer of combined replies (ai_helper.SENTIMENT_MARKER).
+SENTIMENT_MARKER = '<<<SENTIMENT'
+
+# Words that make the mock sentiment come out low; everything else is
+# neutral or positive.
+LOW_WORDS = ('anxious', 'stressed', 'challenging', 'support', 'sad', 'tired', 'worried')
+POSITIVE_WORDS = ('good', 'great', 'motivated', 'productive', 'peaceful', 'happy')
+
+FILLER = (
+    "That sounds like a lot to carry, and it is good that you are taking a moment to notice "
+    "how you feel. A short walk or a few slow breaths can help reset the day. Would you like "
+    "to try one of your usual activities, or talk a little more about what is on your mind?"
+).split()
+
+def _now():
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+def sentiment_reply(text):
+    text = text.lower()
+    if any(word in text for word in LOW_WORDS):
+        score, mood, impact = 0.25, 'low', -0.03
+    elif any(word in text for word in POSITIVE_WORDS):
+        score, mood, impact = 0.8, 'positive', 0.03
+    else:
+        score, mood, impact = 0.5, 'neutral', 0.01
+    return json.dumps({'score': score, 'mood': mood, 'impact': impact})
+
+def activities_reply():
+    return json.dumps([
+        {'name': 'Nature Walk', 'description': 'Take a 10-minute walk outside', 'points': 20, 'category': 'exercise'},
+        {'name': 'Gratitude List', 'description': "Write down three things you're grateful for", 'points': 15,
+         'category': 'reflection'},
+        {'name': 'Deep Breathing', 'description': 'Practice deep breathing for 5 minutes', 'points': 10,
+         'category': 'mindfulness'},
+    ])
+
+def reply_for(messages, reply_tokens, trailer=True):
+    # Picks the canned reply matching what the system prompt asks for.
+    system = ' '.join(m.get('content', '') for m in messages if m.get('role') == 'system')
+    user = next((m.get('content', '') for m in reversed(messages) if m.get('role') == 'user'), '')
+    if SENTIMENT_MARKER in system:
+        reply = ' '.join(FILLER[i % len(FILLER)] for i in range(reply_tokens))
+        return f"{reply}\n{SENTIMENT_MARKER} {sentiment_reply(user)}>>>" if trailer else reply
+    if '"impact"' in system or 'impact:' in system:
+        return sentiment_reply(user)
+    if 'JSON array' in system:
+        return activities_reply()
+    if 'categorizes and scores' in system:
+        return json.dumps({'name': 'Custom Activity', 'description': user[:80], 'points': 15, 'category': 'reflection'})
+    words = [FILLER[i % len(FILLER)] for i in range(reply_tokens)]
+    return ' '.join(words)
+
+def tokenize(text):
+    # Roughly word-sized pieces that join back into the exact text.
+    pieces, start = [], 0
+    for i, char in enumerate(text):
+        if char == ' ' and i > start:
+            pieces.append(text[start:i])
+            start = i
+    pieces.append(text[start:])
+    return [piece for piece in pieces if piece]
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MockOllama/0.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/api/version':
+            self._send_json(200, {'version': '0.0.0-mock'})
+        elif self.path == '/api/tags':
+            self._send_json(200, {'models': [{'name': self.server.mock.model, 'model': self.server.mock.model}]})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        if self.path != '/api/chat':
+            self._send_json(404, {'error': 'not found'})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self._send_json(400, {'error': 'invalid JSON'})
+            return
+        self.server.mock.serve_chat(self, request)
+
+class MockOllamaServer:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.2, tokens_per_second=40.0, reply_tokens=60,
+                 jitter=0.0, model='qwen2.5:3b', seed=None, trailer_rate=1.0):
+        # latency: seconds before the first token; tokens_per_second: rate of
+        # the rest (0 = all at once); jitter: +/- fraction applied to both;
+        # trailer_rate: share of combined replies that include the sentiment
+        # trailer (the rest exercise the app's fallback).
+        self.latency = latency
+        self.trailer_rate = trailer_rate
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.jitter = jitter
+        self.model = model
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.streamed = 0
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.mock = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _jittered(self, value):
+        if not self.jitter:
+            return value
+        with self._lock:
+            return value * (1 + self._rng.uniform(-self.jitter, self.jitter))
+
+    def serve_chat(self, handler, request):
+        stream = request.get('stream', True)
+        with self._lock:
+            self.requests += 1
+            self.streamed += bool(stream)
+        started = time.perf_counter()
+        with self._lock:
+            trailer = self._rng.random() < self.trailer_rate
+        content = reply_for(request.get('messages') or [], self.reply_tokens, trailer)
+        tokens = tokenize(content)
+        delay = 1 / self._jittered(self.tokens_per_second) if self.tokens_per_second else 0.0
+        model = request.get('model') or self.model
+
+        time.sleep(max(0.0, self._jittered(self.latency)))
+        if not stream:
+            time.sleep(delay * max(0, len(tokens) - 1))
+            handler._send_json(200, dict(
+                self._final(model, started, len(tokens)),
+                message={'role': 'assistant', 'content': content},
+            ))
+            return
+
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/x-ndjson')
+        handler.send_header('Transfer-Encoding', 'chunked')
+        handler.end_headers()
+        try:
+            for i, token in enumerate(tokens):
+                if i:
+                    time.sleep(delay)
+                self._write_chunk(handler, {
+                    'model': model, 'created_at': _now(),
+                    'message': {'role': 'assistant', 'content': token}, 'done': False,
+                })
+            self._write_chunk(handler, dict(
+                self._final(model, started, len(tokens)),
+                message={'role': 'assistant', 'content': ''},
+            ))
+            handler.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client stopped reading
+
+    def _final(self, model, started, eval_count):
+        elapsed = int((time.perf_counter() - started) * 1e9)
+        return {
+            'model': model, 'created_at': _now(), 'done': True, 'done_reason': 'stop',
+            'total_duration': elapsed, 'load_duration': 0,
+            'prompt_eval_count': 0, 'eval_count': eval_count, 'eval_duration': elapsed,
+        }
+
+    @staticmethod
+    def _write_chunk(handler, payload):
+        data = json.dumps(payload).encode() + b'\n'
+        handler.wfile.write(f"{len(data):x}\r\n".encode() + data + b'\r\n')
+        handler.wfile.flush()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever, name='mock-ollama', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a mock Ollama /api/chat for offline runs and benchmarks")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--latency', type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument('--tokens-per-second', type=float, default=40.0)
+    parser.add_argument('--reply-tokens', type=int, default=60, help="length of free-text replies")
+    parser.add_argument('--jitter', type=float, default=0.0, help="+/- fraction applied to the timings")
+    parser.add_argument('--trailer-rate', type=float, default=1.0, help="combined replies with a sentiment trailer")
+    args = parser.parse_args()
+
+    server = MockOllamaServer(args.host, args.port, args.latency, args.tokens_per_second, args.reply_tokens,
+                              args.jitter, trailer_rate=args.trailer_rate)
+    print(f"Mock Ollama listening on {server.url} (Ctrl+C to stop)")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -1,91 +1,165 @@
 from ollama import Client # type: ignore
 import json
+import time
+from collections import deque
 from datetime import datetime
-from config import OLLAMA_HOST, AI_MODEL
+from config import OLLAMA_HOST, AI_MODEL, AI_SENTIMENT, AI_STREAM
+
+# Marks the sentiment trailer the model appends to its reply in combined mode
+# (see SentimentTrailer), e.g. <<<SENTIMENT {"score": 0.2, "mood": "low", "impact": -0.03}>>>
+SENTIMENT_MARKER = '<<<SENTIMENT'
+SENTIMENT_INSTRUCTION = f"""
+After your reply, add one final line rating the emotional state of the user's latest message, exactly like:
+{SENTIMENT_MARKER} {{"score": 0.2, "mood": "low", "impact": -0.03}}>>>
+- score: float between 0-1 (0 = very negative, 1 = very positive)
+- mood: string (low/neutral/positive)
+- impact: float between -0.05 and 0.05 (how much this should affect overall mood)
+Never mention or explain this line."""
+
+class SentimentTrailer:
+    # Separates the reply from the sentiment trailer as the reply streams in.
+    # feed() returns the text that is safe to show: anything that could still
+    # turn out to be the start of the trailer is held back until it is clear.
+    # After finish(), `result` is (score, mood, impact), or None when the
+    # model left the trailer out or got it wrong.
+    def __init__(self):
+        self.result = None
+        self._pending = ''
+        self._trailer = None
+
+    def feed(self, piece):
+        if self._trailer is not None:
+            self._trailer += piece
+            return ''
+        self._pending += piece
+        index = self._pending.find(SENTIMENT_MARKER)
+        if index != -1:
+            self._trailer = self._pending[index + len(SENTIMENT_MARKER):]
+            visible, self._pending = self._pending[:index].rstrip(), ''
+            return visible
+        keep = 0
+        for n in range(min(len(SENTIMENT_MARKER) - 1, len(self._pending)), 0, -1):
+            if SENTIMENT_MARKER.startswith(self._pending[-n:]):
+                keep = n
+                break
+        # Trailing whitespace is held back too, as it would precede the marker.
+        cut = len(self._pending) - keep
+        visible = self._pending[:cut].rstrip()
+        self._pending = self._pending[len(visible):]
+        return visible
+
+    def finish(self):
+        # Returns any text still held back, and parses the trailer.
+        if self._trailer is None:
+            visible, self._pending = self._pending.rstrip(), ''
+            return visible
+        start, end = self._trailer.find('{'), self._trailer.find('}')
+        try:
+            analysis = json.loads(self._trailer[start:end + 1]) if 0 <= start < end else None
+            if analysis and analysis.get('mood') in ('low', 'neutral', 'positive'):
+                self.result = (
+                    max(0.0, min(1.0, float(analysis['score']))),
+                    str(analysis['mood']),
+                    max(-0.05, min(0.05, float(analysis['impact'])))
+                )
+        except (ValueError, TypeError, KeyError) as e:
+            print(f"Ignoring malformed sentiment trailer: {e}")
+        return ''
 
 class AIHelper:
     def __init__(self):
         self.client = Client(host=OLLAMA_HOST)
         self.model = AI_MODEL
         self.db = None
+        # Seconds to the first streamed token, most recent last.
+        self.first_token_times = deque(maxlen=AI_STREAM['ttft_history'])
 
     # Set the database.
     def set_database(self, db):
         self.db = db
 
-    def get_response(self, user_input):
+    def _build_messages(self, user_input, with_sentiment=False):
+        # The conversation sent to the model: recent chats, a system prompt
+        # with today's activities and history, then the user's message.
+        # with_sentiment asks for the sentiment trailer as well.
+        todays_activities = []
+        if self.db:
+            try:
+                activities = self.db.get_todays_activities()
+                if activities:
+                    by_category = {}
+                    for name, category, points, notes, timestamp in activities:
+                        if category not in by_category:
+                            by_category[category] = []
+                        time_str = datetime.fromisoformat(timestamp).strftime('%I:%M %p')
+                        activity_str = f"{name} ({points}pts at {time_str})"
+                        if notes:
+                            activity_str += f" - Note: {notes}"
+                        by_category[category].append(activity_str)
+                    
+                    for category, acts in by_category.items():
+                        todays_activities.append(f"{category.title()}: {', '.join(acts)}")
+            except Exception as e:
+                print(f"Warning: Could not get today's activities: {e}")
+
+        daily_context = "\nToday's Activities:"
+        if todays_activities:
+            daily_context += "\n• " + "\n• ".join(todays_activities)
+        else:
+            daily_context += "\nNo activities completed today yet."
+
+        completed_activities = []
+        total_points = 0
+        if self.db:
+            try:
+                recommendations, recent = self.db.get_activity_recommendations(0.5) 
+                completed_activities = recent
+                total_points = self.db.get_total_points()
+            except Exception as e:
+                print(f"Warning: Could not get activity history: {e}")
+
+        activity_context = ""
+        if completed_activities:
+            activity_context = f"\nUser's recent activities: {', '.join(completed_activities)}"
+            activity_context += f"\nTotal points earned: {total_points}"
+
+        # Get recent chat context
+        messages = []
+        if self.db:
+            try:
+                recent_chats = self.db.get_recent_chats(3)
+                for _, msg, resp in recent_chats[::-1]:
+                    if not msg.startswith('/'):
+                        messages.extend([
+                            {"role": "user", "content": msg},
+                            {"role": "assistant", "content": resp}
+                        ])
+            except Exception as e:
+                print(f"Warning: Could not get chat history: {e}")
+
+        # Add current message with enhanced context
+        messages.append({
+            "role": "system",
+            "content": f"""You are Stacy, a friendly and empathetic emotional AI Healthcare Assistant created by Pranav Verma.
+            {daily_context}
+            {activity_context}
+            Guidelines:
+            - Be very specific about today's completed activities when asked
+            - Include timing information for activities when available
+            - If activities were completed today, acknowledge them positively
+            - If no activities were completed today, encourage starting with a simple one
+            - Keep responses conversational and natural
+            - Only mention crisis resources (988) if user expresses serious distress
+            """ + (SENTIMENT_INSTRUCTION if with_sentiment else "")
+        })
+        messages.append({"role": "user", "content": user_input})
+        return messages
+
+    def get_response(self, user_input, trailer=None):
+        # With a SentimentTrailer, the model also rates the message's
+        # sentiment in the same call; read it from trailer.result.
         try:
-            todays_activities = []
-            if self.db:
-                try:
-                    activities = self.db.get_todays_activities()
-                    if activities:
-                        by_category = {}
-                        for name, category, points, notes, timestamp in activities:
-                            if category not in by_category:
-                                by_category[category] = []
-                            time_str = datetime.fromisoformat(timestamp).strftime('%I:%M %p')
-                            activity_str = f"{name} ({points}pts at {time_str})"
-                            if notes:
-                                activity_str += f" - Note: {notes}"
-                            by_category[category].append(activity_str)
-                        
-                        for category, acts in by_category.items():
-                            todays_activities.append(f"{category.title()}: {', '.join(acts)}")
-                except Exception as e:
-                    print(f"Warning: Could not get today's activities: {e}")
-
-            daily_context = "\nToday's Activities:"
-            if todays_activities:
-                daily_context += "\n• " + "\n• ".join(todays_activities)
-            else:
-                daily_context += "\nNo activities completed today yet."
-
-            completed_activities = []
-            total_points = 0
-            if self.db:
-                try:
-                    recommendations, recent = self.db.get_activity_recommendations(0.5) 
-                    completed_activities = recent
-                    total_points = self.db.get_total_points()
-                except Exception as e:
-                    print(f"Warning: Could not get activity history: {e}")
-
-            activity_context = ""
-            if completed_activities:
-                activity_context = f"\nUser's recent activities: {', '.join(completed_activities)}"
-                activity_context += f"\nTotal points earned: {total_points}"
-
-            # Get recent chat context
-            messages = []
-            if self.db:
-                try:
-                    recent_chats = self.db.get_recent_chats(3)
-                    for _, msg, resp in recent_chats[::-1]:
-                        if not msg.startswith('/'):
-                            messages.extend([
-                                {"role": "user", "content": msg},
-                                {"role": "assistant", "content": resp}
-                            ])
-                except Exception as e:
-                    print(f"Warning: Could not get chat history: {e}")
-
-            # Add current message with enhanced context
-            messages.append({
-                "role": "system",
-                "content": f"""You are Stacy, a friendly and empathetic emotional AI Healthcare Assistant created by Pranav Verma.
-                {daily_context}
-                {activity_context}
-                Guidelines:
-                - Be very specific about today's completed activities when asked
-                - Include timing information for activities when available
-                - If activities were completed today, acknowledge them positively
-                - If no activities were completed today, encourage starting with a simple one
-                - Keep responses conversational and natural
-                - Only mention crisis resources (988) if user expresses serious distress
-                """
-            })
-            messages.append({"role": "user", "content": user_input})
+            messages = self._build_messages(user_input, with_sentiment=trailer is not None)
 
             # Get response using ollama
             response = self.client.chat(
@@ -95,13 +169,141 @@ class AIHelper:
 
             # Extract content
             if isinstance(response, dict) and 'message' in response:
-                return response['message'].get('content', 'No response content')
+                content = response['message'].get('content', 'No response content')
             else:
-                return str(response)
+                content = str(response)
+            if trailer is not None:
+                content = trailer.feed(content) + trailer.finish()
+            return content
 
         except Exception as e:
             return f"Error: Unable to get response. Please ensure Ollama is running. ({str(e)})"
 
+    def stream_response(self, user_input, trailer=None):
+        # Same as get_response, but yields the reply in pieces as the model
+        # generates them. The time from the call to the first piece (context
+        # gathering included, as that is what the user waits through) is
+        # recorded in first_token_times.
+        started = time.perf_counter()
+        received = False
+        try:
+            messages = self._build_messages(user_input, with_sentiment=trailer is not None)
+            for chunk in self.client.chat(model=self.model, messages=messages, stream=True):
+                content = chunk.get('message', {}).get('content', '')
+                if not content:
+                    continue
+                if not received:
+                    received = True
+                    self.first_token_times.append(time.perf_counter() - started)
+                if trailer is not None:
+                    content = trailer.feed(content)
+                if content:
+                    yield content
+            if trailer is not None:
+                content = trailer.finish()
+                if content:
+                    yield content
+        except Exception as e:
+            yield ("\n\n" if received else "") + \
+                f"Error: Unable to get response. Please ensure Ollama is running. ({str(e)})"
+
+    def chat_turn(self, user_input, analyzer, pool, on_start=None, on_text=None, stream=None, combined=None):
+        # One chat turn, without any UI: the reply, the message's sentiment
+        # and, for a low mood, activity suggestions. Runs on a worker thread;
+        # MentalHealthApp hands on_start() (before the streamed reply) and
+        # on_text(text) (batches of it, at most every flush_interval seconds)
+        # to Tk. `analyzer` is a SentimentAnalyzer and `pool` an executor its
+        # AI calls run on. stream and combined default to AI_STREAM['enabled']
+        # and AI_SENTIMENT['combined'].
+        # Returns {'reply', 'streamed', 'sentiment', 'suggestions', 'timings'},
+        # timings being seconds per stage: 'local sentiment', 'reply', and on
+        # the turns that need them 'sentiment' (waiting for the separate call
+        # after the reply) and 'recommendations'.
+        stream = AI_STREAM['enabled'] if stream is None else stream
+        combined = AI_SENTIMENT['combined'] if combined is None else combined
+        timings = {}
+
+        # Clear-cut messages are scored locally, and repeated ones come from
+        # the sentiment cache. For the rest, in combined mode the reply
+        # carries the message's sentiment too, which saves a second LLM call;
+        # otherwise the sentiment call starts now, alongside the reply, so the
+        # turn takes the longer of the two.
+        started = time.perf_counter()
+        sentiment = analyzer.local_sentiment(user_input) or analyzer.cached_sentiment(user_input)
+        timings['local sentiment'] = time.perf_counter() - started
+        trailer = SentimentTrailer() if sentiment is None and combined else None
+        pending_sentiment = None
+        if sentiment is None:
+            analyzer.record_escalation()
+            if trailer is None:
+                pending_sentiment = pool.submit(analyzer.model_sentiment, user_input)
+
+        started = time.perf_counter()
+        if not stream:
+            reply = self.get_response(user_input, trailer)
+        else:
+            if on_start:
+                on_start()
+            parts, pending = [], []
+            last_flush = time.monotonic()
+            for piece in self.stream_response(user_input, trailer):
+                parts.append(piece)
+                pending.append(piece)
+                if on_text and time.monotonic() - last_flush >= AI_STREAM['flush_interval']:
+                    on_text(''.join(pending))
+                    pending = []
+                    last_flush = time.monotonic()
+            if on_text and pending:
+                on_text(''.join(pending))
+            reply = ''.join(parts)
+        timings['reply'] = time.perf_counter() - started
+
+        if sentiment is None and trailer and trailer.result:
+            sentiment = trailer.result
+            analyzer.remember(user_input, sentiment)
+        if sentiment is None:
+            # No trailer in the reply: fall back to the separate call.
+            started = time.perf_counter()
+            if pending_sentiment is None:
+                pending_sentiment = pool.submit(analyzer.model_sentiment, user_input)
+            sentiment = pending_sentiment.result()
+            timings['sentiment'] = time.perf_counter() - started
+
+        suggestions = ""
+        if sentiment[1] == "low":
+            started = time.perf_counter()
+            suggestions = self.activity_suggestions(sentiment[0])
+            timings['recommendations'] = time.perf_counter() - started
+        return {
+            'reply': reply,
+            'streamed': stream,
+            'sentiment': sentiment,
+            'suggestions': suggestions,
+            'timings': timings,
+        }
+
+    def activity_suggestions(self, sentiment_score):
+        # Text appended to the reply for a low mood.
+        suggestions = ""
+        recommendations, recent = self.db.get_activity_recommendations(sentiment_score)
+        if recommendations:
+            suggestions += "\n\nHere are some activities that might help:"
+            for name, desc, points in recommendations:
+                suggestions += f"\n• {name} ({points} points) - {desc}"
+        return suggestions
+
+    def ttft_stats(self):
+        # Time to first token over the last turns, in milliseconds.
+        times = sorted(self.first_token_times)
+        if not times:
+            return {'turns': 0, 'last_ms': 0.0, 'p50_ms': 0.0, 'p95_ms': 0.0}
+        return {
+            'turns': len(times),
+            'last_ms': self.first_token_times[-1] * 1000,
+            'p50_ms': times[(len(times) - 1) // 2] * 1000,
+            'p95_ms': times[min(len(times) - 1, int(len(times) * 0.95))] * 1000,
+        }
+
     def generate_activities(self, mood_score, recent_activities=None):
         try:
             mood_type = "low" if mood_score < 0.3 else "neutral" if mood_score < 0.7 else "positive"
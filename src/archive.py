@@ -0,0 +1,126 @@
+# Cold storage for chat_history and mood_tracking.
+# Rows older than the archive horizon are moved, a whole month at a time,
+# into one SQLite file per month next to the live database
+# (archive/<name>-YYYY-MM.db). The live database keeps an index of those
+# segments in archive_segments, which is what readers consult to find them.
+
+import os
+import sqlite3
+import migrations
+
+# Columns copied into the archive, in order. Anything else a table carries
+# (e.g. columns left in databases made by older versions of the app)
+# stays behind.
+ARCHIVED_COLUMNS = {
+    'chat_history': ('id', 'timestamp', 'ts_epoch', 'day_key', 'message', 'response', 'sentiment_score'),
+    'mood_tracking': ('id', 'timestamp', 'ts_epoch', 'day_key', 'mood_score', 'notes'),
+}
+
+COPY_BATCH_SIZE = 5000
+
+def partition_path(db_path, month, archive_dir='archive'):
+    directory = os.path.join(os.path.dirname(db_path) or '.', archive_dir)
+    name = os.path.splitext(os.path.basename(db_path))[0]
+    return os.path.join(directory, f"{name}-{month}.db")
+
+def next_month(month):
+    year, number = int(month[:4]), int(month[5:7])
+    year, number = (year + 1, 1) if number == 12 else (year, number + 1)
+    return f"{year:04d}-{number:02d}"
+
+def _create_partition(conn):
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chat_history (
+            id INTEGER PRIMARY KEY,
+            timestamp TEXT,
+            ts_epoch INTEGER,
+            day_key TEXT,
+            message TEXT,
+            response TEXT,
+            sentiment_score REAL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS mood_tracking (
+            id INTEGER PRIMARY KEY,
+            timestamp TEXT,
+            ts_epoch INTEGER,
+            day_key TEXT,
+            mood_score REAL,
+            notes TEXT
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_history_day_key ON chat_history (day_key, ts_epoch)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_mood_tracking_day_key ON mood_tracking (day_key, ts_epoch)')
+    conn.commit()
+    if migrations.fts5_available(conn):
+        # Same external-content index and triggers as the live chat_history.
+        migrations._create_chat_search(conn, None)
+
+def open_partition(path):
+    # Read-write connection to a month file, creating it on first use.
+    created = not os.path.exists(path)
+    if created:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    if created:
+        _create_partition(conn)
+    return conn
+
+def open_partition_readonly(path):
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+def archivable_months(conn, table, before_day_key):
+    # Months with rows in `table` dated before before_day_key, oldest first.
+    return [row[0] for row in conn.execute(f'''
+        SELECT DISTINCT substr(day_key, 1, 7)
+        FROM {table}
+        WHERE day_key < ?
+        ORDER BY 1
+    ''', (before_day_key,))]
+
+def copy_month(conn, partition, table, month):
+    # Copies one month of `table` into the partition and commits it there.
+    # Returns the highest id copied (None if there was nothing to copy), so
+    # the caller deletes exactly those rows from the live table. Archived
+    # rows never change, so a re-run after an interrupted move just skips
+    # the ids it already has.
+    columns = ', '.join(ARCHIVED_COLUMNS[table])
+    placeholders = ', '.join('?' * len(ARCHIVED_COLUMNS[table]))
+    source = conn.execute(f'''
+        SELECT {columns}
+        FROM {table}
+        WHERE day_key >= ? AND day_key < ?
+        ORDER BY id
+    ''', (f"{month}-01", f"{next_month(month)}-01"))
+    max_id = None
+    while True:
+        rows = source.fetchmany(COPY_BATCH_SIZE)
+        if not rows:
+            break
+        partition.executemany(f'INSERT OR IGNORE INTO {table} ({columns}) VALUES ({placeholders})', rows)
+        max_id = rows[-1][0]
+    partition.commit()
+    return max_id
+
+def describe_segment(partition, table):
+    return partition.execute(f'''
+        SELECT COUNT(*), MIN(id), MAX(id), MIN(day_key), MAX(day_key)
+        FROM {table}
+    ''').fetchone()
+
+def segments(conn, table, newest_first=False):
+    # [(month, path, row_count, min_id, max_id)] for one archived table.
+    order = 'DESC' if newest_first else 'ASC'
+    return conn.execute(f'''
+        SELECT month, path, row_count, min_id, max_id
+        FROM archive_segments
+        WHERE table_name = ?
+        ORDER BY month {order}
+    ''', (table,)).fetchall()
+
+def archived_months(conn, table):
+    return {row[0] for row in conn.execute(
+        'SELECT month FROM archive_segments WHERE table_name = ?', (table,)
+    )}
@@ -0,0 +1,82 @@
+# Read-through cache for Database query methods.
+# Entries are keyed on (method, arguments) and remember which tables they
+# were computed from; a write to one of those tables drops them. Entries
+# also expire when the local day changes, since "today" and "this week"
+# queries depend on the date as well as the data.
+
+import threading
+from collections import OrderedDict
+
+class QueryCache:
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (value, tables, day_key)
+        self._generations = {}          # table -> write counter
+        self._epoch = 0                 # bumped by clear()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.expirations = 0
+
+    def generation(self, tables):
+        # Snapshot taken before computing a value; put() refuses to store it
+        # if any of the tables was written in the meantime.
+        with self._lock:
+            return self._snapshot(tables)
+
+    def _snapshot(self, tables):
+        return (self._epoch,) + tuple(self._generations.get(table, 0) for table in tables)
+
+    def get(self, key, day_key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, _, entry_day = entry
+                if entry_day == day_key:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value, tables, day_key, generation):
+        with self._lock:
+            if self._snapshot(tables) != generation:
+                return
+            self._entries[key] = (value, frozenset(tables), day_key)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tables):
+        tables = set(tables)
+        if not tables:
+            return
+        with self._lock:
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+            stale = [key for key, (_, deps, _) in self._entries.items() if deps & tables]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits / lookups) if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'expirations': self.expirations,
+            }
@@ -11,3 +11,128 @@ OLLAMA_HOST = 'https://ollama-h2.pranavv.co.in'
 # OR (Incase you want a lighter model):
 # ollama pull qwen2.5:1.5b
 AI_MODEL = 'qwen2.5:3b'
+
+# Streaming chat replies (see AIHelper.stream_response). Tokens are appended
+# to the chat pane at most every flush_interval seconds; the time to the
+# first token is kept for the last ttft_history turns and shown by /perf.
+AI_STREAM = {
+    'enabled': True,
+    'flush_interval': 0.05,
+    'ttft_history': 100,
+}
+
+# Sentiment of chat messages (see sentiment.py). With combined on, the chat
+# reply and the message's sentiment come from one LLM call (the model appends
+# a sentiment trailer to its reply); turns where the trailer is missing fall
+# back to a separate SentimentAnalyzer call. With it off, that call runs
+# alongside the reply on a worker thread.
+# With local_first on, messages are scored with VADER and TextBlob first and
+# only go to the LLM (trailer or separate call) when the local result is
+# unsure: VADER's |compound| (0-1) is below local_confidence, or the two
+# scores (both mapped to 0-1) differ by more than max_disagreement.
+AI_SENTIMENT = {
+    'combined': True,
+    'local_first': True,
+    'local_confidence': 0.5,
+    'max_disagreement': 0.3,
+}
+
+# Cache of LLM sentiment results (see sentiment_cache.py), keyed on the
+# normalized message, AI_MODEL and the prompt version. max_entries are kept
+# in memory; with a path, up to max_persisted also go to that SQLite file and
+# survive restarts (path None keeps the cache in memory only).
+SENTIMENT_CACHE = {
+    'enabled': True,
+    'max_entries': 512,
+    'path': 'sentiment_cache.db',
+    'max_persisted': 10000,
+}
+
+# SQLite connection profile used by database.py.
+# WAL lets the chat worker and the UI read while the other one writes.
+DB_PROFILE = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 64 * 1024 * 1024,  # bytes
+    'cache_size': -16000,           # negative = size in KiB
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5.0,            # seconds SQLite itself waits on a lock
+    'busy_retries': 5,              # extra attempts after that, with backoff
+    'busy_backoff': 0.05,           # first retry delay in seconds, doubled each time
+}
+
+# Connection pool limits (see pool.py). Idle connections are closed after
+# idle_timeout seconds; checkouts held longer than leak_timeout are reported
+# (once each, checked whenever a connection is checked out or returned).
+DB_POOL = {
+    'max_size': 8,
+    'idle_timeout': 60.0,
+    'checkout_timeout': 10.0,
+    'leak_timeout': 30.0,
+}
+
+# Write-behind queue for inserts (see writer.py). Queued writes are
+# committed together once max_batch statements are waiting or max_delay
+# seconds have passed, whichever comes first.
+DB_WRITE_BEHIND = {
+    'enabled': True,
+    'max_batch': 256,
+    'max_delay': 0.05,
+}
+
+# Read-through cache for Database query methods (see cache.py).
+DB_CACHE = {
+    'enabled': True,
+    'max_entries': 256,
+}
+
+# Per-user database shards (see shards.py). When enabled, each user gets
+# their own database file under root instead of the shared database.db.
+# Off by default so an existing database.db keeps being used.
+DB_SHARDS = {
+    'enabled': False,
+    'root': 'users',
+    'max_open': 16,          # shards kept open at once (LRU)
+    'idle_timeout': 300.0,   # seconds before an unused shard is closed
+    'max_workers': 4,        # threads for cross-shard queries
+}
+
+# Cold storage for old chats and mood entries (see archive.py). /archive
+# moves whole months older than horizon_days out of the live database into
+# one file per month under <database dir>/<dir>.
+DB_ARCHIVE = {
+    'horizon_days': 180,
+    'dir': 'archive',
+}
+
+# Opt-in query profiler (see profiler.py). Statements slower than slow_ms
+# are logged with their query plan; /perf and shutdown print a report.
+DB_PROFILER = {
+    'enabled': False,
+    'slow_ms': 50.0,
+    'explain': True,
+    'slow_log_size': 100,
+}
+
+# Background maintenance (see maintenance.py). Intervals are in seconds.
+# Jobs other than the backup only run once the database has seen no
+# queries for idle_after seconds. archive_interval schedules
+# Database.archive_old_rows (moving rows past DB_ARCHIVE's horizon into
+# archive files); None leaves archiving to the /archive command.
+DB_MAINTENANCE = {
+    'enabled': True,
+    'check_interval': 5.0,
+    'idle_after': 30.0,
+    'backup_interval': 6 * 3600,
+    'backup_dir': 'backups',
+    'backup_keep': 3,
+    'backup_step_pages': 64,      # pages copied per backup step
+    'backup_step_sleep': 0.01,    # pause between steps so writers get in
+    'optimize_interval': 3600,
+    'analyze_interval': 24 * 3600,
+    'vacuum_interval': 3600,
+    'vacuum_pages': 256,          # pages released per incremental vacuum
+    'vacuum_step_pages': 64,      # pages released per vacuum transaction
+    'vacuum_step_sleep': 0.01,    # pause between steps so writers get in
+    'archive_interval': None,
+}
@@ -1,79 +1,328 @@
+import os
+import shutil
 import sqlite3
+import tempfile
+import uuid
+from contextlib import closing
 from datetime import datetime, timedelta, timezone
+import functools
+import random
+import re
 import threading
+import time
 import pytz  # type: ignore
+import archive
+import migrations
+import transfer
+from config import DB_PROFILE, DB_POOL, DB_WRITE_BEHIND, DB_CACHE, DB_ARCHIVE, DB_PROFILER
+from pool import ConnectionPool
+from profiler import Profiler, ProfilingConnection
+from writer import WriteBehindWriter
+from cache import QueryCache
+
+# Table a write statement touches, for cache invalidation.
+_WRITE_TABLE = re.compile(r'^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|UPDATE|DELETE\s+FROM)\s+(\w+)', re.IGNORECASE)
+
+# Chat search ranks only the most recent matches; ranking every hit for a
+# common word means scoring a large part of the history on each keystroke.
+SEARCH_WINDOW = 500
+
+# A token as the chat index's unicode61 tokenizer sees it: a run of letters
+# and digits; everything else (including '_') separates tokens.
+_SEARCH_TOKEN = re.compile(r'[^\W_]+')
+
+# Where Database keeps its data: 'file' is db_path itself, 'temp' a fresh
+# file in a temporary directory removed on close(), and 'memory' a private
+# in-memory database shared by all of the instance's connections.
+BACKENDS = ('file', 'temp', 'memory')
+
+def _is_busy_error(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+def retry_on_busy(method):
+    # Retries a write with exponential backoff when another connection holds
+    # the lock for longer than the busy timeout. Only the outermost call
+    # retries: a nested call runs inside its caller's transaction, so the
+    # error goes up to the caller, whose connection the pool rolls back on
+    # release before the whole operation runs again.
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if getattr(self._local, 'conn', None) is not None:
+            return method(self, *args, **kwargs)
+        delay = self.profile['busy_backoff']
+        for attempt in range(self.profile['busy_retries'] + 1):
+            try:
+                return method(self, *args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if not _is_busy_error(e) or attempt == self.profile['busy_retries']:
+                    raise
+                self._count_busy_retry()
+                time.sleep(delay)
+                delay *= 2
+    return wrapper
+
+def with_connection(method=None, *, read_only=False):
+    # Checks a connection out of the pool for the duration of the call and
+    # exposes it through _get_conn() / _get_read_conn(). Nested calls on the
+    # same thread reuse the outer checkout.
+    attr = 'read_conn' if read_only else 'conn'
+
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if getattr(self._local, attr, None) is not None:
+                return method(self, *args, **kwargs)
+            pool = self._read_pool if read_only else self._pool
+            self._last_used = time.monotonic()
+            with pool.connection() as conn:
+                setattr(self._local, attr, conn)
+                try:
+                    return method(self, *args, **kwargs)
+                finally:
+                    setattr(self._local, attr, None)
+        return wrapper
+
+    return decorate(method) if method else decorate
+
+def cached(*tables, key=None):
+    # Read-through cache for a query method that depends on `tables`.
+    # `key(self, *args)` can map arguments to a coarser cache key, e.g. a
+    # datetime to its day. Cached results are shared: treat them as read-only.
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self._cache is None:
+                return method(self, *args, **kwargs)
+            arg_key = key(self, *args, **kwargs) if key else (args, tuple(sorted(kwargs.items())))
+            cache_key = (method.__name__, arg_key)
+            day_key = self._day_key(self._get_current_time())
+            hit, value = self._cache.get(cache_key, day_key)
+            if hit:
+                return value
+            generation = self._cache.generation(tables)
+            value = method(self, *args, **kwargs)
+            self._cache.put(cache_key, value, tables, day_key, generation)
+            return value
+        return wrapper
+    return decorate
+
+def invalidates(*tables):
+    # Drops cached reads of `tables` once a synchronous write method returns.
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                if self._cache is not None:
+                    self._cache.invalidate(tables)
+        return wrapper
+    return decorate
 
 class Database:
-    def __init__(self):
+    def __init__(self, db_path='database.db', backend='file', profile=None, pool=None, write_behind=None, cache=None,
+                 archive=None, profiler=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}, expected one of {', '.join(BACKENDS)}")
         self._local = threading.local()
-        self.db_path = 'database.db'
-        self._init_db()
+        self._last_used = time.monotonic()
+        self._stats_lock = threading.Lock()
+        self._busy_retries = 0
+        self.backend = backend
+        self.db_path = db_path
+        self._uri = False
+        self._anchor = None
+        self._temp_dir = None
+        if backend == 'temp':
+            self._temp_dir = tempfile.mkdtemp(prefix='stacy-db-')
+            self.db_path = os.path.join(self._temp_dir, os.path.basename(db_path))
+        elif backend == 'memory':
+            # A named shared-cache database lives as long as one connection
+            # to it is open, so keep one aside for the instance's lifetime.
+            self.db_path = f"file:stacy-{uuid.uuid4().hex}?mode=memory&cache=shared"
+            self._uri = True
+            self._anchor = sqlite3.connect(self.db_path, uri=True, check_same_thread=False)
+        self.profile = dict(DB_PROFILE, **(profile or {}))
+        self.archive_settings = dict(DB_ARCHIVE, **(archive or {}))
+
+        profiler_settings = dict(DB_PROFILER, **(profiler or {}))
+        self._profiler = None
+        if profiler_settings.pop('enabled'):
+            self._profiler = Profiler(**profiler_settings)
+            self._profiler.instrument(self)
         self.timezone = pytz.timezone('Asia/Kolkata')
+        self._init_db()
 
-    def _get_conn(self):
-        if not hasattr(self._local, 'conn'):
-            self._local.conn = sqlite3.connect(self.db_path)
-        return self._local.conn
+        pool_settings = dict(DB_POOL, **(pool or {}))
+        self._pool = ConnectionPool(self._connect, **pool_settings)
+        self._read_pool = ConnectionPool(lambda: self._connect(read_only=True), **pool_settings)
 
-    def _init_db(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Chat history table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chat_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT,
-                message TEXT,
-                response TEXT,
-                sentiment_score REAL
-            )
-        ''')
-        
-        # Mood tracking table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS mood_tracking (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT,
-                mood_score REAL,
-                notes TEXT
+        cache_settings = dict(DB_CACHE, **(cache or {}))
+        self._cache = None
+        if cache_settings.pop('enabled'):
+            self._cache = QueryCache(**cache_settings)
+
+        writer_settings = dict(DB_WRITE_BEHIND, **(write_behind or {}))
+        self._writer = None
+        if writer_settings.pop('enabled'):
+            self._writer = WriteBehindWriter(self._write_now, **writer_settings)
+
+    def _connect(self, read_only=False):
+        # Pooled connections move between threads, but only ever one at a time.
+        # Setting a connection up can hit a lock held by another connection
+        # (on the memory backend, a shared-cache table lock, which SQLite does
+        # not wait on), so that is retried with the same backoff as writes.
+        delay = self.profile['busy_backoff']
+        for attempt in range(self.profile['busy_retries'] + 1):
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=self.profile['busy_timeout'],
+                check_same_thread=False,
+                factory=ProfilingConnection if self._profiler else sqlite3.Connection,
+                uri=self._uri
             )
-        ''')
-        
-        # Activities table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS activities (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                description TEXT,
-                points INTEGER,
-                category TEXT
+            try:
+                self._configure(conn, read_only)
+                return conn
+            except sqlite3.OperationalError as e:
+                conn.close()
+                if not _is_busy_error(e) or attempt == self.profile['busy_retries']:
+                    raise
+                self._count_busy_retry()
+                time.sleep(delay)
+                delay *= 2
+
+    def _count_busy_retry(self):
+        with self._stats_lock:
+            self._busy_retries += 1
+
+    def _configure(self, conn, read_only):
+        if self._profiler:
+            conn.profiler = self._profiler
+        cursor = conn.cursor()
+        if self.backend == 'memory':
+            # Shared-cache connections lock whole tables against each other
+            # instead of using WAL; readers skip those locks rather than
+            # failing with "database table is locked" while a write runs.
+            cursor.execute('PRAGMA read_uncommitted = ON')
+        if not read_only and self.backend != 'memory':
+            # Skipped on the memory backend: it has no file to vacuum and no
+            # WAL, and setting either takes a schema lock against other writers.
+            # auto_vacuum only takes effect while the file is still empty, so it has to
+            # come before journal_mode; existing databases are converted by
+            # enable_auto_vacuum() (the /vacuum command).
+            cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            # journal_mode is persistent, but setting it is cheap and covers
+            # databases created before WAL was enabled.
+            cursor.execute(f"PRAGMA journal_mode = {self.profile['journal_mode']}")
+        cursor.execute(f"PRAGMA synchronous = {self.profile['synchronous']}")
+        cursor.execute(f"PRAGMA mmap_size = {int(self.profile['mmap_size'])}")
+        cursor.execute(f"PRAGMA cache_size = {int(self.profile['cache_size'])}")
+        cursor.execute(f"PRAGMA temp_store = {self.profile['temp_store']}")
+        if read_only:
+            cursor.execute('PRAGMA query_only = ON')
+
+    def _get_conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            raise RuntimeError("_get_conn() used outside a @with_connection method")
+        return conn
+
+    def _get_read_conn(self):
+        # Query-only connection for analytics reads. Under WAL it reads a
+        # snapshot and never waits on the writer.
+        conn = getattr(self._local, 'read_conn', None)
+        if conn is None:
+            raise RuntimeError("_get_read_conn() used outside a @with_connection(read_only=True) method")
+        return conn
+
+    def pool_stats(self):
+        return {'write': self._pool.stats(), 'read': self._read_pool.stats()}
+
+    def busy_retries(self):
+        # Lock waits that outlasted busy_timeout and were retried (writes and
+        # connection setup).
+        with self._stats_lock:
+            return self._busy_retries
+
+    def writer_stats(self):
+        return self._writer.stats() if self._writer else None
+
+    def cache_stats(self):
+        return self._cache.stats() if self._cache else None
+
+    def profiler_stats(self):
+        return self._profiler.stats() if self._profiler else None
+
+    def perf_report(self):
+        # Profiler report (when enabled) plus pool, writer and cache counters.
+        sections = []
+        if self._profiler:
+            sections.append(self._profiler.report())
+        else:
+            sections.append("Profiling is off (set DB_PROFILER['enabled'] in config.py).")
+        pools = self.pool_stats()
+        for name in ('write', 'read'):
+            stats = pools[name]
+            sections.append(
+                f"{name.capitalize()} pool: {stats['size']}/{stats['max_size']} open, "
+                f"{stats['checkouts']} checkouts, {stats['avg_wait_ms']:.2f} ms avg wait"
             )
-        ''')
-        
-        # User progress table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_progress (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT,
-                activity_id INTEGER,
-                completed BOOLEAN,
-                points_earned INTEGER,
-                FOREIGN KEY (activity_id) REFERENCES activities (id)
+        sections.append(f"Busy retries: {self.busy_retries()}")
+        writer = self.writer_stats()
+        if writer:
+            sections.append(
+                f"Write-behind: {writer['statements']} statements in {writer['batches']} commits, "
+                f"{writer['avg_commit_ms']:.2f} ms avg commit, {writer['pending']} pending"
             )
-        ''')
-        
-        # Activity notes table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS activity_notes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                activity_id INTEGER,
-                timestamp TEXT,
-                notes TEXT,
-                FOREIGN KEY (activity_id) REFERENCES activities (id)
+        cache = self.cache_stats()
+        if cache:
+            sections.append(
+                f"Query cache: {cache['entries']} entries, {cache['hit_ratio']:.0%} hit ratio "
+                f"({cache['hits']} hits, {cache['misses']} misses)"
             )
-        ''')
-        
+        return '\n'.join(sections)
+
+    def _write_now(self, statements):
+        self._execute_writes(statements)
+        if self._cache is not None:
+            self._cache.invalidate({
+                match.group(1) for match in (_WRITE_TABLE.match(sql) for sql, _ in statements) if match
+            })
+
+    @retry_on_busy
+    @with_connection
+    def _execute_writes(self, statements):
+        conn = self._get_conn()
+        cursor = conn.cursor()
+        for sql, params in statements:
+            cursor.execute(sql, params)
+        conn.commit()
+
+    def _write(self, sql, params):
+        # Inserts that nobody reads back immediately go through the
+        # write-behind queue when it is enabled; see flush().
+        if self._writer:
+            self._writer.submit(sql, params)
+        else:
+            self._write_now([(sql, params)])
+
+    def flush(self, callback=None, timeout=None):
+        # Read-your-writes barrier for queued inserts. With a callback this
+        # returns immediately and the callback runs once they are committed.
+        if self._writer:
+            return self._writer.flush(callback, timeout)
+        if callback:
+            callback()
+        return True
+
+    def _init_db(self):
+        conn = self._connect()
+        migrations.migrate(conn, self)
+        migrations.verify_schema(conn, self)
+
+        cursor = conn.cursor()
         cursor.execute('SELECT COUNT(*) FROM activities')
         if cursor.fetchone()[0] == 0:
             self._init_default_activities(cursor)
@@ -91,9 +340,12 @@ class Database:
             ('Mood Check-in', 'Record your current mood and feelings', 5, 'tracking')
         ]
         cursor.executemany('''
-            INSERT INTO activities (name, description, points, category)
-            VALUES (?, ?, ?, ?)
-        ''', default_activities)
+            INSERT INTO activities (name, name_key, description, points, category)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [
+            (name, migrations.normalize_activity_name(name), description, points, category)
+            for name, description, points, category in default_activities
+        ])
 
     def _get_current_time(self):
         return datetime.now(self.timezone)
@@ -103,96 +355,281 @@ class Database:
             date = self.timezone.localize(date)
         return date.strftime('%Y-%m-%d %H:%M:%S')
 
+    def _localize(self, date):
+        if not date.tzinfo:
+            return self.timezone.localize(date)
+        return date.astimezone(self.timezone)
+
+    def _day_key(self, date):
+        return self._localize(date).strftime('%Y-%m-%d')
+
+    def _epoch(self, date):
+        return int(self._localize(date).timestamp())
+
+    def _time_keys(self, date):
+        # (ts_epoch, day_key) for a timestamp, stored alongside the raw text.
+        return self._epoch(date), self._day_key(date)
+
+    def _parse_db_timestamp(self, value):
+        # Older rows hold either '%Y-%m-%d %H:%M:%S' (local time) or ISO strings,
+        # with or without an offset. Naive values are treated as local time.
+        if not value:
+            return None
+        try:
+            return self._localize(datetime.fromisoformat(value))
+        except ValueError:
+            return None
+
     def add_chat_entry(self, user_message, ai_response, sentiment=0.0):
-        conn = self._get_conn()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO chat_history (timestamp, message, response, sentiment_score)
-            VALUES (?, ?, ?, ?)
-        ''', (self._get_current_time().isoformat(), user_message, ai_response, sentiment))
-        conn.commit()
+        now = self._get_current_time()
+        self._write('''
+            INSERT INTO chat_history (timestamp, ts_epoch, day_key, message, response, sentiment_score)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (now.isoformat(), *self._time_keys(now), user_message, ai_response, sentiment))
 
+    @cached('chat_history')
+    @with_connection
     def get_recent_chats(self, limit=10):
         conn = self._get_conn()
         cursor = conn.cursor()
         cursor.execute('''
             SELECT timestamp, message, response
             FROM chat_history
-            ORDER BY timestamp DESC
+            ORDER BY ts_epoch DESC, id DESC
             LIMIT ?
         ''', (limit,))
         return cursor.fetchall()
 
+    @invalidates('chat_history')
+    @retry_on_busy
+    @with_connection
     def clear_history(self):
+        self.flush()
         conn = self._get_conn()
         cursor = conn.cursor()
+        # Archived chats go too; the month files keep their mood rows.
+        for _, path, *_ in archive.segments(conn, 'chat_history'):
+            with closing(archive.open_partition(self._segment_path(path))) as partition:
+                partition.execute('DELETE FROM chat_history')
+                partition.commit()
+        cursor.execute("DELETE FROM archive_segments WHERE table_name = 'chat_history'")
         cursor.execute('DELETE FROM chat_history')
         conn.commit()
 
+    def _segment_path(self, path):
+        return os.path.join(os.path.dirname(self.db_path) or '.', path)
+
+    @with_connection(read_only=True)
+    def archive_segments(self, table, newest_first=False):
+        # [(month, path, row_count, min_id, max_id)] of archived months.
+        return archive.segments(self._get_read_conn(), table, newest_first)
+
+    def _row_sources(self, conn, table='chat_history', oldest_first=True):
+        # Connections holding rows of an archived table, as (conn, min_id,
+        # max_id): archived months first and the live table (`conn`,
+        # unbounded) last, or the reverse. Archived connections are closed
+        # once the caller moves on.
+        segments = archive.segments(conn, table, newest_first=not oldest_first)
+        if not oldest_first:
+            yield conn, None, None
+        for _, path, _, min_id, max_id in segments:
+            with closing(archive.open_partition_readonly(self._segment_path(path))) as partition:
+                yield partition, min_id, max_id
+        if oldest_first:
+            yield conn, None, None
+
     def get_all_chats(self):
-        conn = self._get_conn()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT timestamp, message, response
-            FROM chat_history
-            ORDER BY timestamp ASC
-        ''')
-        return cursor.fetchall()
+        return list(self.iter_chats())
+
+    def iter_chats(self, batch_size=500, after_id=None, with_ids=False):
+        # Streams the chat history oldest first, archived months included,
+        # without loading it all. Rows are (timestamp, message, response),
+        # prefixed with the id when with_ids is set. The read connection is
+        # held until the generator is exhausted or closed.
+        after_id = after_id or 0
+        with self._read_pool.connection() as conn:
+            for source, _, max_id in self._row_sources(conn):
+                if max_id is not None and max_id <= after_id:
+                    continue
+                cursor = source.cursor()
+                cursor.execute('''
+                    SELECT id, timestamp, message, response
+                    FROM chat_history
+                    WHERE id > ?
+                    ORDER BY id ASC
+                ''', (after_id,))
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield row if with_ids else row[1:]
+
+    @with_connection(read_only=True)
+    def get_chat_page(self, before_id=None, after_id=None, page_size=50):
+        # Keyset pagination over chat_history's primary key, continuing into
+        # archived months. Returns up to page_size rows of (id, timestamp,
+        # message, response), oldest first: the newest page when no bound is
+        # given, the page just older than before_id, or the page just newer
+        # than after_id.
+        conn = self._get_read_conn()
+        rows = []
+        if after_id is not None:
+            for source, _, max_id in self._row_sources(conn):
+                if max_id is not None and max_id <= after_id:
+                    continue
+                rows += source.execute('''
+                    SELECT id, timestamp, message, response
+                    FROM chat_history
+                    WHERE id > ?
+                    ORDER BY id ASC
+                    LIMIT ?
+                ''', (after_id, page_size - len(rows))).fetchall()
+                if len(rows) >= page_size:
+                    break
+            return rows
+
+        if before_id is None:
+            before_id = 2**63 - 1  # largest rowid
+        for source, min_id, _ in self._row_sources(conn, oldest_first=False):
+            if min_id is not None and min_id >= before_id:
+                continue
+            rows += source.execute('''
+                SELECT id, timestamp, message, response
+                FROM chat_history
+                WHERE id < ?
+                ORDER BY id DESC
+                LIMIT ?
+            ''', (before_id, page_size - len(rows))).fetchall()
+            if len(rows) >= page_size:
+                break
+        return rows[::-1]
+
+    def _fts_query(self, query):
+        # The query is split into tokens the way the index was, so each term
+        # is what FTS5 will actually match ("C++" is the token "c"), and each
+        # is quoted so words like NOT or NEAR are not read as operators. The
+        # last token also matches as a prefix while it is still being typed
+        # (nothing after it) and is long enough for the expansion to be worth
+        # its cost.
+        tokens = list(_SEARCH_TOKEN.finditer(query))
+        terms = ['"' + token.group() + '"' for token in tokens]
+        if tokens and len(tokens[-1].group()) >= 3 and tokens[-1].end() == len(query.rstrip()):
+            terms[-1] += '*'
+        return ' '.join(terms)
+
+    @with_connection(read_only=True)
+    def search_chats(self, query, limit=20):
+        # Ranked full-text search over messages and responses. Returns dicts
+        # with the chat id, timestamp and highlighted snippets, best first.
+        # Archived months are searched, newest first, only when the live
+        # table has fewer than `limit` matches.
+        fts_query = self._fts_query(query)
+        if not fts_query:
+            return []
+
+        results = []
+        for source, _, _ in self._row_sources(self._get_read_conn(), oldest_first=False):
+            results += self._search_source(source.cursor(), query, fts_query, limit - len(results))
+            if len(results) >= limit:
+                break
+        return results
+
+    def _search_source(self, cursor, query, fts_query, limit):
+        if cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'chat_fts'").fetchone():
+            cutoff = cursor.execute('''
+                SELECT rowid FROM chat_fts
+                WHERE chat_fts MATCH ?
+                ORDER BY rowid DESC
+                LIMIT 1 OFFSET ?
+            ''', (fts_query, SEARCH_WINDOW - 1)).fetchone()
+            cursor.execute('''
+                SELECT
+                    c.id,
+                    c.timestamp,
+                    snippet(chat_fts, 0, '[', ']', '...', 12),
+                    snippet(chat_fts, 1, '[', ']', '...', 12)
+                FROM chat_fts
+                JOIN chat_history c ON c.id = chat_fts.rowid
+                WHERE chat_fts MATCH ? AND chat_fts.rowid >= ?
+                ORDER BY rank
+                LIMIT ?
+            ''', (fts_query, cutoff[0] if cutoff else 0, limit))
+        else:
+            pattern = f"%{query.strip()}%"
+            cursor.execute('''
+                SELECT id, timestamp, message, response
+                FROM chat_history
+                WHERE message LIKE ? OR response LIKE ?
+                ORDER BY id DESC
+                LIMIT ?
+            ''', (pattern, pattern, limit))
+
+        return [
+            {'id': row[0], 'timestamp': row[1], 'message': row[2], 'response': row[3]}
+            for row in cursor.fetchall()
+        ]
 
     def add_mood_entry(self, mood_score, notes=""):
-        conn = self._get_conn()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO mood_tracking (timestamp, mood_score, notes)
-            VALUES (?, ?, ?)
-        ''', (self._get_current_time().isoformat(), mood_score, notes))
-        conn.commit()
+        now = self._get_current_time()
+        self._write('''
+            INSERT INTO mood_tracking (timestamp, ts_epoch, day_key, mood_score, notes)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (now.isoformat(), *self._time_keys(now), mood_score, notes))
 
+    def _week_start_key(self):
+        # First day of the rolling 7-day window (today included) that the
+        # weekly stats cover, since daily_rollup is kept per day.
+        return self._day_key(self._get_current_time() - timedelta(days=6))
+
+    @cached('mood_tracking')
+    @with_connection(read_only=True)
     def get_weekly_mood_average(self):
-        conn = self._get_conn()
+        conn = self._get_read_conn()
         cursor = conn.cursor()
-        week_ago = (self._get_current_time() - timedelta(days=7)).isoformat()
         cursor.execute('''
-            SELECT AVG(mood_score)
-            FROM mood_tracking
-            WHERE timestamp > ?
-        ''', (week_ago,))
+            SELECT SUM(mood_sum) / SUM(mood_count)
+            FROM daily_rollup
+            WHERE day_key >= ? AND mood_count > 0
+        ''', (self._week_start_key(),))
         return cursor.fetchone()[0] or 0.0
 
+    @cached('mood_tracking')
+    @with_connection(read_only=True)
     def get_daily_mood_average(self):
-        conn = self._get_conn()
+        conn = self._get_read_conn()
         cursor = conn.cursor()
-        today = self._get_current_time().date().isoformat()
+        today = self._day_key(self._get_current_time())
         cursor.execute('''
-            SELECT AVG(mood_score)
-            FROM mood_tracking
-            WHERE date(timestamp) = ?
+            SELECT mood_sum / mood_count
+            FROM daily_rollup
+            WHERE day_key = ? AND mood_count > 0
         ''', (today,))
-        return cursor.fetchone()[0] or 0.0
+        row = cursor.fetchone()
+        return (row[0] if row else None) or 0.0
 
+    @cached('mood_tracking')
+    @with_connection(read_only=True)
     def get_mood_trend(self, days=7):
-        conn = self._get_conn()
+        conn = self._get_read_conn()
         cursor = conn.cursor()
-        start_date = (self._get_current_time() - timedelta(days=days-1)).date().isoformat()
+        start_date = self._day_key(self._get_current_time() - timedelta(days=days-1))
         
         cursor.execute('''
             SELECT 
-                date(timestamp) as day,
-                AVG(mood_score) as avg_mood,
-                COUNT(*)
-                as entries
-            FROM mood_tracking
-            WHERE date(timestamp) >= ?
-            GROUP BY date(timestamp)
-            ORDER BY date(timestamp)
+                day_key as day,
+                mood_sum / mood_count as avg_mood,
+                mood_count as entries
+            FROM daily_rollup
+            WHERE day_key >= ? AND mood_count > 0
+            ORDER BY day_key
         ''', (start_date,))
         
         return cursor.fetchall()
 
     def get_activity_recommendations(self, current_mood):
-        conn = self._get_conn()
-        cursor = conn.cursor()
-        
+        # Up to three activities picked at random on every call; only the
+        # lookups they are picked from are cached.
         # recommendations based on mood
         if current_mood < 0.3:  # Low mood
             category = 'mindfulness'
@@ -201,98 +638,167 @@ class Database:
         else:  # Good mood
             category = 'reflection'
             
+        candidates = self._activities_in_category(category)
+        recommendations = random.sample(candidates, min(3, len(candidates)))
+        return recommendations, self._recent_activity_names()
+
+    @cached('activities')
+    @with_connection
+    def _activities_in_category(self, category):
+        conn = self._get_conn()
+        cursor = conn.cursor()
         cursor.execute('''
             SELECT DISTINCT a.name, a.description, a.points
             FROM activities a
             WHERE a.category = ?
-            ORDER BY RANDOM()
-            LIMIT 3
         ''', (category,))
-        
-        recommendations = cursor.fetchall()
-        
+        return cursor.fetchall()
+
+    @cached('activities', 'user_progress')
+    @with_connection
+    def _recent_activity_names(self):
+        conn = self._get_conn()
+        cursor = conn.cursor()
         # recently completed activities
+        week_ago = self._epoch(self._get_current_time() - timedelta(days=7))
         cursor.execute('''
-            SELECT DISTINCT a.name
+            SELECT a.name
             FROM user_progress p
             JOIN activities a ON p.activity_id = a.id
-            WHERE p.timestamp > datetime('now', '-7 days')
-            ORDER BY p.timestamp DESC
+            WHERE p.ts_epoch > ?
+            GROUP BY a.name
+            ORDER BY MAX(p.ts_epoch) DESC
             LIMIT 5
-        ''')
-        recent = [row[0] for row in cursor.fetchall()]
-        
-        return recommendations, recent
+        ''', (week_ago,))
+        return [row[0] for row in cursor.fetchall()]
+
+    @cached('activities')
+    @with_connection
+    def get_activities(self):
+        conn = self._get_conn()
+        cursor = conn.cursor()
+        cursor.execute('SELECT name, description, points FROM activities')
+        return cursor.fetchall()
 
-    def add_generated_activity(self, activity_dict):
+    def get_activity_names(self):
+        return [name for name, _, _ in self.get_activities()]
+
+    @cached('activities', 'user_progress')
+    @with_connection
+    def is_activity_completed(self, activity_name):
         conn = self._get_conn()
         cursor = conn.cursor()
         cursor.execute('''
-            INSERT INTO activities (name, description, points, category)
-            VALUES (?, ?, ?, ?)
+            SELECT COUNT(*) FROM user_progress p
+            JOIN activities a ON p.activity_id = a.id
+            WHERE a.name_key = ? AND p.day_key = ?
+        ''', (migrations.normalize_activity_name(activity_name), self._day_key(self._get_current_time())))
+        return cursor.fetchone()[0] > 0
+
+    @invalidates('activities')
+    @retry_on_busy
+    @with_connection
+    def add_generated_activity(self, activity_dict, update=True):
+        # Upsert into the catalog: an activity that already exists under the
+        # same normalized name gets the latest description and points, and
+        # keeps its id (and category, which the rollups are keyed on). With
+        # update=False an existing entry is left as it is.
+        conn = self._get_conn()
+        cursor = conn.cursor()
+        name_key = migrations.normalize_activity_name(activity_dict['name'])
+        on_conflict = (
+            'DO UPDATE SET description = excluded.description, points = excluded.points'
+            if update else 'DO NOTHING'
+        )
+        cursor.execute(f'''
+            INSERT INTO activities (name, name_key, description, points, category)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (name_key) {on_conflict}
         ''', (
             activity_dict['name'],
+            name_key,
             activity_dict['description'],
             activity_dict['points'],
             activity_dict['category']
         ))
+        cursor.execute('SELECT id FROM activities WHERE name_key = ?', (name_key,))
+        activity_id = cursor.fetchone()[0]
         conn.commit()
-        return cursor.lastrowid
+        return activity_id
 
-    def complete_activity(self, activity_name):
+    @retry_on_busy
+    @with_connection
+    def complete_activity(self, activity_name, points=None, details=None):
+        # `points` overrides the catalog value for this completion (e.g. a
+        # meditation scored on duration); `details` is stored with it.
         conn = self._get_conn()
         cursor = conn.cursor()
         
         now = self._get_current_time()
-        print(f"Completing activity at: {now.strftime('%Y-%m-%d %H:%M:%S %Z')}")
-        
         cursor.execute('''
-            SELECT id, points FROM activities WHERE name = ?
-        ''', (activity_name,))
+            SELECT id, points FROM activities WHERE name_key = ?
+        ''', (migrations.normalize_activity_name(activity_name),))
         activity = cursor.fetchone()
         if activity:
-            activity_id, points = activity
+            activity_id, catalog_points = activity
+            if points is None:
+                points = catalog_points
             timestamp = now.strftime('%Y-%m-%d %H:%M:%S')
-            cursor.execute('''
-                INSERT INTO user_progress (timestamp, activity_id, completed, points_earned)
-                VALUES (?, ?, ?, ?)
-            ''', (timestamp, activity_id, True, points))
-            conn.commit()
+            self._write('''
+                INSERT INTO user_progress (timestamp, ts_epoch, day_key, activity_id, completed, points_earned, details)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (timestamp, *self._time_keys(now), activity_id, True, points, details))
             return points
         return 0
 
+    @cached('user_progress')
+    @with_connection(read_only=True)
     def get_total_points(self):
-        conn = self._get_conn()
+        conn = self._get_read_conn()
         cursor = conn.cursor()
-        cursor.execute('SELECT SUM(points_earned) FROM user_progress')
+        cursor.execute('SELECT SUM(points) FROM daily_rollup')
         return cursor.fetchone()[0] or 0
 
+    @cached('activities', 'user_progress')
+    @with_connection(read_only=True)
     def get_weekly_progress(self):
-        conn = self._get_conn()
+        conn = self._get_read_conn()
         cursor = conn.cursor()
-        week_ago = (self._get_current_time() - timedelta(days=7)).isoformat()
         cursor.execute('''
-            SELECT a.name, COUNT(*), SUM(p.points_earned)
-            FROM user_progress p
-            JOIN activities a ON p.activity_id = a.id
-            WHERE p.timestamp > ?
+            SELECT a.name, SUM(r.completions), SUM(r.points)
+            FROM daily_activity_rollup r
+            JOIN activities a ON r.activity_id = a.id
+            WHERE r.day_key >= ?
             GROUP BY a.name
-        ''', (week_ago,))
+        ''', (self._week_start_key(),))
         return cursor.fetchall()
 
-    def add_activity_note(self, activity_name, notes):
+    @retry_on_busy
+    @with_connection
+    def add_activity_note(self, activity_name, notes, progress_id=None):
+        # Without a progress_id the note goes on today's latest completion of
+        # the activity, resolved when the insert runs so that it also works
+        # for a completion still sitting in the write-behind queue.
         conn = self._get_conn()
         cursor = conn.cursor()
-        cursor.execute('SELECT id FROM activities WHERE name = ?', (activity_name,))
+        cursor.execute('SELECT id FROM activities WHERE name_key = ?', (migrations.normalize_activity_name(activity_name),))
         activity_id = cursor.fetchone()[0]
-        cursor.execute('''
-            INSERT INTO activity_notes (activity_id, timestamp, notes)
-            VALUES (?, ?, ?)
-        ''', (activity_id, self._get_current_time().isoformat(), notes))
-        conn.commit()
+        now = self._get_current_time()
+        ts_epoch, day_key = self._time_keys(now)
+        self._write('''
+            INSERT INTO activity_notes (activity_id, progress_id, timestamp, ts_epoch, day_key, notes)
+            VALUES (?, COALESCE(?, (
+                SELECT id FROM user_progress
+                WHERE activity_id = ? AND day_key = ?
+                ORDER BY ts_epoch DESC, id DESC
+                LIMIT 1
+            )), ?, ?, ?, ?)
+        ''', (activity_id, progress_id, activity_id, day_key, now.isoformat(), ts_epoch, day_key, notes))
 
+    @cached('activities', 'user_progress')
+    @with_connection(read_only=True)
     def get_weekly_activities(self):
-        conn = self._get_conn()
+        conn = self._get_read_conn()
         cursor = conn.cursor()
         
         today = self._get_current_time()
@@ -300,96 +806,83 @@ class Database:
             hour=0, minute=0, second=0, microsecond=0, tzinfo=None
         )
         
-        print(f"Start of week: {start_of_week.strftime('%Y-%m-%d %H:%M:%S')}")
-        
+        return self._get_activities_by_day(
+            cursor, start_of_week.strftime('%Y-%m-%d'), today.strftime('%Y-%m-%d')
+        )
+
+    def _get_activities_by_day(self, cursor, start_day, end_day):
+        # Completed activity names keyed by weekday (0 = Monday), for the
+        # inclusive day_key range [start_day, end_day].
         cursor.execute('''
-            WITH RECURSIVE dates(date) AS (
-                SELECT date(?)
-                UNION ALL
-                SELECT date(date, '+1 day')
-                FROM dates
-                WHERE date < date(?, '+6 day')
-            )
-            SELECT 
-                CAST(strftime('%w', d.date) AS INTEGER) AS day_index,
-                GROUP_CONCAT(a.name) as activities
-            FROM dates d
-            LEFT JOIN user_progress p ON date(p.timestamp) = d.date
-            LEFT JOIN activities a ON p.activity_id = a.id
-            WHERE d.date <= date(?)
-            GROUP BY d.date
-            ORDER BY d.date
-        ''', (start_of_week.strftime('%Y-%m-%d'), 
-              start_of_week.strftime('%Y-%m-%d'),
-              today.strftime('%Y-%m-%d')))
+            SELECT p.day_key, a.name
+            FROM user_progress p
+            JOIN activities a ON p.activity_id = a.id
+            WHERE p.day_key BETWEEN ? AND ?
+            ORDER BY p.day_key, p.ts_epoch
+        ''', (start_day, end_day))
         
         activities_by_day = {}
-        for day, activities in cursor.fetchall():
-            # convert Sunday from 0 to 6
-            day_index = 6 if day == 0 else day - 1
-            print(f"Day {day_index} ({day}): {activities}")
-            if activities:
-                activities_by_day[day_index] = activities.split(',')
+        for day_key, name in cursor.fetchall():
+            day_index = datetime.strptime(day_key, '%Y-%m-%d').weekday()
+            activities_by_day.setdefault(day_index, []).append(name)
         
         return activities_by_day
 
+    @cached('user_progress')
+    @with_connection(read_only=True)
     def get_weekly_activity_count(self):
-        conn = self._get_conn()
+        conn = self._get_read_conn()
         cursor = conn.cursor()
-        week_ago = (self._get_current_time() - timedelta(days=7)).isoformat()
         cursor.execute('''
-            SELECT COUNT(*)
-            FROM user_progress
-            WHERE timestamp > ?
-        ''', (week_ago,))
+            SELECT SUM(activity_count)
+            FROM daily_rollup
+            WHERE day_key >= ?
+        ''', (self._week_start_key(),))
         return cursor.fetchone()[0] or 0
 
+    @cached('activities', 'user_progress', 'activity_notes')
+    @with_connection
     def get_todays_activities(self):
         conn = self._get_conn()
         cursor = conn.cursor()
         
-        today_start = self._get_current_time().replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
-        today_end = self._get_current_time().replace(hour=23, minute=59, second=59, microsecond=999999).isoformat()
+        today = self._day_key(self._get_current_time())
         
         cursor.execute('''
             SELECT 
                 a.name,
                 a.category,
                 p.points_earned,
-                n.notes,
+                (SELECT GROUP_CONCAT(n.notes, '; ') FROM activity_notes n WHERE n.progress_id = p.id),
                 p.timestamp
             FROM user_progress p
             JOIN activities a ON p.activity_id = a.id
-            LEFT JOIN activity_notes n ON n.activity_id = a.id 
-                AND datetime(n.timestamp) BETWEEN datetime(?) AND datetime(?)
-            WHERE datetime(p.timestamp) BETWEEN datetime(?) AND datetime(?)
-            ORDER BY p.timestamp DESC
-        ''', (today_start, today_end, today_start, today_end))
+            WHERE p.day_key = ?
+            ORDER BY p.ts_epoch DESC
+        ''', (today,))
         
         return cursor.fetchall()
 
+    @cached('activities', 'user_progress', 'activity_notes', key=lambda self, date: self._day_key(date))
+    @with_connection
     def get_day_activities(self, date):
         conn = self._get_conn()
         cursor = conn.cursor()
         
-        if not date.tzinfo:
-            date = self.timezone.localize(date)
-        date = date.replace(tzinfo=None)
-        
         cursor.execute('''
             SELECT 
                 p.id,
                 a.name,
                 a.category,
                 p.points_earned as points,
-                n.notes,
-                p.timestamp
+                (SELECT GROUP_CONCAT(n.notes, '; ') FROM activity_notes n WHERE n.progress_id = p.id) as notes,
+                p.timestamp,
+                p.details
             FROM user_progress p
             JOIN activities a ON p.activity_id = a.id
-            LEFT JOIN activity_notes n ON n.activity_id = a.id 
-            WHERE date(p.timestamp) = date(?)
-            ORDER BY p.timestamp DESC
-        ''', (date.strftime('%Y-%m-%d'),))
+            WHERE p.day_key = ?
+            ORDER BY p.ts_epoch DESC
+        ''', (self._day_key(date),))
         
         activities = []
         for row in cursor.fetchall():
@@ -399,48 +892,389 @@ class Database:
                 'category': row[2],
                 'points': row[3],
                 'notes': row[4],
-                'timestamp': row[5]
+                'timestamp': row[5],
+                'details': row[6]
             })
         return activities
 
+    @invalidates('user_progress', 'activity_notes', 'mood_tracking')
+    @retry_on_busy
+    @with_connection
     def delete_activity(self, progress_id, date):
+        self.flush()
         conn = self._get_conn()
         cursor = conn.cursor()
 
         cursor.execute('BEGIN TRANSACTION')
         try:
             cursor.execute('''
-                SELECT points_earned, activity_id
+                SELECT points_earned
                 FROM user_progress
                 WHERE id = ?
             ''', (progress_id,))
-            points, activity_id = cursor.fetchone()
+            points, = cursor.fetchone()
 
+            cursor.execute('DELETE FROM activity_notes WHERE progress_id = ?', (progress_id,))
             cursor.execute('DELETE FROM user_progress WHERE id = ?', (progress_id,))
 
-            cursor.execute('''
-                DELETE FROM activity_notes 
-                WHERE activity_id = ? AND date(timestamp) = date(?)
-            ''', (activity_id, date.isoformat()))
+            day_key = self._day_key(date)
 
             cursor.execute('''
                 UPDATE mood_tracking
                 SET mood_score = mood_score - ?
-                WHERE date(timestamp) = date(?)
-            ''', (points * 0.01, date.isoformat()))  # adjust mood
+                WHERE day_key = ?
+            ''', (points * 0.01, day_key))  # adjust mood
             
             conn.commit()
         except Exception as e:
             conn.rollback()
             raise e
 
+    @invalidates('user_progress', 'mood_tracking')
+    @retry_on_busy
+    @with_connection
+    def rebuild_rollups(self):
+        # Reconciles daily_rollup / daily_activity_rollup with the raw tables
+        # and returns the number of days that had drifted.
+        self.flush()
+        conn = self._get_conn()
+        return migrations.rebuild_rollups(conn, archive.archived_months(conn, 'mood_tracking'))
+
+    @invalidates('chat_history', 'mood_tracking')
+    @retry_on_busy
+    @with_connection
+    def archive_old_rows(self, horizon_days=None):
+        # Moves chats and mood entries from whole months that ended more than
+        # horizon_days ago into the monthly archive files. Returns
+        # {table: rows moved}. Safe to re-run after an interruption.
+        if self.backend == 'memory':
+            raise RuntimeError("Archiving needs a file-backed database")
+        self.flush()
+        if horizon_days is None:
+            horizon_days = self.archive_settings['horizon_days']
+        cutoff = self._day_key(self._get_current_time() - timedelta(days=horizon_days))
+        before = cutoff[:7] + '-01'
+
+        conn = self._get_conn()
+        moved = {}
+        for table in archive.ARCHIVED_COLUMNS:
+            moved[table] = 0
+            for month in archive.archivable_months(conn, table, before):
+                moved[table] += self._archive_month(conn, table, month)
+        return moved
+
+    def _archive_month(self, conn, table, month):
+        # Copy first, then delete and record the segment in one transaction,
+        # so readers see each row in exactly one place once it commits.
+        path = archive.partition_path(self.db_path, month, self.archive_settings['dir'])
+        with closing(archive.open_partition(path)) as partition:
+            max_id = archive.copy_month(conn, partition, table, month)
+            if max_id is None:
+                return 0
+            row_count, min_id, segment_max_id, min_day, max_day = archive.describe_segment(partition, table)
+
+        start, end = f"{month}-01", f"{archive.next_month(month)}-01"
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            if table == 'mood_tracking':
+                # The rollup triggers would subtract the archived moods from
+                # daily_rollup; archived days keep counting towards stats.
+                cursor.execute('DROP TABLE IF EXISTS temp.archived_rollup')
+                cursor.execute('''
+                    CREATE TEMP TABLE archived_rollup AS
+                    SELECT * FROM daily_rollup WHERE day_key >= ? AND day_key < ?
+                ''', (start, end))
+            cursor.execute(f'''
+                DELETE FROM {table}
+                WHERE day_key >= ? AND day_key < ? AND id <= ?
+            ''', (start, end, max_id))
+            moved = cursor.rowcount
+            if table == 'mood_tracking':
+                cursor.execute('INSERT OR REPLACE INTO daily_rollup SELECT * FROM temp.archived_rollup')
+                cursor.execute('DROP TABLE temp.archived_rollup')
+            cursor.execute('''
+                INSERT OR REPLACE INTO archive_segments
+                    (table_name, month, path, row_count, min_id, max_id, min_day, max_day, archived_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                table, month, os.path.relpath(path, os.path.dirname(self.db_path) or '.'),
+                row_count, min_id, segment_max_id, min_day, max_day,
+                datetime.now(timezone.utc).isoformat()
+            ))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Archived {moved} row(s) of {table} for {month}")
+        return moved
+
+    def _table_columns(self, conn, table):
+        # {column: declared type} of a live table.
+        return {row[1]: row[2] or '' for row in conn.execute(f'PRAGMA table_info({table})')}
+
+    def _iter_table(self, conn, table, columns):
+        # All rows of `table`, archived months included, in id order per source.
+        if table in archive.ARCHIVED_COLUMNS:
+            sources = self._row_sources(conn, table)
+        else:
+            sources = [(conn, None, None)]
+        for source, _, _ in sources:
+            cursor = source.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id")
+            while True:
+                rows = cursor.fetchmany(transfer.BATCH_SIZE)
+                if not rows:
+                    break
+                yield from rows
+
+    @with_connection(read_only=True)
+    def export_data(self, directory, fmt='ndjson'):
+        # Writes one <table>.<fmt> file per table into `directory` and
+        # returns {table: rows written}. All tables are read from a single
+        # snapshot.
+        self.flush()
+        os.makedirs(directory, exist_ok=True)
+        conn = self._get_read_conn()
+        conn.execute('BEGIN')
+        counts = {}
+        for table in transfer.TRANSFER_TABLES:
+            started = time.perf_counter()
+            columns = archive.ARCHIVED_COLUMNS.get(table) or tuple(self._table_columns(conn, table))
+            counts[table] = transfer.write_rows(
+                transfer.table_path(directory, table, fmt), fmt, columns,
+                self._iter_table(conn, table, columns)
+            )
+            transfer.report('Exported', table, counts[table], time.perf_counter() - started)
+        return counts
+
+    @with_connection
+    def import_data(self, directory, fmt='ndjson'):
+        # Replaces the user's data with the <table>.<fmt> files in
+        # `directory` (tables without a file end up empty) and returns
+        # {table: rows read}.
+        files = {
+            table: transfer.table_path(directory, table, fmt)
+            for table in transfer.TRANSFER_TABLES
+            if os.path.exists(transfer.table_path(directory, table, fmt))
+        }
+        if not files:
+            raise FileNotFoundError(f"No .{fmt} table files found in {directory}")
+
+        conn = self._get_conn()
+        tables = {}
+        for table, path in files.items():
+            live = self._table_columns(conn, table)
+            numeric = {
+                column for column, declared in live.items()
+                if any(kind in declared.upper() for kind in ('INT', 'REAL', 'BOOL'))
+            }
+            tables[table] = transfer.read_batches(path, fmt, live, numeric)
+        return self.bulk_load(tables, action='Imported')
+
+    @invalidates(*transfer.TRANSFER_TABLES)
+    @with_connection
+    def bulk_load(self, tables, action='Loaded', durable=True):
+        # Replaces the user's data. `tables` maps a table name to an iterator
+        # that yields its column names first and then lists of row tuples
+        # (the shape of transfer.read_batches); tables left out end up empty.
+        # Returns {table: rows loaded}. Everything is loaded in one
+        # transaction with the tables' indexes and triggers dropped, then
+        # those are rebuilt once at the end.
+        # durable=False is for data that can simply be generated again: the
+        # load runs with synchronous = OFF and an in-memory journal, so pages
+        # are written once and never synced, and a crash mid-load can leave
+        # the file corrupt. The usual settings are restored afterwards.
+        self.flush()
+        conn = self._get_conn()
+        cursor = conn.cursor()
+        if not durable:
+            cursor.execute('PRAGMA synchronous = OFF')
+            if self.backend != 'memory':
+                # Leaving WAL needs the only connection to the file; if another
+                # is open the mode stays as it was (without waiting for it) and
+                # only syncing is skipped.
+                cursor.execute('PRAGMA busy_timeout = 0')
+                try:
+                    cursor.execute('PRAGMA journal_mode = MEMORY').fetchone()
+                except sqlite3.OperationalError:
+                    pass
+                cursor.execute(f"PRAGMA busy_timeout = {int(self.profile['busy_timeout'] * 1000)}")
+        try:
+            return self._bulk_load(conn, tables, action)
+        finally:
+            if not durable:
+                if self.backend != 'memory':
+                    cursor.execute(f"PRAGMA journal_mode = {self.profile['journal_mode']}").fetchone()
+                cursor.execute(f"PRAGMA synchronous = {self.profile['synchronous']}")
+
+    def _bulk_load(self, conn, tables, action):
+        cursor = conn.cursor()
+        placeholders = ', '.join('?' * len(transfer.TRANSFER_TABLES))
+        deferred = cursor.execute(f'''
+            SELECT type, name, sql FROM sqlite_master
+            WHERE type IN ('index', 'trigger') AND sql IS NOT NULL AND tbl_name IN ({placeholders})
+        ''', transfer.TRANSFER_TABLES).fetchall()
+        segments = [
+            (table, path) for table in archive.ARCHIVED_COLUMNS
+            for _, path, *_ in archive.segments(conn, table)
+        ]
+
+        counts = {}
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            for kind, name, _ in deferred:
+                cursor.execute(f'DROP {kind.upper()} IF EXISTS "{name}"')
+            for table in transfer.TRANSFER_TABLES:
+                cursor.execute(f'DELETE FROM {table}')
+            cursor.execute('DELETE FROM archive_segments')
+
+            # Parents first, whatever order `tables` came in.
+            for table in sorted(tables, key=transfer.TRANSFER_TABLES.index):
+                started = time.perf_counter()
+                batches = tables[table]
+                columns = next(batches)
+                counts[table] = 0
+                if not columns:
+                    continue
+                insert_sql = (
+                    f"INSERT INTO {table} ({', '.join(columns)}) "
+                    f"VALUES ({', '.join('?' * len(columns))})"
+                )
+                for rows in batches:
+                    cursor.executemany(insert_sql, rows)
+                    counts[table] += len(rows)
+                transfer.report(action, table, counts[table], time.perf_counter() - started)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        # The archived months held the data that was just replaced.
+        for table, path in segments:
+            with closing(archive.open_partition(self._segment_path(path))) as partition:
+                partition.execute(f'DELETE FROM {table}')
+                partition.commit()
+
+        # Re-running the migrations recreates the indexes and triggers they
+        # own, fills in derived columns older exports lack, and rebuilds the
+        # rollups and the search index. Anything else dropped is restored.
+        started = time.perf_counter()
+        for _, _, step in migrations.MIGRATIONS:
+            step(conn, self)
+        existing = {row[0] for row in cursor.execute('SELECT name FROM sqlite_master')}
+        for _, name, sql in deferred:
+            if name not in existing:
+                cursor.execute(sql)
+        conn.commit()
+        print(f"Rebuilt indexes, rollups and search in {time.perf_counter() - started:.2f}s")
+        return counts
+
+    def idle_seconds(self):
+        # Time since a Database method last checked out a connection.
+        return time.monotonic() - self._last_used
+
+    def backup(self, path, step_pages=64, step_sleep=0.01):
+        # Online copy through SQLite's backup API, step_pages pages at a time
+        # with a pause between steps so writers are never locked out for
+        # long. The copy is checked and only then renamed to `path`.
+        # Returns the number of pages copied.
+        self.flush()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        partial = path + '.partial'
+        pages = [0]
+
+        def progress(status, remaining, total):
+            pages[0] = total
+
+        with closing(self._connect(read_only=True)) as source, closing(sqlite3.connect(partial)) as target:
+            # Without an open read transaction each step takes a fresh one,
+            # and any commit in between restarts the copy from page 1. Under
+            # WAL, holding one snapshot for the whole copy blocks no writers.
+            source.execute('BEGIN')
+            source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            source.backup(target, pages=step_pages, progress=progress, sleep=step_sleep)
+            source.rollback()
+            result = target.execute('PRAGMA quick_check').fetchone()[0]
+        if result != 'ok':
+            os.remove(partial)
+            raise sqlite3.DatabaseError(f"Backup failed its integrity check: {result}")
+        os.replace(partial, path)
+        return pages[0]
+
+    @with_connection(read_only=True)
+    def quick_check(self):
+        # SQLite's cheaper integrity check; returns a list of problems.
+        rows = self._get_read_conn().execute('PRAGMA quick_check').fetchall()
+        return [row[0] for row in rows if row[0] != 'ok']
+
+    @retry_on_busy
+    @with_connection
+    def optimize(self, analyze=False):
+        # PRAGMA optimize only re-analyzes tables whose statistics look
+        # stale; a full ANALYZE rescans everything.
+        conn = self._get_conn()
+        conn.execute('ANALYZE' if analyze else 'PRAGMA optimize')
+        conn.commit()
+
+    @retry_on_busy
+    @with_connection
+    def incremental_vacuum(self, pages=256, step_pages=64, step_sleep=0.01):
+        # Returns up to `pages` free pages (all of them if None) to the
+        # filesystem, step_pages per transaction with a pause between steps, so the write lock is only
+        # held briefly. Does nothing until the database is in incremental
+        # auto-vacuum mode (see enable_auto_vacuum). Returns the number of
+        # pages released.
+        conn = self._get_conn()
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return 0
+        released = 0
+        while pages is None or released < pages:
+            free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if not free:
+                break
+            step = step_pages if pages is None else min(step_pages, pages - released)
+            conn.execute(f'PRAGMA incremental_vacuum({int(step)})').fetchall()
+            conn.commit()
+            released += free - conn.execute('PRAGMA freelist_count').fetchone()[0]
+            time.sleep(step_sleep)
+        return released
+
+    @with_connection
+    def auto_vacuum_enabled(self):
+        # Read on the write connection: a pooled reader can still report the
+        # mode from before enable_auto_vacuum().
+        return self._get_conn().execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+
+    @with_connection
+    def enable_auto_vacuum(self):
+        # One-off conversion of a database created before incremental
+        # auto-vacuum was enabled. It runs a full VACUUM, which rewrites the
+        # whole file and blocks every writer until it is done, so it is only
+        # run on request (the /vacuum command). Returns the number of pages
+        # the file shrank by.
+        self.flush()
+        conn = self._get_conn()
+        pages_before = conn.execute('PRAGMA page_count').fetchone()[0]
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        return pages_before - conn.execute('PRAGMA page_count').fetchone()[0]
+
     def close(self):
-        if hasattr(self._local, 'conn'):
-            self._local.conn.close()
-            del self._local.conn
+        if self._writer:
+            self._writer.close()
+        if self._profiler:
+            print(self.perf_report())
+        self._pool.close()
+        self._read_pool.close()
+        if self._anchor:
+            self._anchor.close()
+        if self._temp_dir:
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
 
+    @cached('activities', 'user_progress', key=lambda self, start_date: self._day_key(start_date))
+    @with_connection(read_only=True)
     def get_activities_for_week(self, start_date):
-        conn = self._get_conn()
+        conn = self._get_read_conn()
         cursor = conn.cursor()
         
         if not start_date.tzinfo:
@@ -449,36 +1283,14 @@ class Database:
         start_date = start_date.replace(tzinfo=None)
         end_date = (start_date + timedelta(days=6))
         
-        print(f"Fetching activities from {start_date} to {end_date}")
-        
-        cursor.execute('''
-            WITH RECURSIVE dates(date) AS (
-                SELECT date(?)
-                UNION ALL
-                SELECT date(date, '+1 day')
-                FROM dates
-                WHERE date < date(?, '+6 day')
-            )
-            SELECT 
-                CAST(strftime('%w', d.date) AS INTEGER) AS day_index,
-                GROUP_CONCAT(a.name) as activities
-            FROM dates d
-            LEFT JOIN user_progress p ON date(p.timestamp) = d.date
-            LEFT JOIN activities a ON p.activity_id = a.id
-            GROUP BY d.date
-            ORDER BY d.date
-        ''', (start_date.strftime('%Y-%m-%d'), start_date.strftime('%Y-%m-%d')))
-        
-        activities_by_day = {}
-        for day, activities in cursor.fetchall():
-            day_index = 6 if day == 0 else day - 1
-            if activities:
-                activities_by_day[day_index] = activities.split(',')
-        
-        return activities_by_day
+        return self._get_activities_by_day(
+            cursor, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+        )
 
+    @cached('user_progress', 'mood_tracking', key=lambda self, start_date: self._day_key(start_date))
+    @with_connection(read_only=True)
     def get_stats_for_week(self, start_date):
-        conn = self._get_conn()
+        conn = self._get_read_conn()
         cursor = conn.cursor()
         
         if not start_date.tzinfo:
@@ -487,25 +1299,17 @@ class Database:
         end_date = (start_date + timedelta(days=6))
         
         cursor.execute('''
-            SELECT COUNT(*) as activity_count, 
-                   SUM(points_earned) as total_points
-            FROM user_progress
-            WHERE date(timestamp) BETWEEN date(?) AND date(?)
-        ''', (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
-        
-        count_row = cursor.fetchone()
-        
-        # Get average mood
-        cursor.execute('''
-            SELECT AVG(mood_score)
-            FROM mood_tracking
-            WHERE date(timestamp) BETWEEN date(?) AND date(?)
+            SELECT SUM(activity_count) as activity_count, 
+                   SUM(points) as total_points,
+                   SUM(mood_sum) / NULLIF(SUM(mood_count), 0) as mood_avg
+            FROM daily_rollup
+            WHERE day_key BETWEEN ? AND ?
         ''', (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
         
-        mood_row = cursor.fetchone()
+        row = cursor.fetchone()
         
         return {
-            'activity_count': count_row[0] or 0,
-            'points': count_row[1] or 0,
-            'mood_avg': mood_row[0] or 0.0
+            'activity_count': row[0] or 0,
+            'points': row[1] or 0,
+            'mood_avg': row[2] or 0.0
         }
@@ -1,178 +1,296 @@
-# This is a script to generate random data after the first run of
-# this application. After the `database.db` file has been created,
-# you can run this script to generate random data to test the app.
+# Synthetic data for trying out the app and for benchmarks.
+# Generates N users x D days of activity completions, notes, mood entries and
+# chats from a seed, and loads them with Database.bulk_load(), so the data
+# always matches the app's current schema (indexes, rollups and the search
+# index are rebuilt by the migrations at the end of the load).
+#
+#   python insert.py                                   # 30 days into database.db
+#   python insert.py --days 365 --events-per-day 40 --seed 7 --db bench.db
+#   python insert.py --users 50 --days 90 --seed 7     # one shard per user
+#
+# The same seed always produces the same rows. Loading replaces the data in
+# the target database.
+#
+# The data is shaped like real usage rather than uniform noise:
+# - chats come in bursts (sessions of several messages a minute or so apart),
+#   and some days are much busier than others;
+# - activity usage is long-tailed: every user has a few favourites
+#   (Zipf-weighted) and rarely does the rest;
+# - mood is autocorrelated: each user has a baseline, each day's level
+#   drifts from the previous day's, and entries within a day wander around it.
 
-import sqlite3
+import argparse
+import itertools
+import math
+import os
 import random
-from datetime import datetime, timedelta
 import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from statistics import NormalDist
+import migrations
+import transfer
+
+ACTIVITIES = [
+    ("Morning Meditation", "Practiced mindfulness meditation for 10 minutes", 10, "mindfulness"),
+    ("Nature Walk", "Took a refreshing walk in nature", 15, "exercise"),
+    ("Gratitude Journaling", "Wrote down 3 things I'm grateful for", 10, "reflection"),
+    ("Deep Breathing", "Practiced deep breathing exercises", 5, "mindfulness"),
+    ("Social Call", "Called a friend or family member", 10, "social"),
+    ("Art Session", "Drew or painted for relaxation", 15, "creative"),
+    ("Positive Affirmations", "Practiced positive self-talk", 5, "mindfulness"),
+    ("Exercise", "Did a workout or yoga session", 20, "exercise"),
+    ("Reading", "Read a book for pleasure", 10, "mindfulness"),
+    ("Music Break", "Listened to calming music", 5, "creative")
+]
+
+CHAT_MESSAGES = [
+    "I'm feeling quite good today!",
+    "Had a challenging day at work",
+    "Feeling a bit anxious",
+    "Made progress on my goals today",
+    "Feeling motivated and energetic",
+    "Need some support today",
+    "Having a great day",
+    "Feeling stressed but managing",
+    "Today was productive",
+    "Feeling peaceful after meditation"
+]
+CHAT_RESPONSES = [f"I understand you're {message.lower()}. How can I help?" for message in CHAT_MESSAGES]
+
+ACTIVITY_NOTES = [
+    "Felt calmer afterwards",
+    "Hard to focus today",
+    "Really enjoyed this one",
+    "Shorter than planned",
+    "Want to do this more often"
+]
+
+# Share of a day's events that go to each table.
+EVENT_MIX = {
+    'mood_tracking': 0.45,
+    'user_progress': 0.25,
+    'chat_history': 0.30,
+}
+NOTE_RATE = 0.2             # completions that get a note
+CHAT_BURST_MEAN = 3.0       # messages per chat session
+CHAT_GAP_SECONDS = 60.0     # mean gap between messages in a session
+ZIPF_EXPONENT = 1.2         # activity preference; higher = fewer favourites
+MOOD_DAY_CARRY = 0.85       # how much of yesterday's mood level carries over
+MOOD_ENTRY_CARRY = 0.6      # same, between entries within a day
+BUSY_DAY_SPREAD = 0.5       # log-normal sigma of the per-day event volume
+WAKING_HOURS = (7, 23)
+
+# 'HH:MM:SS' for every second of a day, so rows are stamped without
+# building datetime objects.
+_CLOCK = [f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in range(24 * 3600)]
+# Standard normal quantiles, indexed with random(): much cheaper per row
+# than random.gauss() and plenty fine-grained for noise.
+_NORMAL_SIZE = 4096
+_NORMAL = [NormalDist().inv_cdf((i + 0.5) / _NORMAL_SIZE) for i in range(_NORMAL_SIZE)]
+
+def _rng(seed, user, stream):
+    # Independent, reproducible stream per user and table, so a table's rows
+    # do not depend on which other tables were generated or in what order.
+    return random.Random(f"{seed}:{user}:{stream}")
+
+def _poisson(rng, mean):
+    if mean <= 0:
+        return 0
+    if mean > 30:
+        return max(0, round(rng.gauss(mean, math.sqrt(mean))))
+    limit, count, product = math.exp(-mean), 0, rng.random()
+    while product > limit:
+        count += 1
+        product *= rng.random()
+    return count
+
+def _clamp(value):
+    return 0.0 if value < 0.0 else 1.0 if value > 1.0 else value
+
+def _days(timezone, days, seed, user):
+    # [(day_key, midnight epoch, utc offset, mood level, volume)] for the
+    # last `days` days, today included. The offset is taken at midnight, which
+    # is exact for zones without DST (the app's Asia/Kolkata).
+    rng = _rng(seed, user, 'days')
+    baseline = rng.uniform(0.4, 0.65)
+    level = baseline
+    today = datetime.now(timezone).date()
+    result = []
+    for n in range(days - 1, -1, -1):
+        date = today - timedelta(days=n)
+        midnight = timezone.localize(datetime(date.year, date.month, date.day))
+        # A gentle upward trend, as the app is supposed to help.
+        target = baseline + 0.15 * (days - 1 - n) / max(days - 1, 1)
+        level = _clamp(target + MOOD_DAY_CARRY * (level - target) + rng.gauss(0, 0.06))
+        volume = math.exp(rng.gauss(0, BUSY_DAY_SPREAD) - BUSY_DAY_SPREAD ** 2 / 2)
+        result.append((date.isoformat(), int(midnight.timestamp()), midnight.isoformat()[-6:], level, volume))
+    return result
+
+def _seconds_of_day(rng, count):
+    # random() scaled by hand; randint() is several times slower.
+    start, span, random = WAKING_HOURS[0] * 3600, (WAKING_HOURS[1] - WAKING_HOURS[0]) * 3600, rng.random
+    return sorted([start + int(random() * span) for _ in range(count)])
+
+def _batched(columns, days):
+    # The bulk_load() shape: column names, then lists of row tuples. `days`
+    # yields one list of rows per day.
+    yield columns
+    batch = []
+    for rows in days:
+        batch += rows
+        if len(batch) >= transfer.BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _progress_rows(days, rate, seed, user):
+    # (id, timestamp, ts_epoch, day_key, activity_id, completed, points).
+    rng = _rng(seed, user, 'user_progress')
+    ranking = list(range(1, len(ACTIVITIES) + 1))
+    rng.shuffle(ranking)
+    cumulative, total = [], 0.0
+    for rank in range(1, len(ranking) + 1):
+        total += 1 / rank ** ZIPF_EXPONENT
+        cumulative.append(total)
+    points = [None] + [activity[2] for activity in ACTIVITIES]
+    first_id = 1
+    for day_key, midnight, _, _, volume in days:
+        seconds = _seconds_of_day(rng, _poisson(rng, rate * volume))
+        activity_ids = rng.choices(ranking, cum_weights=cumulative, k=len(seconds))
+        yield [
+            (progress_id, f"{day_key} {_CLOCK[second]}", midnight + second, day_key, activity_id, 1, points[activity_id])
+            for progress_id, second, activity_id in zip(range(first_id, first_id + len(seconds)), seconds, activity_ids)
+        ]
+        first_id += len(seconds)
+
+def _mood_rows(days, rate, seed, user):
+    rng = _rng(seed, user, 'mood_tracking')
+    random = rng.random
+    mood = days[0][3] if days else 0.5
+    for day_key, midnight, offset, level, volume in days:
+        rows = []
+        for second in _seconds_of_day(rng, _poisson(rng, rate * volume)):
+            mood = level + MOOD_ENTRY_CARRY * (mood - level) + 0.08 * _NORMAL[int(random() * _NORMAL_SIZE)]
+            mood = 0.0 if mood < 0.0 else 1.0 if mood > 1.0 else mood
+            rows.append((f"{day_key}T{_CLOCK[second]}{offset}", midnight + second, day_key, mood, "Generated mood entry"))
+        yield rows
+
+def _chat_rows(days, rate, seed, user):
+    rng = _rng(seed, user, 'chat_history')
+    random = rng.random
+    last_second = WAKING_HOURS[1] * 3600 - 1
+    for day_key, midnight, offset, level, volume in days:
+        seconds = []
+        for second in _seconds_of_day(rng, _poisson(rng, rate * volume / CHAT_BURST_MEAN)):
+            # Geometric burst length with mean CHAT_BURST_MEAN, exponential gaps.
+            while True:
+                seconds.append(second)
+                second = min(last_second, second + 1 + int(-CHAT_GAP_SECONDS * math.log(1.0 - random())))
+                if random() < 1 / CHAT_BURST_MEAN:
+                    break
+        seconds.sort()
+        rows = []
+        for second in seconds:
+            n = int(random() * len(CHAT_MESSAGES))
+            sentiment = level + 0.15 * _NORMAL[int(random() * _NORMAL_SIZE)]
+            sentiment = 0.0 if sentiment < 0.0 else 1.0 if sentiment > 1.0 else sentiment
+            rows.append((f"{day_key}T{_CLOCK[second]}{offset}", midnight + second, day_key,
+                         CHAT_MESSAGES[n], CHAT_RESPONSES[n], sentiment))
+        yield rows
+
+def _note_rows(days, rate, seed, user):
+    # Replays the completions (same seed) and notes NOTE_RATE of them, so
+    # notes stay tied to their completion without holding ids in memory.
+    rng = _rng(seed, user, 'activity_notes')
+    random = rng.random
+    for (_, midnight, offset, _, _), completions in zip(days, _progress_rows(days, rate, seed, user)):
+        rows = []
+        for progress_id, _, ts_epoch, day_key, activity_id, _, _ in completions:
+            if random() < NOTE_RATE:
+                second = ts_epoch - midnight + 60 + int(random() * 1740)
+                rows.append((activity_id, progress_id, f"{day_key}T{_CLOCK[second]}{offset}", midnight + second,
+                             day_key, ACTIVITY_NOTES[int(random() * len(ACTIVITY_NOTES))]))
+        yield rows
+
+def generate_tables(timezone, days=30, events_per_day=8.0, seed=0, user=0):
+    # One user's data in the shape Database.bulk_load() takes:
+    # {table: iterator of column names, then lists of row tuples}.
+    # Rows are generated lazily, so memory use does not grow with `days`.
+    calendar = _days(timezone, days, seed, user)
+    rates = {table: events_per_day * share for table, share in EVENT_MIX.items()}
+    return {
+        'activities': _batched(
+            ('id', 'name', 'description', 'points', 'category', 'name_key'),
+            [[(i, *activity, migrations.normalize_activity_name(activity[0])) for i, activity in enumerate(ACTIVITIES, 1)]]
+        ),
+        'user_progress': _batched(
+            ('id', 'timestamp', 'ts_epoch', 'day_key', 'activity_id', 'completed', 'points_earned'),
+            _progress_rows(calendar, rates['user_progress'], seed, user)
+        ),
+        'activity_notes': _batched(
+            ('activity_id', 'progress_id', 'timestamp', 'ts_epoch', 'day_key', 'notes'),
+            _note_rows(calendar, rates['user_progress'], seed, user)
+        ),
+        'mood_tracking': _batched(
+            ('timestamp', 'ts_epoch', 'day_key', 'mood_score', 'notes'),
+            _mood_rows(calendar, rates['mood_tracking'], seed, user)
+        ),
+        'chat_history': _batched(
+            ('timestamp', 'ts_epoch', 'day_key', 'message', 'response', 'sentiment_score'),
+            _chat_rows(calendar, rates['chat_history'], seed, user)
+        ),
+    }
+
+def load_fixture(db, days=30, seed=0, events_per_day=8.0, user=0):
+    # Bulk-populates a Database (e.g. Database(backend='memory')) with
+    # generated data, replacing what it held. Returns {table: rows}. The
+    # data can be regenerated from the seed, so the load is not made durable.
+    return db.bulk_load(
+        generate_tables(db.timezone, days, events_per_day, seed, user), action='Generated', durable=False
+    )
+
+def load_database(path, days=30, seed=0, events_per_day=8.0, user=0):
+    # Generates one user's data into the database file at `path`. Returns
+    # the number of rows written. Module-level so worker processes can run it.
+    from database import Database
+    db = Database(path)
+    try:
+        return sum(load_fixture(db, days, seed, events_per_day, user).values())
+    finally:
+        db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill the app's database with reproducible synthetic data")
+    parser.add_argument('--users', type=int, default=1, help="more than one writes a shard per user")
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--events-per-day', type=float, default=8.0)
+    parser.add_argument('--seed', type=int, default=None, help="random (and printed) when left out")
+    parser.add_argument('--db', default='database.db', help="target database for a single user")
+    parser.add_argument('--shards-root', default=None, help="shard directory for several users")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="processes filling shards in parallel")
+    args = parser.parse_args()
 
-def create_database_schema():
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
-    
-    # Drop existing tables
-    cursor.execute('DROP TABLE IF EXISTS chat_history')
-    cursor.execute('DROP TABLE IF EXISTS mood_tracking')
-    cursor.execute('DROP TABLE IF EXISTS user_progress')
-    cursor.execute('DROP TABLE IF EXISTS activities')
-    
-    # Create activities table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS activities (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            description TEXT,
-            points INTEGER DEFAULT 0,
-            category TEXT
-        )
-    ''')
-    
-    # Create user_progress table - updated schema
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_progress (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            activity_id INTEGER,
-            timestamp TEXT,
-            completed BOOLEAN DEFAULT 1,
-            points_earned INTEGER DEFAULT 0,
-            notes TEXT,
-            FOREIGN KEY (activity_id) REFERENCES activities (id)
-        )
-    ''')
-    
-    # Mood Tracking Table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS mood_tracking (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            mood_score REAL,
-            notes TEXT
-        )
-    ''')
-    
-    # Create chat history table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chat_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            message TEXT,
-            response TEXT,
-            sentiment_score REAL
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-
-def generate_sample_data():
-    # Create schema first
-    create_database_schema()
-    
-    # Connect to database
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
-    
-    # Sample activities with categories
-    activities = [
-        ("Morning Meditation", "Practiced mindfulness meditation for 10 minutes", 10, "mindfulness"),
-        ("Nature Walk", "Took a refreshing walk in nature", 15, "exercise"),
-        ("Gratitude Journaling", "Wrote down 3 things I'm grateful for", 10, "reflection"),
-        ("Deep Breathing", "Practiced deep breathing exercises", 5, "mindfulness"),
-        ("Social Call", "Called a friend or family member", 10, "social"),
-        ("Art Session", "Drew or painted for relaxation", 15, "creative"),
-        ("Positive Affirmations", "Practiced positive self-talk", 5, "mindfulness"),
-        ("Exercise", "Did a workout or yoga session", 20, "exercise"),
-        ("Reading", "Read a book for pleasure", 10, "mindfulness"),
-        ("Music Break", "Listened to calming music", 5, "creative")
-    ]
-    
-    # Insert activities
-    cursor.execute('DELETE FROM activities')
-    for activity in activities:
-        cursor.execute('''
-            INSERT INTO activities (name, description, points, category)
-            VALUES (?, ?, ?, ?)
-        ''', activity)
-    
-    # Generate 30 days of data
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=30)
-    current_date = start_date
-    
-    # Clear existing data
-    cursor.execute('DELETE FROM mood_tracking')
-    cursor.execute('DELETE FROM user_progress')
-    cursor.execute('DELETE FROM chat_history')
-    
-    # Sample chat messages
-    chat_messages = [
-        "I'm feeling quite good today!",
-        "Had a challenging day at work",
-        "Feeling a bit anxious",
-        "Made progress on my goals today",
-        "Feeling motivated and energetic",
-        "Need some support today",
-        "Having a great day",
-        "Feeling stressed but managing",
-        "Today was productive",
-        "Feeling peaceful after meditation"
-    ]
-    
-    # Generate data for each day
-    while current_date <= end_date:
-        # Generate 1-3 activities per day
-        daily_activities = random.sample(activities, random.randint(1, 3))
-        for activity in daily_activities:
-            timestamp = current_date.replace(
-                hour=random.randint(8, 20),
-                minute=random.randint(0, 59)
-            )
-            
-            cursor.execute('''
-                INSERT INTO user_progress (activity_id, timestamp, completed, points_earned)
-                SELECT id, ?, 1, points
-                FROM activities
-                WHERE name = ?
-            ''', (timestamp.isoformat(), activity[0]))
-        
-        # Generate mood entries (4-6 per day to ensure enough data)
-        entry_count = random.randint(4, 6)
-        for _ in range(entry_count):
-            timestamp = current_date.replace(
-                hour=random.randint(8, 20),
-                minute=random.randint(0, 59)
-            )
-            # Generate mood score with a slight upward trend
-            base_mood = 0.5 + ((current_date - start_date).days / 60)  # Gradual improvement
-            mood_score = min(1.0, max(0.0, base_mood + random.uniform(-0.2, 0.2)))
-            
-            cursor.execute('''
-                INSERT INTO mood_tracking (timestamp, mood_score, notes)
-                VALUES (?, ?, ?)
-            ''', (timestamp.isoformat(), mood_score, "Generated mood entry"))
-        
-        # Generate chat history (1-2 per day)
-        chat_count = random.randint(1, 2)
-        for _ in range(chat_count):
-            timestamp = current_date.replace(
-                hour=random.randint(8, 20),
-                minute=random.randint(0, 59)
-            )
-            message = random.choice(chat_messages)
-            response = f"I understand you're {message.lower()}. How can I help?"
-            
-            cursor.execute('''
-                INSERT INTO chat_history (timestamp, message, response, sentiment_score)
-                VALUES (?, ?, ?, ?)
-            ''', (timestamp.isoformat(), message, response, random.uniform(0.3, 0.8)))
-        
-        current_date += timedelta(days=1)
-    
-    conn.commit()
-    conn.close()
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 31)
+    print(f"Generating {args.users} user(s) x {args.days} days x {args.events_per_day:g} events/day (seed {seed})...")
+    started = time.perf_counter()
+    if args.users == 1:
+        total = load_database(args.db, args.days, seed, args.events_per_day)
+    else:
+        # Shards are separate files, so users are generated and written in
+        # parallel processes (the generator itself is CPU-bound Python).
+        from config import DB_SHARDS
+        from shards import ShardManager
+        shards = ShardManager(args.shards_root or DB_SHARDS['root'])
+        paths = [shards.shard_path(f"user{user:05d}") for user in range(args.users)]
+        shards.close()
+        with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+            total = sum(pool.map(
+                load_database, paths, itertools.repeat(args.days), itertools.repeat(seed),
+                itertools.repeat(args.events_per_day), range(args.users)
+            ))
+    transfer.report('Generated', 'all tables', total, time.perf_counter() - started)
 
 if __name__ == "__main__":
-    print("Generating sample data...")
-    generate_sample_data()
-    print("Sample data generated successfully!")
+    main()
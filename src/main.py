@@ -3,8 +3,12 @@ import customtkinter as ctk  # type: ignore
 from tkinter import messagebox, scrolledtext
 from ai_helper import AIHelper
 from database import Database
+from shards import ShardManager
+from maintenance import MaintenanceScheduler
+from config import DB_SHARDS, DB_MAINTENANCE
 from sentiment import SentimentAnalyzer
 import threading
+from concurrent.futures import ThreadPoolExecutor
 import signal
 import sys
 from datetime import datetime, timedelta
@@ -16,6 +20,16 @@ import numpy as np
 import pytz  # type: ignore
 import time
 
+# Chats shown per /list or /more page.
+CHAT_PAGE_SIZE = 20
+
+# Catalog points of "Meditation Session" (what /complete pays for it); timed
+# sessions are scored on their own completion instead.
+MEDITATION_POINTS = 10
+
+# Seconds on_closing waits for a background database write to finish.
+SHUTDOWN_WAIT = 5
+
 class MentalHealthApp:
     def __init__(self, root):
         self.root = root
@@ -25,13 +39,30 @@ class MentalHealthApp:
         self.root.title("Stacy - AI Mental Health Assistant")
         self.root.geometry("1000x700")
         
-        self.db = Database()
+        self.username = "User"
+        self.shards = None
+        shard_settings = dict(DB_SHARDS)
+        if shard_settings.pop('enabled'):
+            self.shards = ShardManager(**shard_settings)
+            self.db = self.shards.acquire(self.username)
+        else:
+            self.db = Database()
+        self.maintenance = None
+        maintenance_settings = dict(DB_MAINTENANCE)
+        if maintenance_settings.pop('enabled'):
+            self.maintenance = MaintenanceScheduler(self.db, **maintenance_settings)
+            self.maintenance.start()
         self.ai_helper = AIHelper()
         self.ai_helper.set_database(self.db)
         self.sentiment_analyzer = SentimentAnalyzer()
+        # Sentiment calls block on the LLM; they run here, never on the Tk thread.
+        self.sentiment_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='sentiment')
+        # Pool jobs write to the database only while holding this lock and
+        # only if _closing is unset, so on_closing never closes it under them.
+        self._db_job_lock = threading.Lock()
+        self._closing = False
         
         self.current_activities = []
-        self.username = "User"
         self.current_mood = self.db.get_daily_mood_average() or 0.5
         self.detail_popup = None
         self.timezone = pytz.timezone('Asia/Kolkata')
@@ -39,6 +70,7 @@ class MentalHealthApp:
         self.meditation_timer = None
         self.meditation_start_time = None
         self.meditation_duration = 0
+        self.chat_list_oldest_id = None
         
         self.create_gui()
         self.update_stats()
@@ -48,12 +80,20 @@ class MentalHealthApp:
             '/clear': self.cmd_clear,
             '/bye': self.cmd_exit,
             '/list': self.cmd_list,
+            '/more': self.cmd_more,
+            '/search': self.cmd_search,
             '/help': self.cmd_help,
             '/stats': self.cmd_stats,
             '/activities': self.cmd_activities,
             '/complete': self.cmd_complete,
-            '/mood': self.cmd_mood
+            '/mood': self.cmd_mood,
+            '/rebuild': self.cmd_rebuild,
+            '/archive': self.cmd_archive,
+            '/vacuum': self.cmd_vacuum,
+            '/perf': self.cmd_perf
         }
+        # Commands that take the rest of the line as an argument.
+        self.arg_commands = {'/search'}
 
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
@@ -386,13 +426,18 @@ class MentalHealthApp:
             ).pack(anchor=tk.W, padx=20, pady=2)
 
     def handle_command(self, cmd):
-        if cmd in self.commands:
-            self.commands[cmd]()
+        name, _, args = cmd.partition(' ')
+        if name in self.commands:
+            if name in self.arg_commands:
+                self.commands[name](args.strip())
+            else:
+                self.commands[name]()
             return True
         return False
 
     def cmd_clear(self):
         self.db.clear_history()
+        self.chat_list_oldest_id = None
         self.chat_area.configure(state='normal')
         self.chat_area.delete('1.0', tk.END)
         self.chat_area.configure(state='disabled')
@@ -402,9 +447,39 @@ class MentalHealthApp:
         self.on_closing()
 
     def cmd_list(self):
-        history = self.db.get_all_chats()
+        # Latest page only; /more walks back through older pages.
+        page = self.db.get_chat_page(page_size=CHAT_PAGE_SIZE)
         self.display_message("System: Chat History:")
-        for timestamp, msg, resp in history:
+        self._display_chat_page(page)
+
+    def cmd_more(self):
+        if self.chat_list_oldest_id is None:
+            self.display_message("System: Use /list first to show your chat history.", 'system')
+            return
+        page = self.db.get_chat_page(before_id=self.chat_list_oldest_id, page_size=CHAT_PAGE_SIZE)
+        if not page:
+            self.display_message("System: No older messages.", 'system')
+            return
+        self.display_message("System: Older Chat History:")
+        self._display_chat_page(page)
+
+    def cmd_search(self, query):
+        if not query:
+            self.display_message("System: Usage: /search <words>", 'system')
+            return
+        results = self.db.search_chats(query, limit=CHAT_PAGE_SIZE)
+        if not results:
+            self.display_message(f"System: No chats found for '{query}'.", 'system')
+            return
+        self.display_message(f"System: Chats matching '{query}':")
+        for result in results:
+            time_str = result['timestamp'].split('.')[0].replace('T', ' ')
+            self.display_message(f"[{time_str}]")
+            self.display_message(f"You: {result['message']}")
+            self.display_message(f"AI Assistant: {result['response']}")
+
+    def _display_chat_page(self, page):
+        for _, timestamp, msg, resp in page:
             try:
                 time_str = datetime.fromisoformat(timestamp).strftime('%Y-%m-%d %H:%M:%S')
             except AttributeError: 
@@ -412,19 +487,29 @@ class MentalHealthApp:
             self.display_message(f"[{time_str}]")
             self.display_message(f"You: {msg}")
             self.display_message(f"AI Assistant: {resp}")
+        if page:
+            self.chat_list_oldest_id = page[0][0]
+            if len(page) == CHAT_PAGE_SIZE:
+                self.display_message("System: Type /more to load older messages.", 'system')
 
     # Display Commands.
     def cmd_help(self):
         help_text = """
 Available commands:
 /clear - Clear chat history
-/list  - Show chat history
+/list  - Show recent chat history
+/more  - Load older chat history
+/search <words> - Search your past chats
 /bye   - Exit application
 /help  - Show this help message
 /stats - Show weekly progress report
 /activities - List available activities
 /complete - Complete an activity
 /mood - Show current mood
+/rebuild - Recalculate stats from your full history
+/archive - Move old chats and moods to the archive
+/vacuum - Shrink the database file (slow the first time)
+/perf  - Show database performance report
         """
         self.display_message("System: " + help_text)
 
@@ -445,28 +530,36 @@ Available commands:
         threading.Thread(target=self.get_ai_response, args=(user_message,), daemon=True).start()
 
     def get_ai_response(self, user_message):
+        # Runs on a worker thread for the whole turn (AIHelper.chat_turn);
+        # only the UI updates are handed to the Tk thread. The streamed reply
+        # arrives in batches rather than per token, so Tk is not flooded.
         try:
-            ai_response = self.ai_helper.get_response(user_message)
-            
-            self.root.after(0, self.handle_ai_response, user_message, ai_response)
+            turn = self.ai_helper.chat_turn(
+                user_message, self.sentiment_analyzer, self.sentiment_pool,
+                on_start=lambda: self.root.after(0, self._begin_streamed_message),
+                on_text=lambda text: self.root.after(0, self._append_streamed_text, text),
+            )
+            self.root.after(0, self.handle_ai_response, user_message, turn['reply'], turn['streamed'],
+                            turn['sentiment'], turn['suggestions'])
         except Exception as e:
-            self.root.after(0, self.display_message, f"Error: {str(e)}")
+            if not self._closing:
+                self.root.after(0, self.display_message, f"Error: {str(e)}")
 
-    def handle_ai_response(self, user_message, ai_response):
-        sentiment_score, mood, mood_impact = self.sentiment_analyzer.analyze_sentiment(user_message)
+    def handle_ai_response(self, user_message, ai_response, streamed, sentiment, suggestions):
+        # Tk thread: `sentiment` is (score, mood, impact) and `suggestions` the
+        # activity text for low moods, both worked out by get_ai_response.
+        sentiment_score, mood, mood_impact = sentiment
         
         old_mood = self.current_mood
         self.current_mood = max(0.0, min(1.0, self.current_mood + mood_impact))
         
-        if mood == "low":
-            recommendations, recent = self.db.get_activity_recommendations(sentiment_score)
-            if recommendations:
-                ai_response += "\n\nHere are some activities that might help:"
-                for name, desc, points in recommendations:
-                    ai_response += f"\n• {name} ({points} points) - {desc}"
-        
+        ai_response += suggestions
 
-        self.display_message(ai_response, 'assistant')
+        if streamed:
+            # The reply is already on screen; finish it off.
+            self._append_streamed_text(suggestions + "\n")
+        else:
+            self.display_message(ai_response, 'assistant')
         
         if abs(mood_impact) >= 0.01:
             change_text = f"Mood {'increased' if mood_impact > 0 else 'decreased'} by {abs(mood_impact):.2f}"
@@ -476,7 +569,22 @@ Available commands:
         self.message_input.configure(state='normal')
         self.db.add_chat_entry(user_message, ai_response, sentiment_score)
         self.db.add_mood_entry(self.current_mood)
-        self.update_stats()
+        # Both inserts are committed together off the UI thread; refresh the
+        # stats once they have landed.
+        self.db.flush(callback=lambda: self.root.after(0, self.update_stats))
+
+    def _begin_streamed_message(self):
+        self.chat_area.configure(state='normal')
+        self.chat_area.insert(tk.END, "\n", 'assistant')
+        self.chat_area.insert(tk.END, "Stacy: ", 'assistant')
+        self.chat_area.see(tk.END)
+        self.chat_area.configure(state='disabled')
+
+    def _append_streamed_text(self, text):
+        self.chat_area.configure(state='normal')
+        self.chat_area.insert(tk.END, text, 'assistant')
+        self.chat_area.see(tk.END)
+        self.chat_area.configure(state='disabled')
 
     def display_message(self, message, msg_type='system'):
         self.chat_area.configure(state='normal')
@@ -574,10 +682,7 @@ Available commands:
 
     def cmd_activities(self):
         self.display_message("Available Activities:", 'system')
-        conn = self.db._get_conn()
-        cursor = conn.cursor()
-        cursor.execute('SELECT name, description, points FROM activities')
-        for name, desc, points in cursor.fetchall():
+        for name, desc, points in self.db.get_activities():
             self.display_message(f"• {name} ({points} points) - {desc}", 'system')
 
     def cmd_complete(self):
@@ -593,16 +698,13 @@ Available commands:
         activity_combobox = ctk.CTkComboBox(dialog, variable=activity_var)
         activity_combobox.pack(pady=10)
         
-        conn = self.db._get_conn()
-        cursor = conn.cursor()
-        cursor.execute('SELECT name FROM activities')
-        activities = [row[0] for row in cursor.fetchall()]
-        activity_combobox.configure(values=activities)
+        activity_combobox.configure(values=self.db.get_activity_names())
         
         def complete_activity():
             selected_activity = activity_var.get()
             if selected_activity:
                 self.db.complete_activity(selected_activity)
+                self.db.flush()
                 self.display_message(f"System: Activity '{selected_activity}' completed!", 'system')
                 self.update_stats()
                 dialog.destroy()
@@ -613,13 +715,79 @@ Available commands:
         mood_avg = self.db.get_weekly_mood_average()
         self.display_message(f"System: Your current weekly mood average is {mood_avg:.2f}", 'system')
 
+    def cmd_rebuild(self):
+        drifted = self.db.rebuild_rollups()
+        self.display_message(f"System: Stats rebuilt ({drifted} day(s) corrected).", 'system')
+        self.update_stats()
+
+    def cmd_archive(self):
+        moved = self.db.archive_old_rows()
+        self.display_message(
+            f"System: Archived {moved['chat_history']} chat(s) and {moved['mood_tracking']} mood record(s) "
+            f"older than {self.db.archive_settings['horizon_days']} days.",
+            'system'
+        )
+
+    def cmd_vacuum(self):
+        # The first run converts the database to incremental auto-vacuum with
+        # a full VACUUM; after that, maintenance releases free pages itself.
+        if self.db.auto_vacuum_enabled():
+            released = self.db.incremental_vacuum(pages=None)
+            self.display_message(f"System: Released {released} free page(s).", 'system')
+            return
+        self.display_message("System: Compacting the database, this may take a while...", 'system')
+        self.root.update_idletasks()
+        shrunk = self.db.enable_auto_vacuum()
+        self.display_message(f"System: Database compacted by {shrunk} page(s).", 'system')
+
+    def cmd_perf(self):
+        report = self.db.perf_report()
+        ttft = self.ai_helper.ttft_stats()
+        if ttft['turns']:
+            report += (
+                f"\nTime to first token: last {ttft['last_ms']:.0f} ms, p50 {ttft['p50_ms']:.0f} ms, "
+                f"p95 {ttft['p95_ms']:.0f} ms over {ttft['turns']} turn(s)"
+            )
+        tiers = self.sentiment_analyzer.tier_stats()
+        if tiers['messages']:
+            report += (
+                f"\nSentiment: {tiers['escalated']} of {tiers['messages']} message(s) sent to the AI "
+                f"({tiers['escalation_rate']:.0%}), {tiers['local']} scored locally, {tiers['cached']} from the cache"
+            )
+        cache = self.sentiment_analyzer.cache_stats()
+        if cache:
+            report += (
+                f"\nSentiment cache: {cache['entries']} entries in memory"
+                + (f", {cache['persisted']} on disk" if cache['persisted'] is not None else "")
+                + f", {cache['hit_ratio']:.0%} hit ratio ({cache['hits']} hits, {cache['misses']} misses)"
+            )
+        if self.maintenance:
+            report += "\n" + self.maintenance.report()
+        self.display_message("System: " + report, 'system')
+
     def _signal_handler(self, signum, frame):
         self.on_closing()
         sys.exit(0)
 
     def on_closing(self):
         try:
-            self.db.close()
+            # Wait (bounded) for a pool job's write in progress; jobs still
+            # running after this see _closing and leave the database alone.
+            locked = self._db_job_lock.acquire(timeout=SHUTDOWN_WAIT)
+            self._closing = True
+            if locked:
+                self._db_job_lock.release()
+            else:
+                print(f"Warning: a background database write did not finish within {SHUTDOWN_WAIT}s")
+            self.sentiment_pool.shutdown(wait=False, cancel_futures=True)
+            self.sentiment_analyzer.close()
+            if self.maintenance:
+                self.maintenance.stop(timeout=5)
+            if self.shards:
+                self.shards.release(self.username)
+                self.shards.close()
+            else:
+                self.db.close()
         except Exception as e:
             print(f"Error during shutdown: {e}")
         finally:
@@ -671,6 +839,7 @@ Available commands:
 
     def quick_complete_activity(self, activity_name):
         points = self.db.complete_activity(activity_name)
+        self.db.flush()
         messagebox.showinfo(
             "Activity Completed",
             f"Great job! You earned {points} points!"
@@ -688,17 +857,7 @@ Available commands:
         self.refresh_activities()
 
     def is_activity_completed(self, activity_name):
-        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
-        today_end = datetime.now().replace(hour=23, minute=59, second=59, microsecond=999999).isoformat()
-        
-        conn = self.db._get_conn()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT COUNT(*) FROM user_progress p
-            JOIN activities a ON p.activity_id = a.id
-            WHERE a.name = ? AND datetime(p.timestamp) BETWEEN datetime(?) AND datetime(?)
-        ''', (activity_name, today_start, today_end))
-        return cursor.fetchone()[0] > 0
+        return self.db.is_activity_completed(activity_name)
 
     def create_activity_card(self, activity):
         card = ctk.CTkFrame(self.activities_frame)
@@ -891,6 +1050,7 @@ Available commands:
             if activity:
                 activity_id = self.db.add_generated_activity(activity)
                 points = self.db.complete_activity(activity['name'])
+                self.db.flush()
                 messagebox.showinfo(
                     "Activity Logged",
                     f"Custom activity '{activity['name']}' logged! You earned {points} points!"
@@ -921,11 +1081,7 @@ Available commands:
         )
         activity_combobox.pack(pady=10)
         
-        conn = self.db._get_conn()
-        cursor = conn.cursor()
-        cursor.execute('SELECT name FROM activities')
-        activities = [row[0] for row in cursor.fetchall()]
-        activity_combobox.configure(values=activities)
+        activity_combobox.configure(values=self.db.get_activity_names())
 
         notes_frame = ctk.CTkFrame(existing_tab)
         notes_frame.pack(fill=tk.X, padx=10, pady=5)
@@ -946,6 +1102,7 @@ Available commands:
                 points = self.db.complete_activity(selected_activity)
                 if notes:
                     self.db.add_activity_note(selected_activity, notes)
+                self.db.flush()
                 messagebox.showinfo(
                     "Activity Logged",
                     f"Activity logged successfully! You earned {points} points!"
@@ -1086,6 +1243,14 @@ Weekly Stats ({start_of_week.strftime('%b %d')} - {end_of_week.strftime('%b %d')
         )
         points_label.pack(side=tk.LEFT, padx=5)
 
+        if activity['details']:
+            details_label = ctk.CTkLabel(
+                card,
+                text=activity['details'],
+                wraplength=400
+            )
+            details_label.pack(fill=tk.X, pady=(5,0), padx=10)
+
         if activity['notes']:
             notes_label = ctk.CTkLabel(
                 card,
@@ -1190,7 +1355,8 @@ Weekly Stats ({start_of_week.strftime('%b %d')} - {end_of_week.strftime('%b %d')
         def submit_feedback():
             feedback = feedback_text.get("1.0", tk.END).strip()
             if feedback:
-                self.process_meditation_feedback(feedback, meditation_time)
+                # Scoring the feedback waits on the LLM; do it off the Tk thread.
+                self.sentiment_pool.submit(self.process_meditation_feedback, feedback, meditation_time)
                 dialog.destroy()
             else:
                 messagebox.showwarning(
@@ -1205,35 +1371,45 @@ Weekly Stats ({start_of_week.strftime('%b %d')} - {end_of_week.strftime('%b %d')
         ).pack(pady=10)
 
     def process_meditation_feedback(self, feedback, duration):
-        # Analyze sentiment
-        sentiment_score, mood, _ = self.sentiment_analyzer.analyze_sentiment(feedback)
-        
-        # Calculate points based on duration and sentiment
-        # Base points: 1 point per minute
-        base_points = max(1, duration // 60)
+        # Runs on the sentiment pool; the UI is updated from the Tk thread.
+        try:
+            # Analyze sentiment
+            sentiment_score, mood, _ = self.sentiment_analyzer.analyze_sentiment(feedback)
         
-        # Sentiment multiplier: 0.8 to 1.2 based on sentiment score
-        sentiment_multiplier = 0.8 + (sentiment_score * 0.4)
+            # Calculate points based on duration and sentiment
+            # Base points: 1 point per minute
+            base_points = max(1, duration // 60)
         
-        total_points = round(base_points * sentiment_multiplier)
+            # Sentiment multiplier: 0.8 to 1.2 based on sentiment score
+            sentiment_multiplier = 0.8 + (sentiment_score * 0.4)
         
-        # Create activity description
-        minutes = duration // 60
-        seconds = duration % 60
-        description = f"Meditation session ({minutes}:{seconds:02d}). Feedback: {feedback}"
+            total_points = round(base_points * sentiment_multiplier)
         
-        # Create activity
-        activity = {
-            'name': "Meditation Session",
-            'description': description,
-            'points': total_points,
-            'category': 'mindfulness'
-        }
+            # Session details live on the completion, not on the catalog entry
+            minutes = duration // 60
+            seconds = duration % 60
+            details = f"Meditation session ({minutes}:{seconds:02d}). Feedback: {feedback}"
         
-        # Log the activity
-        activity_id = self.db.add_generated_activity(activity)
-        self.db.complete_activity(activity['name'])
+            activity = {
+                'name': "Meditation Session",
+                'description': "Timed meditation session",
+                'points': MEDITATION_POINTS,
+                'category': 'mindfulness'
+            }
         
+            # Log the activity; the catalog entry is only created once
+            with self._db_job_lock:
+                if self._closing:
+                    return
+                self.db.add_generated_activity(activity, update=False)
+                self.db.complete_activity(activity['name'], points=total_points, details=details)
+                self.db.flush()
+            self.root.after(0, self._meditation_logged, total_points)
+        except Exception as e:
+            if not self._closing:
+                self.root.after(0, messagebox.showerror, "Meditation", f"Could not log the session: {e}")
+
+    def _meditation_logged(self, total_points):
         messagebox.showinfo(
             "Meditation Complete",
             f"Great job! You earned {total_points} points for your meditation session."
@@ -0,0 +1,160 @@
+# Background maintenance for the database (see DB_MAINTENANCE in config.py).
+# A daemon thread wakes up every check_interval seconds and runs the jobs
+# that are due: an online backup of file-backed databases (which copies a
+# few pages at a time, so it may run while the app is in use), and ANALYZE /
+# PRAGMA optimize and incremental vacuum (a few pages per step; databases not
+# yet in auto-vacuum mode are left to the /vacuum command), which wait until
+# the database has been idle for idle_after seconds. Archiving old rows
+# (Database.archive_old_rows) is only scheduled when archive_interval is set.
+# Each run is timed and reported.
+
+import glob
+import os
+import threading
+import time
+from datetime import datetime
+
+class _Job:
+    def __init__(self, name, interval, run, idle_only=True, last_run=None):
+        self.name = name
+        self.interval = interval
+        self.run = run
+        self.idle_only = idle_only
+        self.last_run = last_run      # time.time() of the last run, if any
+        self.runs = 0
+        self.errors = 0
+        self.last_seconds = 0.0
+        self.total_seconds = 0.0
+        self.last_result = None
+
+    def due(self, now):
+        return self.last_run is None or now - self.last_run >= self.interval
+
+class MaintenanceScheduler:
+    def __init__(self, db, check_interval=5.0, idle_after=30.0,
+                 backup_interval=6 * 3600, backup_dir='backups', backup_keep=3,
+                 backup_step_pages=64, backup_step_sleep=0.01,
+                 optimize_interval=3600, analyze_interval=24 * 3600,
+                 vacuum_interval=3600, vacuum_pages=256, vacuum_step_pages=64, vacuum_step_sleep=0.01,
+                 archive_interval=None):
+        self.db = db
+        self.check_interval = check_interval
+        self.idle_after = idle_after
+        self.backup_dir = os.path.join(os.path.dirname(db.db_path) or '.', backup_dir)
+        self.backup_keep = backup_keep
+        self.backup_step_pages = backup_step_pages
+        self.backup_step_sleep = backup_step_sleep
+        self.vacuum_pages = vacuum_pages
+        self.vacuum_step_pages = vacuum_step_pages
+        self.vacuum_step_sleep = vacuum_step_sleep
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # The other jobs first run at the first idle spell.
+        self.jobs = [
+            _Job('optimize', optimize_interval, lambda: db.optimize()),
+            _Job('analyze', analyze_interval, lambda: db.optimize(analyze=True)),
+            _Job('incremental vacuum', vacuum_interval, lambda: db.incremental_vacuum(
+                self.vacuum_pages, self.vacuum_step_pages, self.vacuum_step_sleep
+            )),
+        ]
+        if db.backend == 'file':
+            # Backups survive restarts, so the newest file decides when the
+            # next one is due. Temp and memory databases are gone on close and
+            # have no stable name to back up under, so they get no backups.
+            self.jobs.insert(0, _Job(
+                'backup', backup_interval, self._backup, idle_only=False, last_run=self._last_backup_time()
+            ))
+        if archive_interval is not None:
+            # Moves rows out of the live database, so it is opt-in.
+            self.jobs.append(_Job('archive', archive_interval, lambda: db.archive_old_rows()))
+
+    def _backup_name(self):
+        return os.path.splitext(os.path.basename(self.db.db_path))[0]
+
+    def _backups(self):
+        # Oldest first; the timestamp in the name sorts chronologically.
+        return sorted(glob.glob(os.path.join(self.backup_dir, f"{self._backup_name()}-*.db")))
+
+    def _last_backup_time(self):
+        backups = self._backups()
+        return os.path.getmtime(backups[-1]) if backups else None
+
+    def _backup(self):
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(self.backup_dir, f"{self._backup_name()}-{stamp}.db")
+        pages = self.db.backup(path, self.backup_step_pages, self.backup_step_sleep)
+        for old in self._backups()[:-self.backup_keep]:
+            os.remove(old)
+        return f"{pages} pages to {path}"
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='db-maintenance', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        # A job in progress finishes first; a backup stops between steps only
+        # when the process exits, since the thread is a daemon.
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            self.run_pending()
+
+    def run_pending(self, force_idle=False):
+        idle = force_idle or self.db.idle_seconds() >= self.idle_after
+        for job in self.jobs:
+            if self._stop.is_set():
+                break
+            if job.due(time.time()) and (idle or not job.idle_only):
+                self.run_job(job)
+
+    def run_job(self, job):
+        started = time.perf_counter()
+        try:
+            result = job.run()
+        except Exception as e:
+            result = None
+            with self._lock:
+                job.errors += 1
+            print(f"Maintenance job '{job.name}' failed: {e}")
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            job.last_run = time.time()
+            job.runs += 1
+            job.last_seconds = elapsed
+            job.total_seconds += elapsed
+            job.last_result = result
+        print(f"Maintenance: {job.name} took {elapsed:.2f}s" + (f" ({result})" if result is not None else ""))
+
+    def stats(self):
+        with self._lock:
+            return {
+                job.name: {
+                    'runs': job.runs,
+                    'errors': job.errors,
+                    'last_ms': job.last_seconds * 1000,
+                    'avg_ms': (job.total_seconds / job.runs * 1000) if job.runs else 0.0,
+                    'last_run': job.last_run,
+                    'last_result': job.last_result,
+                }
+                for job in self.jobs
+            }
+
+    def report(self):
+        lines = ["Maintenance jobs:"]
+        now = time.time()
+        for name, stats in self.stats().items():
+            last = (
+                f"{(now - stats['last_run']) / 60:.0f} min ago" if stats['last_run'] is not None else "never"
+            )
+            lines.append(
+                f"  {name:<20} {stats['runs']:>3} run(s), last {stats['last_ms']:.0f} ms, "
+                f"avg {stats['avg_ms']:.0f} ms, last run {last}"
+                + (f", {stats['errors']} failed" if stats['errors'] else "")
+            )
+        return '\n'.join(lines)
@@ -0,0 +1,530 @@
+# Schema migrations for the app database.
+# Every change to the schema is a numbered, forward-only step in MIGRATIONS.
+# Applied steps are recorded in the `schema_version` table, so existing
+# installs pick up new columns, indexes and tables on the next start.
+
+import sqlite3
+from datetime import datetime, timezone
+
+# Rows touched per transaction by backfills, so a large table never holds
+# the write lock for the whole migration.
+BACKFILL_BATCH_SIZE = 5000
+
+# Tables that carry a `timestamp` column, and so also get the normalized
+# `ts_epoch` (unix seconds) and `day_key` (local 'YYYY-MM-DD') columns.
+TIMESTAMPED_TABLES = ('chat_history', 'mood_tracking', 'user_progress', 'activity_notes')
+
+class SchemaMismatchError(RuntimeError):
+    pass
+
+def _create_base_tables(conn, db):
+    cursor = conn.cursor()
+
+    # Chat history table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chat_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT,
+            message TEXT,
+            response TEXT,
+            sentiment_score REAL
+        )
+    ''')
+
+    # Mood tracking table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS mood_tracking (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT,
+            mood_score REAL,
+            notes TEXT
+        )
+    ''')
+
+    # Activities table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS activities (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            description TEXT,
+            points INTEGER,
+            category TEXT
+        )
+    ''')
+
+    # User progress table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_progress (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT,
+            activity_id INTEGER,
+            completed BOOLEAN,
+            points_earned INTEGER,
+            FOREIGN KEY (activity_id) REFERENCES activities (id)
+        )
+    ''')
+
+    # Activity notes table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS activity_notes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            activity_id INTEGER,
+            timestamp TEXT,
+            notes TEXT,
+            FOREIGN KEY (activity_id) REFERENCES activities (id)
+        )
+    ''')
+
+def _add_time_keys(conn, db):
+    # Normalized timestamps, so time-window queries can be answered with
+    # index range scans instead of date() scans.
+    cursor = conn.cursor()
+    for table in TIMESTAMPED_TABLES:
+        add_column(conn, table, 'ts_epoch', 'INTEGER')
+        add_column(conn, table, 'day_key', 'TEXT')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_ts_epoch ON {table} (ts_epoch)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_day_key ON {table} (day_key, ts_epoch)')
+    conn.commit()
+
+    def time_keys(row):
+        parsed = db._parse_db_timestamp(row[1])
+        return db._time_keys(parsed) if parsed is not None else None
+
+    for table in TIMESTAMPED_TABLES:
+        backfill(
+            conn,
+            f'SELECT id, timestamp FROM {table} WHERE ts_epoch IS NULL',
+            f'UPDATE {table} SET ts_epoch = ?, day_key = ? WHERE id = ?',
+            time_keys
+        )
+
+def _create_rollups(conn, db):
+    # Per-day aggregates of mood and activity, kept current by triggers so
+    # the stats queries read O(days) rows instead of O(raw rows).
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_rollup (
+            day_key TEXT PRIMARY KEY NOT NULL,
+            mood_sum REAL NOT NULL DEFAULT 0,
+            mood_count INTEGER NOT NULL DEFAULT 0,
+            mood_min REAL,
+            mood_max REAL,
+            activity_count INTEGER NOT NULL DEFAULT 0,
+            points INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_activity_rollup (
+            day_key TEXT NOT NULL,
+            activity_id INTEGER NOT NULL,
+            category TEXT,
+            completions INTEGER NOT NULL DEFAULT 0,
+            points INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day_key, activity_id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_daily_activity_rollup_category
+        ON daily_activity_rollup (category, day_key)
+    ''')
+
+    mood_add = '''
+        INSERT OR IGNORE INTO daily_rollup (day_key) VALUES (NEW.day_key);
+        UPDATE daily_rollup SET
+            mood_sum = mood_sum + NEW.mood_score,
+            mood_count = mood_count + 1,
+            mood_min = MIN(COALESCE(mood_min, NEW.mood_score), NEW.mood_score),
+            mood_max = MAX(COALESCE(mood_max, NEW.mood_score), NEW.mood_score)
+        WHERE day_key = NEW.day_key;
+    '''
+    mood_remove = '''
+        UPDATE daily_rollup SET
+            mood_sum = mood_sum - OLD.mood_score,
+            mood_count = mood_count - 1,
+            mood_min = (SELECT MIN(mood_score) FROM mood_tracking WHERE day_key = OLD.day_key),
+            mood_max = (SELECT MAX(mood_score) FROM mood_tracking WHERE day_key = OLD.day_key)
+        WHERE day_key = OLD.day_key;
+    '''
+    progress_add = '''
+        INSERT OR IGNORE INTO daily_rollup (day_key) VALUES (NEW.day_key);
+        UPDATE daily_rollup SET
+            activity_count = activity_count + 1,
+            points = points + COALESCE(NEW.points_earned, 0)
+        WHERE day_key = NEW.day_key;
+        INSERT OR IGNORE INTO daily_activity_rollup (day_key, activity_id, category)
+        VALUES (NEW.day_key, NEW.activity_id, (SELECT category FROM activities WHERE id = NEW.activity_id));
+        UPDATE daily_activity_rollup SET
+            completions = completions + 1,
+            points = points + COALESCE(NEW.points_earned, 0)
+        WHERE day_key = NEW.day_key AND activity_id = NEW.activity_id;
+    '''
+    progress_remove = '''
+        UPDATE daily_rollup SET
+            activity_count = activity_count - 1,
+            points = points - COALESCE(OLD.points_earned, 0)
+        WHERE day_key = OLD.day_key;
+        UPDATE daily_activity_rollup SET
+            completions = completions - 1,
+            points = points - COALESCE(OLD.points_earned, 0)
+        WHERE day_key = OLD.day_key AND activity_id = OLD.activity_id;
+        DELETE FROM daily_activity_rollup
+        WHERE day_key = OLD.day_key AND activity_id = OLD.activity_id AND completions <= 0;
+    '''
+
+    triggers = [
+        ('trg_mood_rollup_insert', 'AFTER INSERT ON mood_tracking', 'NEW.day_key IS NOT NULL', mood_add),
+        ('trg_mood_rollup_delete', 'AFTER DELETE ON mood_tracking', 'OLD.day_key IS NOT NULL', mood_remove),
+        # delete_activity lowers the day's mood scores with an UPDATE.
+        ('trg_mood_rollup_update', 'AFTER UPDATE OF mood_score, day_key ON mood_tracking',
+         'OLD.day_key IS NOT NULL OR NEW.day_key IS NOT NULL', mood_remove + mood_add + '''
+        UPDATE daily_rollup SET
+            mood_min = (SELECT MIN(mood_score) FROM mood_tracking WHERE day_key = NEW.day_key),
+            mood_max = (SELECT MAX(mood_score) FROM mood_tracking WHERE day_key = NEW.day_key)
+        WHERE day_key = NEW.day_key;
+        '''),
+        ('trg_progress_rollup_insert', 'AFTER INSERT ON user_progress', 'NEW.day_key IS NOT NULL', progress_add),
+        ('trg_progress_rollup_delete', 'AFTER DELETE ON user_progress', 'OLD.day_key IS NOT NULL', progress_remove),
+        ('trg_progress_rollup_update', 'AFTER UPDATE OF activity_id, points_earned, day_key ON user_progress',
+         'OLD.day_key IS NOT NULL OR NEW.day_key IS NOT NULL', progress_remove + progress_add),
+    ]
+    for name, event, when, body in triggers:
+        cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} WHEN {when} BEGIN {body} END')
+    conn.commit()
+
+    rebuild_rollups(conn)
+
+def _rollup_from_raw(conn):
+    # {day_key: (mood_sum, mood_count, mood_min, mood_max, activity_count, points)}
+    days = {}
+    for day_key, mood_sum, mood_count, mood_min, mood_max in conn.execute('''
+        SELECT day_key, SUM(mood_score), COUNT(*), MIN(mood_score), MAX(mood_score)
+        FROM mood_tracking
+        WHERE day_key IS NOT NULL
+        GROUP BY day_key
+    '''):
+        days[day_key] = [mood_sum or 0.0, mood_count, mood_min, mood_max, 0, 0]
+    for day_key, activity_count, points in conn.execute('''
+        SELECT day_key, COUNT(*), COALESCE(SUM(points_earned), 0)
+        FROM user_progress
+        WHERE day_key IS NOT NULL
+        GROUP BY day_key
+    '''):
+        day = days.setdefault(day_key, [0.0, 0, None, None, 0, 0])
+        day[4], day[5] = activity_count, points
+    return days
+
+def _rollup_differs(stored, fresh):
+    for a, b in zip(stored, fresh):
+        if a is None or b is None:
+            if a != b:
+                return True
+        elif abs(a - b) > 1e-6:
+            return True
+    return False
+
+def rebuild_rollups(conn, frozen_mood_months=()):
+    # Recomputes both rollup tables from the raw rows and returns how many
+    # days were out of step before the rebuild. Days in frozen_mood_months
+    # have had their mood rows archived, so their stored mood figures are
+    # kept rather than recomputed from what is left.
+    fresh = _rollup_from_raw(conn)
+    stored = {row[0]: row[1:] for row in conn.execute('''
+        SELECT day_key, mood_sum, mood_count, mood_min, mood_max, activity_count, points
+        FROM daily_rollup
+        WHERE mood_count > 0 OR activity_count > 0
+    ''')}
+    for day, values in stored.items():
+        if day[:7] in frozen_mood_months:
+            activity = fresh.get(day, [0.0, 0, None, None, 0, 0])[4:]
+            fresh[day] = list(values[:4]) + list(activity)
+    mismatched = sum(
+        1 for day in set(fresh) | set(stored)
+        if day not in fresh or day not in stored or _rollup_differs(stored[day], fresh[day])
+    )
+
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM daily_rollup')
+    cursor.executemany('''
+        INSERT INTO daily_rollup (day_key, mood_sum, mood_count, mood_min, mood_max, activity_count, points)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(day, *values) for day, values in fresh.items()])
+    cursor.execute('DELETE FROM daily_activity_rollup')
+    cursor.execute('''
+        INSERT INTO daily_activity_rollup (day_key, activity_id, category, completions, points)
+        SELECT p.day_key, p.activity_id, a.category, COUNT(*), COALESCE(SUM(p.points_earned), 0)
+        FROM user_progress p
+        LEFT JOIN activities a ON a.id = p.activity_id
+        WHERE p.day_key IS NOT NULL AND p.activity_id IS NOT NULL
+        GROUP BY p.day_key, p.activity_id
+    ''')
+    conn.commit()
+    return mismatched
+
+def normalize_activity_name(name):
+    # Catalog key: case- and whitespace-insensitive, so "Deep Breathing" and
+    # "deep  breathing " are the same activity.
+    return ' '.join((name or '').split()).casefold()
+
+def _dedupe_activities(conn, db):
+    # One catalog row per normalized name. Duplicates are merged into the
+    # oldest row, and completions/notes are repointed at it.
+    cursor = conn.cursor()
+    add_column(conn, 'activities', 'name_key', 'TEXT')
+    add_column(conn, 'user_progress', 'details', 'TEXT')
+    conn.commit()
+
+    backfill(
+        conn,
+        'SELECT id, name FROM activities WHERE name_key IS NULL',
+        'UPDATE activities SET name_key = ? WHERE id = ?',
+        lambda row: (normalize_activity_name(row[1]),)
+    )
+
+    duplicates = cursor.execute('''
+        SELECT a.id, keep.id
+        FROM activities a
+        JOIN (
+            SELECT name_key, MIN(id) AS id
+            FROM activities
+            GROUP BY name_key
+            HAVING COUNT(*) > 1
+        ) keep ON keep.name_key = a.name_key
+        WHERE a.id != keep.id
+    ''').fetchall()
+    for duplicate_id, keep_id in duplicates:
+        cursor.execute('UPDATE user_progress SET activity_id = ? WHERE activity_id = ?', (keep_id, duplicate_id))
+        cursor.execute('UPDATE activity_notes SET activity_id = ? WHERE activity_id = ?', (keep_id, duplicate_id))
+        cursor.execute('DELETE FROM activities WHERE id = ?', (duplicate_id,))
+    if duplicates:
+        print(f"Merged {len(duplicates)} duplicate activities")
+
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_activities_name_key ON activities (name_key)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_activities_name ON activities (name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_activities_category ON activities (category)')
+    conn.commit()
+
+def _key_notes_to_progress(conn, db):
+    # Notes belong to one completion (user_progress row) rather than to the
+    # activity, so joining them never multiplies rows. Existing notes are
+    # matched to the latest completion of the same activity on the same day
+    # at or before the note, falling back to the earliest one after it.
+    cursor = conn.cursor()
+    add_column(conn, 'activity_notes', 'progress_id', 'INTEGER REFERENCES user_progress (id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_activity_notes_progress_id ON activity_notes (progress_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_progress_activity ON user_progress (activity_id, day_key, ts_epoch)')
+    conn.commit()
+
+    def match_progress(row):
+        _, activity_id, day_key, ts_epoch = row
+        match = conn.execute('''
+            SELECT id FROM user_progress
+            WHERE activity_id = ? AND day_key = ?
+            ORDER BY ts_epoch > ?, ABS(ts_epoch - ?)
+            LIMIT 1
+        ''', (activity_id, day_key, ts_epoch, ts_epoch)).fetchone()
+        return (match[0],) if match else None
+
+    backfill(
+        conn,
+        'SELECT id, activity_id, day_key, ts_epoch FROM activity_notes WHERE progress_id IS NULL',
+        'UPDATE activity_notes SET progress_id = ? WHERE id = ?',
+        match_progress
+    )
+
+def fts5_available(conn):
+    return bool(conn.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')").fetchone()[0])
+
+def _create_chat_search(conn, db):
+    # FTS5 index over chat messages and responses. It is an external-content
+    # table (the text stays in chat_history), kept in sync by triggers.
+    # Builds of SQLite without FTS5 skip this and search falls back to LIKE.
+    if not fts5_available(conn):
+        print("SQLite was built without FTS5; chat search will use a slower scan")
+        return
+
+    cursor = conn.cursor()
+    exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'chat_fts'").fetchone()
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS chat_fts USING fts5(
+            message, response,
+            content = 'chat_history', content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_chat_fts_insert AFTER INSERT ON chat_history BEGIN
+            INSERT INTO chat_fts (rowid, message, response) VALUES (NEW.id, NEW.message, NEW.response);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_chat_fts_delete AFTER DELETE ON chat_history BEGIN
+            INSERT INTO chat_fts (chat_fts, rowid, message, response) VALUES ('delete', OLD.id, OLD.message, OLD.response);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_chat_fts_update AFTER UPDATE OF message, response ON chat_history BEGIN
+            INSERT INTO chat_fts (chat_fts, rowid, message, response) VALUES ('delete', OLD.id, OLD.message, OLD.response);
+            INSERT INTO chat_fts (rowid, message, response) VALUES (NEW.id, NEW.message, NEW.response);
+        END
+    ''')
+    conn.commit()
+    if exists:
+        # Re-run by Database.bulk_load, which reloaded chat_history with the
+        # triggers dropped; index the new rows from scratch.
+        cursor.execute("INSERT INTO chat_fts (chat_fts) VALUES ('rebuild')")
+        conn.commit()
+        return
+
+    # Index existing rows in id ranges, one commit per batch.
+    last_id = 0
+    max_id = cursor.execute('SELECT COALESCE(MAX(id), 0) FROM chat_history').fetchone()[0]
+    while last_id < max_id:
+        cursor.execute('''
+            INSERT INTO chat_fts (rowid, message, response)
+            SELECT id, message, response FROM chat_history
+            WHERE id > ? AND id <= ?
+        ''', (last_id, last_id + BACKFILL_BATCH_SIZE))
+        conn.commit()
+        last_id += BACKFILL_BATCH_SIZE
+
+def _create_archive_index(conn, db):
+    # One row per archived month file (see archive.py). Paths are relative
+    # to the directory of the live database.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive_segments (
+            table_name TEXT NOT NULL,
+            month TEXT NOT NULL,
+            path TEXT NOT NULL,
+            row_count INTEGER NOT NULL DEFAULT 0,
+            min_id INTEGER,
+            max_id INTEGER,
+            min_day TEXT,
+            max_day TEXT,
+            archived_at TEXT,
+            PRIMARY KEY (table_name, month)
+        )
+    ''')
+    conn.commit()
+
+# (version, name, step). Steps must be safe to re-run on a database that
+# already has their changes, since installs created before `schema_version`
+# existed start again from version 0.
+MIGRATIONS = [
+    (1, 'base tables', _create_base_tables),
+    (2, 'normalized timestamps', _add_time_keys),
+    (3, 'daily rollups', _create_rollups),
+    (4, 'deduplicated activity catalog', _dedupe_activities),
+    (5, 'notes keyed to completions', _key_notes_to_progress),
+    (6, 'chat full-text search', _create_chat_search),
+    (7, 'archive segment index', _create_archive_index),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def add_column(conn, table, column, definition):
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def backfill(conn, select_sql, update_sql, compute, batch_size=BACKFILL_BATCH_SIZE):
+    # Walks the rows matched by `select_sql` (whose first column must be the
+    # rowid) in id order, committing every `batch_size` rows. `compute` maps a
+    # row to the update parameters (without the trailing id), or None to skip.
+    where = ' AND ' if ' WHERE ' in select_sql.upper() else ' WHERE '
+    chunk_sql = f'{select_sql}{where}id > ? ORDER BY id LIMIT ?'
+    last_id = 0
+    total = 0
+    while True:
+        rows = conn.execute(chunk_sql, (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            params = compute(row)
+            if params is not None:
+                updates.append(tuple(params) + (row[0],))
+        conn.executemany(update_sql, updates)
+        conn.commit()
+        total += len(updates)
+        last_id = rows[-1][0]
+    return total
+
+def get_version(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TEXT
+        )
+    ''')
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+def migrate(conn, db):
+    current = get_version(conn)
+    if current > SCHEMA_VERSION:
+        raise SchemaMismatchError(
+            f"Database schema version {current} is newer than this app ({SCHEMA_VERSION})"
+        )
+
+    for version, name, step in MIGRATIONS:
+        if version <= current:
+            continue
+        print(f"Applying migration {version}: {name}")
+        step(conn, db)
+        conn.execute('''
+            INSERT INTO schema_version (version, name, applied_at)
+            VALUES (?, ?, ?)
+        ''', (version, name, datetime.now(timezone.utc).isoformat()))
+        conn.commit()
+
+def _describe(conn):
+    # {table: set(columns)} plus the set of (type, name) for indexes and
+    # triggers, ignoring SQLite internals.
+    tables = {}
+    for (name,) in conn.execute('''
+        SELECT name FROM sqlite_master
+        WHERE type = 'table' AND name NOT LIKE 'sqlite_%'
+    '''):
+        tables[name] = {row[1] for row in conn.execute(f'PRAGMA table_info("{name}")')}
+    objects = set(conn.execute('''
+        SELECT type, name FROM sqlite_master
+        WHERE type IN ('index', 'trigger') AND name NOT LIKE 'sqlite_%'
+    '''))
+    return tables, objects
+
+_expected_schema = None
+
+def expected_schema(db):
+    # Same for every database file, so it is built once per process rather
+    # than on every shard open.
+    global _expected_schema
+    if _expected_schema is None:
+        conn = sqlite3.connect(':memory:')
+        try:
+            for _, _, step in MIGRATIONS:
+                step(conn, db)
+            _expected_schema = _describe(conn)
+        finally:
+            conn.close()
+    return _expected_schema
+
+def verify_schema(conn, db):
+    # The live schema may carry extra columns (e.g. ones left in databases
+    # made by older versions of the app), but everything the migrations
+    # create must exist.
+    expected_tables, expected_objects = expected_schema(db)
+    live_tables, live_objects = _describe(conn)
+
+    problems = []
+    for table, columns in expected_tables.items():
+        if table not in live_tables:
+            problems.append(f"missing table {table}")
+            continue
+        missing = columns - live_tables[table]
+        if missing:
+            problems.append(f"{table} is missing columns: {', '.join(sorted(missing))}")
+    for kind, name in sorted(expected_objects - live_objects):
+        problems.append(f"missing {kind} {name}")
+
+    if problems:
+        raise SchemaMismatchError("Database schema does not match: " + "; ".join(problems))
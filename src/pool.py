@@ -0,0 +1,164 @@
+# Bounded SQLite connection pool.
+# Connections are checked out for the duration of one Database call and
+# handed back afterwards, so short-lived worker threads (one per chat
+# message) reuse a few connections instead of each leaking their own.
+
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import contextmanager
+
+class PoolExhaustedError(RuntimeError):
+    pass
+
+class ConnectionPool:
+    def __init__(self, factory, max_size=8, idle_timeout=60.0, checkout_timeout=10.0, leak_timeout=30.0):
+        self._factory = factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.leak_timeout = leak_timeout
+
+        self._cond = threading.Condition()
+        self._idle = deque()     # (conn, returned_at)
+        self._in_use = {}        # id(conn) -> (conn, checked_out_at, thread name, stack)
+        self._flagged = set()    # id(conn) of checkouts already reported as leaks
+        self._closed = False
+
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+        self._created = 0
+        self._evicted = 0
+        self._leaks_reported = 0
+
+    @property
+    def size(self):
+        return len(self._idle) + len(self._in_use)
+
+    def acquire(self):
+        started = time.perf_counter()
+        deadline = started + self.checkout_timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolExhaustedError("Connection pool is closed")
+                self._evict_idle_locked()
+                # Reported here, before a leak can exhaust the pool.
+                self._report_leaks_locked(self.leak_timeout, new_only=True)
+                if self._idle:
+                    conn, _ = self._idle.pop()
+                    break
+                if self.size < self.max_size:
+                    conn = self._factory()
+                    self._created += 1
+                    break
+
+                waited = True
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self._report_leaks_locked(self.leak_timeout)
+                    raise PoolExhaustedError(
+                        f"No connection available after {self.checkout_timeout}s "
+                        f"({len(self._in_use)} in use, max {self.max_size})"
+                    )
+                self._cond.wait(remaining)
+
+            wait = time.perf_counter() - started
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+            self._wait_time += wait
+            self._max_wait = max(self._max_wait, wait)
+            self._in_use[id(conn)] = (
+                conn,
+                time.monotonic(),
+                threading.current_thread().name,
+                traceback.extract_stack(limit=8)[:-2]
+            )
+            return conn
+
+    def release(self, conn):
+        # Anything left uncommitted by the caller is rolled back, so the next
+        # borrower always starts outside a transaction.
+        if conn.in_transaction:
+            conn.rollback()
+        with self._cond:
+            self._report_leaks_locked(self.leak_timeout, new_only=True)
+            self._in_use.pop(id(conn), None)
+            self._flagged.discard(id(conn))
+            if self._closed:
+                conn.close()
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def _evict_idle_locked(self):
+        now = time.monotonic()
+        # Oldest returns sit at the left; the most recently used are reused first.
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            conn.close()
+            self._evicted += 1
+
+    def evict_idle(self):
+        with self._cond:
+            self._evict_idle_locked()
+
+    def _report_leaks_locked(self, threshold, new_only=False):
+        # With new_only, checkouts reported before are skipped, so a
+        # long-held connection is reported once rather than on every call.
+        leaks = []
+        now = time.monotonic()
+        for key, (conn, checked_out_at, thread_name, stack) in self._in_use.items():
+            held = now - checked_out_at
+            if held >= threshold and not (new_only and key in self._flagged):
+                self._flagged.add(key)
+                leaks.append((thread_name, held, stack))
+        for thread_name, held, stack in leaks:
+            self._leaks_reported += 1
+            print(f"Warning: connection held by thread '{thread_name}' for {held:.1f}s, checked out at:")
+            print(''.join(traceback.format_list(stack)).rstrip())
+        return leaks
+
+    def check_leaks(self):
+        with self._cond:
+            return self._report_leaks_locked(self.leak_timeout)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+                'max_size': self.max_size,
+                'created': self._created,
+                'evicted': self._evicted,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'avg_wait_ms': (self._wait_time / self._checkouts * 1000) if self._checkouts else 0.0,
+                'max_wait_ms': self._max_wait * 1000,
+                'leaks_reported': self._leaks_reported,
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                conn.close()
+            if self._in_use:
+                print(f"Warning: closing pool with {len(self._in_use)} connection(s) still checked out")
+                self._report_leaks_locked(0.0)
+            self._cond.notify_all()
@@ -0,0 +1,215 @@
+# Opt-in profiler for Database (see DB_PROFILER in config.py).
+# Records per-method call counts, latency histograms and rows returned, and
+# times every statement run on a profiled connection. Statements slower than
+# slow_ms are kept in a slow-query log together with their EXPLAIN QUERY
+# PLAN, and plans that scan a whole table are flagged.
+
+import functools
+import inspect
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+# Upper bounds (ms) of the latency histogram buckets; the last is open-ended.
+LATENCY_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000)
+
+# "SCAN chat_history" / "SCAN TABLE chat_history AS c", but not index,
+# covering-index, subquery or virtual-table scans.
+_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+# Newer SQLite reports scans by alias ("SCAN c"), so aliases are mapped back.
+_TABLE_ALIAS = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+AS)?\s+(\w+)', re.IGNORECASE)
+_EXPLAINABLE = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|WITH|REPLACE)\b', re.IGNORECASE)
+
+# Public Database methods that are not queries.
+NOT_PROFILED = {'close', 'flush', 'pool_stats', 'writer_stats', 'cache_stats', 'perf_report'}
+
+def _count_rows(result):
+    if result is None:
+        return 0
+    if isinstance(result, (list, tuple, dict, set)):
+        return len(result)
+    return 1
+
+def _normalize(sql):
+    return ' '.join(sql.split())
+
+class _MethodStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def add(self, seconds, rows):
+        ms = seconds * 1000
+        self.calls += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.rows += rows
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the given fraction of calls.
+        target = fraction * self.calls
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= target:
+                bound = LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else float('inf')
+                return min(bound, self.max * 1000)
+        return 0.0
+
+class Profiler:
+    def __init__(self, slow_ms=50.0, explain=True, slow_log_size=100):
+        self.slow_ms = slow_ms
+        self.explain = explain
+        self._lock = threading.Lock()
+        self._methods = {}                             # name -> _MethodStats
+        self._statements = {}                          # normalized sql -> [count, total, max]
+        self._slow = deque(maxlen=slow_log_size)       # (ms, sql, plan, full scans)
+        self._full_scans = {}                          # table -> slow statements scanning it
+
+    def instrument(self, db):
+        # Wraps the public query methods of `db` on the instance, so calls
+        # made through `db.` (including from other Database methods) are timed.
+        for name, method in inspect.getmembers(db, inspect.ismethod):
+            if name.startswith('_') or name in NOT_PROFILED or inspect.isgeneratorfunction(method):
+                continue
+            setattr(db, name, self._wrap(name, method))
+
+    def _wrap(self, name, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = method(*args, **kwargs)
+            except Exception:
+                with self._lock:
+                    self._methods.setdefault(name, _MethodStats()).errors += 1
+                raise
+            self.record_method(name, time.perf_counter() - started, _count_rows(result))
+            return result
+        return wrapper
+
+    def record_method(self, name, seconds, rows):
+        with self._lock:
+            self._methods.setdefault(name, _MethodStats()).add(seconds, rows)
+
+    def record_statement(self, conn, sql, params, seconds):
+        key = _normalize(sql)
+        with self._lock:
+            stats = self._statements.setdefault(key, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+        ms = seconds * 1000
+        if ms < self.slow_ms:
+            return
+
+        plan, scans = [], []
+        if self.explain and _EXPLAINABLE.match(sql):
+            try:
+                # A plain cursor, so the EXPLAIN itself is not profiled.
+                rows = conn.cursor(sqlite3.Cursor).execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+                plan = [row[-1] for row in rows]
+                aliases = {alias: table for table, alias in _TABLE_ALIAS.findall(sql)}
+                scans = [
+                    aliases.get(match.group(1), match.group(1))
+                    for match in map(_FULL_SCAN.match, plan) if match
+                ]
+            except sqlite3.Error as e:
+                plan = [f"(no plan: {e})"]
+        with self._lock:
+            self._slow.append((ms, key, plan, scans))
+            for table in scans:
+                self._full_scans[table] = self._full_scans.get(table, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'methods': {
+                    name: {
+                        'calls': s.calls,
+                        'errors': s.errors,
+                        'avg_ms': (s.total / s.calls * 1000) if s.calls else 0.0,
+                        'p50_ms': s.percentile(0.5),
+                        'p95_ms': s.percentile(0.95),
+                        'max_ms': s.max * 1000,
+                        'rows': s.rows,
+                        'histogram': dict(zip(
+                            [f"<={bound}ms" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"],
+                            s.buckets
+                        )),
+                    }
+                    for name, s in self._methods.items()
+                },
+                'slow_queries': len(self._slow),
+                'full_scans': dict(self._full_scans),
+            }
+
+    def report(self, top=10):
+        with self._lock:
+            methods = sorted(self._methods.items(), key=lambda item: item[1].total, reverse=True)
+            statements = sorted(self._statements.items(), key=lambda item: item[1][1], reverse=True)[:top]
+            slow = sorted(self._slow, reverse=True)[:top]
+            full_scans = dict(self._full_scans)
+
+        lines = ["Database methods (by total time):"]
+        lines.append(f"  {'method':<28} {'calls':>6} {'avg ms':>8} {'p95 ms':>8} {'max ms':>8} {'rows/call':>9}")
+        for name, s in methods:
+            lines.append(
+                f"  {name:<28} {s.calls:>6} {s.total / s.calls * 1000 if s.calls else 0:>8.2f} "
+                f"{s.percentile(0.95):>8.1f} {s.max * 1000:>8.2f} {s.rows / s.calls if s.calls else 0:>9.1f}"
+                + (f"  ({s.errors} failed)" if s.errors else "")
+            )
+        lines.append("Statements (by total time):")
+        for sql, (count, total, worst) in statements:
+            lines.append(f"  {count:>6}x {total * 1000:>9.1f} ms total {worst * 1000:>8.2f} ms max  {sql[:100]}")
+        lines.append(f"Slow statements (>= {self.slow_ms:g} ms):")
+        for ms, sql, plan, scans in slow:
+            flag = f"  FULL SCAN of {', '.join(scans)}" if scans else ""
+            lines.append(f"  {ms:>8.2f} ms  {sql[:100]}{flag}")
+            for step in plan:
+                lines.append(f"      {step}")
+        if full_scans:
+            lines.append("Tables fully scanned by slow statements: " + ", ".join(
+                f"{table} ({count})" for table, count in sorted(full_scans.items())
+            ))
+        return '\n'.join(lines)
+
+class ProfilingCursor(sqlite3.Cursor):
+    def execute(self, sql, params=()):
+        started = time.perf_counter()
+        result = super().execute(sql, params)
+        self.connection.profiler.record_statement(self.connection, sql, params, time.perf_counter() - started)
+        return result
+
+    def executemany(self, sql, seq_of_params):
+        started = time.perf_counter()
+        result = super().executemany(sql, seq_of_params)
+        # Too many parameter sets to explain one meaningfully.
+        self.connection.profiler.record_statement(self.connection, sql, None, time.perf_counter() - started)
+        return result
+
+class ProfilingConnection(sqlite3.Connection):
+    # sqlite3.connect(..., factory=ProfilingConnection); set `profiler`
+    # before use.
+    profiler = None
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or ProfilingCursor)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
@@ -1,23 +1,82 @@
 # Sentiment analysis.
-# Uses AI to analyze the sentiments of the user's prompt.
+# Scores the user's messages locally with VADER and TextBlob, and uses AI to
+# analyze the sentiment only when the local scores are unsure or disagree.
 
 from textblob import TextBlob # type: ignore
 import nltk #type: ignore
-from typing import Tuple
+import threading
+from typing import Optional, Tuple
 from ollama import Client # type: ignore
-from config import OLLAMA_HOST, AI_MODEL
+from config import OLLAMA_HOST, AI_MODEL, AI_SENTIMENT, SENTIMENT_CACHE
+from sentiment_cache import SentimentCache
+
+# Part of the sentiment cache key: bump it when the prompt in model_sentiment
+# or ai_helper.SENTIMENT_INSTRUCTION changes, so old results are not reused.
+PROMPT_VERSION = 1
 
 class SentimentAnalyzer:
-    def __init__(self):
+    def __init__(self, cache=None):
         try:
             # Using 'vader_lexicon' sentiment analysis tool.
-            nltk.data.find('vader_lexicon')
+            nltk.data.find('sentiment/vader_lexicon.zip')
         except LookupError:
-            nltk.download('vader_lexicon')
+            nltk.download('vader_lexicon', quiet=True)
+        try:
+            from nltk.sentiment import SentimentIntensityAnalyzer # type: ignore
+            self.vader = SentimentIntensityAnalyzer()
+        except (ImportError, LookupError) as e:
+            # Without VADER every message goes to the AI.
+            print(f"VADER unavailable, sentiment will always use the AI: {e}")
+            self.vader = None
         self.client = Client(host=OLLAMA_HOST)
         self.model = AI_MODEL
+        self.local_first = AI_SENTIMENT['local_first']
+        self.local_confidence = AI_SENTIMENT['local_confidence']
+        self.max_disagreement = AI_SENTIMENT['max_disagreement']
+        # Messages answered locally, from the cache, or escalated to the AI.
+        # Analyses run on worker threads, so the counts are updated under a lock.
+        self._stats_lock = threading.Lock()
+        self.local_count = 0
+        self.cached_count = 0
+        self.escalated_count = 0
+        # `cache` overrides SENTIMENT_CACHE, e.g. {'path': None} for memory only.
+        cache_settings = dict(SENTIMENT_CACHE, **(cache or {}))
+        self.cache = None
+        if cache_settings.pop('enabled'):
+            self.cache = SentimentCache(self.model, PROMPT_VERSION, **cache_settings)
 
     def analyze_sentiment(self, text: str) -> Tuple[float, str, float]:
+        # The local result when it is confident, otherwise the AI's (cached).
+        result = self.local_sentiment(text) or self.cached_sentiment(text)
+        if result is None:
+            self.record_escalation()
+            result = self.model_sentiment(text)
+        return result
+
+    def local_sentiment(self, text: str) -> Optional[Tuple[float, str, float]]:
+        # VADER and TextBlob take microseconds. Their result is used when
+        # VADER is sure (|compound| >= local_confidence) and TextBlob roughly
+        # agrees; otherwise this returns None and the message should go to
+        # the cache, then the AI.
+        result = None
+        if self.local_first and self.vader is not None:
+            compound = self.vader.polarity_scores(text)['compound']
+            vader_score = (compound + 1) / 2
+            blob_score = (TextBlob(text).sentiment.polarity + 1) / 2
+            if abs(compound) >= self.local_confidence and abs(vader_score - blob_score) <= self.max_disagreement:
+                result = self._from_score((vader_score + blob_score) / 2)
+        if result is not None:
+            with self._stats_lock:
+                self.local_count += 1
+        return result
+
+    def record_escalation(self):
+        # Called once per message that asks the AI (a model_sentiment call or
+        # a reply with a sentiment trailer), whether or not it answers.
+        with self._stats_lock:
+            self.escalated_count += 1
+
+    def model_sentiment(self, text: str) -> Tuple[float, str, float]:
 
         # Analysis Template
         # Ask Qwen2.5 for the mood tracking.
@@ -44,19 +103,58 @@ class SentimentAnalyzer:
             json_match = re.search(r'{.*}', content)
             if json_match:
                 analysis = json.loads(json_match.group())
-                return (
+                result = (
                     float(analysis['score']),
                     str(analysis['mood']),
                     float(analysis['impact'])
                 )
+                self.remember(text, result)
+                return result
         except Exception as e:
             print(f"AI analysis failed: {e}")
         
         # Fallback to TextBlob if AI fails
         # This does not work well, but, it should work as a fallback option.
         analysis = TextBlob(text)
-        base_score = (analysis.sentiment.polarity + 1) / 2
-        
+        return self._from_score((analysis.sentiment.polarity + 1) / 2)
+
+    def cached_sentiment(self, text: str) -> Optional[Tuple[float, str, float]]:
+        # An earlier AI result for the same message, if any.
+        result = self.cache.get(text) if self.cache else None
+        if result is not None:
+            with self._stats_lock:
+                self.cached_count += 1
+        return result
+
+    def remember(self, text: str, result: Tuple[float, str, float]):
+        # Stores an AI result (from model_sentiment or a reply's sentiment
+        # trailer). The TextBlob fallback is never cached.
+        if self.cache:
+            self.cache.put(text, result)
+
+    def cache_stats(self):
+        return self.cache.stats() if self.cache else None
+
+    def close(self):
+        if self.cache:
+            self.cache.close()
+
+    def tier_stats(self):
+        # How many messages each tier answered: local scores, the cache, or the AI.
+        with self._stats_lock:
+            local, cached, escalated = self.local_count, self.cached_count, self.escalated_count
+        total = local + cached + escalated
+        return {
+            'messages': total,
+            'local': local,
+            'cached': cached,
+            'escalated': escalated,
+            'escalation_rate': escalated / total if total else 0.0,
+        }
+
+    @staticmethod
+    def _from_score(base_score: float) -> Tuple[float, str, float]:
+        # Maps a 0-1 score onto (score, mood, impact).
         if base_score < 0.3:
             mood = "low"
             mood_impact = -0.03
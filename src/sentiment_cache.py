@@ -0,0 +1,158 @@
+# Cache of LLM sentiment results (see sentiment.py).
+# Entries are keyed on a hash of the normalized message text, the model and
+# the prompt version, so a changed AI_MODEL or prompt never sees old
+# results. An in-memory LRU sits in front of an optional SQLite file that
+# survives restarts; rows for another model or prompt version are dropped
+# when the file is opened.
+
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+class SentimentCache:
+    def __init__(self, model, prompt_version, max_entries=512, path=None, max_persisted=10000):
+        self.model = model
+        self.prompt_version = prompt_version
+        self.max_entries = max_entries
+        self.max_persisted = max_persisted
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (score, mood, impact)
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._conn = None
+        self._persisted = 0
+        if path:
+            try:
+                self._conn = self._open(path)
+            except sqlite3.Error as e:
+                print(f"Sentiment cache file unavailable, keeping it in memory only: {e}")
+
+    def _open(self, path):
+        # Sentiment calls come from worker threads; every use of the
+        # connection is under self._lock.
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS sentiment_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                prompt_version INTEGER NOT NULL,
+                score REAL NOT NULL,
+                mood TEXT NOT NULL,
+                impact REAL NOT NULL,
+                used_at REAL NOT NULL
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sentiment_cache_used ON sentiment_cache(used_at)")
+        dropped = conn.execute(
+            "DELETE FROM sentiment_cache WHERE model != ? OR prompt_version != ?",
+            (self.model, self.prompt_version)
+        ).rowcount
+        conn.commit()
+        if dropped:
+            print(f"Sentiment cache: dropped {dropped} entries from another model or prompt version")
+        self._persisted = conn.execute("SELECT COUNT(*) FROM sentiment_cache").fetchone()[0]
+        return conn
+
+    @staticmethod
+    def normalize(text):
+        # "I'm fine", "i'm  fine." and " I'M FINE " share an entry; "?" and "!"
+        # are kept since they can change the reading.
+        return ' '.join(text.casefold().split()).rstrip('. ')
+
+    def _key(self, text):
+        raw = f"{self.model}\0{self.prompt_version}\0{self.normalize(text)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, text):
+        key = self._key(text)
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            if self._conn is not None:
+                try:
+                    row = self._conn.execute(
+                        "SELECT score, mood, impact FROM sentiment_cache WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None:
+                        self._conn.execute(
+                            "UPDATE sentiment_cache SET used_at = ? WHERE key = ?", (time.time(), key)
+                        )
+                        self._conn.commit()
+                        value = tuple(row)
+                        self._remember(key, value)
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return value
+                except sqlite3.Error as e:
+                    print(f"Sentiment cache read failed: {e}")
+            self.misses += 1
+            return None
+
+    def put(self, text, value):
+        key = self._key(text)
+        score, mood, impact = value
+        with self._lock:
+            self._remember(key, (score, mood, impact))
+            if self._conn is None:
+                return
+            try:
+                added = self._conn.execute(
+                    "SELECT 1 FROM sentiment_cache WHERE key = ?", (key,)
+                ).fetchone() is None
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sentiment_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, self.model, self.prompt_version, score, mood, impact, time.time())
+                )
+                self._persisted += added
+                if self._persisted > self.max_persisted:
+                    # Trim a tenth below the limit so this does not run on every put.
+                    excess = self._persisted - self.max_persisted + self.max_persisted // 10
+                    self._persisted -= self._conn.execute(
+                        "DELETE FROM sentiment_cache WHERE key IN "
+                        "(SELECT key FROM sentiment_cache ORDER BY used_at LIMIT ?)", (excess,)
+                    ).rowcount
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"Sentiment cache write failed: {e}")
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM sentiment_cache")
+                self._conn.commit()
+                self._persisted = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'persisted': self._persisted if self._conn is not None else None,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits / lookups) if lookups else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
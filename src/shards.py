@@ -0,0 +1,188 @@
+# Per-user database shards.
+# Every user gets their own SQLite file under one directory, opened as a
+# regular Database. Only max_open shards stay open at a time: the least
+# recently used unpinned shard is closed when another one is needed, and
+# shards nobody has touched for idle_timeout seconds are closed as well
+# (checked whenever a shard is acquired or released).
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import quote, unquote
+from database import Database
+
+SHARD_SUFFIX = '.db'
+
+class ShardManager:
+    def __init__(self, root='users', max_open=16, idle_timeout=300.0, max_workers=4, db_options=None):
+        self.root = root
+        self.max_open = max_open
+        self.idle_timeout = idle_timeout
+        self.max_workers = max_workers
+        # Extra Database(...) keyword arguments, e.g. smaller pools per shard.
+        self.db_options = db_options or {}
+
+        self._lock = threading.Condition()
+        self._open = OrderedDict()   # user_id -> Database, least recently used first
+        self._last_used = {}         # user_id -> monotonic time
+        self._pins = {}              # user_id -> number of active acquire()s
+        self._opening = set()        # user_ids being opened by another thread
+        self._closed = False
+
+        self._opens = 0
+        self._hits = 0
+        self._evictions = 0
+
+        os.makedirs(root, exist_ok=True)
+
+    def shard_path(self, user_id):
+        # Percent-encoding keeps any user id a single, reversible file name.
+        if not user_id or user_id in ('.', '..'):
+            raise ValueError(f"Invalid user id: {user_id!r}")
+        return os.path.join(self.root, quote(user_id, safe='') + SHARD_SUFFIX)
+
+    def user_ids(self):
+        # Every user with a shard on disk, open or not.
+        return sorted(
+            unquote(name[:-len(SHARD_SUFFIX)])
+            for name in os.listdir(self.root)
+            if name.endswith(SHARD_SUFFIX)
+        )
+
+    def acquire(self, user_id):
+        # Returns the user's Database, opening the shard if needed. The shard
+        # stays pinned (never evicted) until the matching release().
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Shard manager is closed")
+                db = self._open.get(user_id)
+                if db is not None:
+                    self._open.move_to_end(user_id)
+                    self._hits += 1
+                    break
+                if user_id not in self._opening:
+                    self._opening.add(user_id)
+                    db = None
+                    break
+                self._lock.wait()
+
+            if db is None:
+                # Opening runs the migrations, so do it outside the lock.
+                self._lock.release()
+                try:
+                    db = Database(self.shard_path(user_id), **self.db_options)
+                finally:
+                    self._lock.acquire()
+                    self._opening.discard(user_id)
+                    self._lock.notify_all()
+                self._open[user_id] = db
+                self._opens += 1
+
+            self._pins[user_id] = self._pins.get(user_id, 0) + 1
+            self._last_used[user_id] = time.monotonic()
+            evicted = self._evict_idle_locked() + self._evict_lru_locked()
+        self._close_all(evicted)
+        return db
+
+    def release(self, user_id):
+        with self._lock:
+            pins = self._pins.get(user_id, 0) - 1
+            if pins > 0:
+                self._pins[user_id] = pins
+            else:
+                self._pins.pop(user_id, None)
+            self._last_used[user_id] = time.monotonic()
+            evicted = self._evict_idle_locked() + self._evict_lru_locked()
+        self._close_all(evicted)
+
+    @contextmanager
+    def shard(self, user_id):
+        db = self.acquire(user_id)
+        try:
+            yield db
+        finally:
+            self.release(user_id)
+
+    def _evict_lru_locked(self):
+        # Over the limit, close least recently used shards first. Pinned ones
+        # are skipped, so the limit can be exceeded while they are in use.
+        evicted = []
+        for user_id in list(self._open):
+            if len(self._open) <= self.max_open:
+                break
+            if user_id not in self._pins:
+                evicted.append(self._remove_locked(user_id))
+        return evicted
+
+    def _evict_idle_locked(self):
+        now = time.monotonic()
+        return [
+            self._remove_locked(user_id)
+            for user_id in list(self._open)
+            if user_id not in self._pins and now - self._last_used[user_id] > self.idle_timeout
+        ]
+
+    def evict_idle(self):
+        with self._lock:
+            evicted = self._evict_idle_locked()
+        self._close_all(evicted)
+        return len(evicted)
+
+    def _remove_locked(self, user_id):
+        self._last_used.pop(user_id, None)
+        self._evictions += 1
+        return self._open.pop(user_id)
+
+    def _close_all(self, dbs):
+        # Closing flushes the shard's write-behind queue; done outside the
+        # lock so other users are not held up by it.
+        for db in dbs:
+            try:
+                db.close()
+            except Exception as e:
+                print(f"Error closing shard {db.db_path}: {e}")
+
+    def map(self, fn, user_ids=None):
+        # Runs fn(db) against every shard (or the given users) in parallel and
+        # returns {user_id: result}. Queued writes are flushed first so the
+        # results include them. Shards opened just for this are subject to
+        # the usual LRU limit afterwards.
+        user_ids = self.user_ids() if user_ids is None else list(user_ids)
+
+        def run(user_id):
+            with self.shard(user_id) as db:
+                db.flush()
+                return fn(db)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='shard') as executor:
+            return dict(zip(user_ids, executor.map(run, user_ids)))
+
+    def aggregate(self, fn, combine=sum, user_ids=None):
+        # e.g. manager.aggregate(lambda db: db.get_total_points())
+        return combine(self.map(fn, user_ids).values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'open': len(self._open),
+                'pinned': len(self._pins),
+                'max_open': self.max_open,
+                'opens': self._opens,
+                'hits': self._hits,
+                'evictions': self._evictions,
+            }
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if self._pins:
+                print(f"Warning: closing shard manager with {len(self._pins)} shard(s) still in use")
+            dbs = list(self._open.values())
+            self._open.clear()
+            self._last_used.clear()
+            self._pins.clear()
+        self._close_all(dbs)
@@ -0,0 +1,104 @@
+# Bulk export/import of a user's data as NDJSON or CSV, one file per table.
+# Rows are streamed in batches both ways, so memory use does not grow with
+# the size of the history.
+#
+#   python transfer.py export <dir> [--format ndjson|csv] [--db database.db]
+#   python transfer.py import <dir> [--format ndjson|csv] [--db database.db]
+#
+# Importing replaces the user's data in the target database.
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import time
+
+# Parents before children, so ids referenced by later tables already exist.
+TRANSFER_TABLES = ('activities', 'user_progress', 'activity_notes', 'chat_history', 'mood_tracking')
+FORMATS = ('ndjson', 'csv')
+BATCH_SIZE = 10000
+
+def table_path(directory, table, fmt):
+    return os.path.join(directory, f"{table}.{fmt}")
+
+def write_rows(path, fmt, columns, rows):
+    # Writes an iterable of row tuples and returns how many were written.
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow(['' if value is None else value for value in row])
+                count += 1
+        else:
+            encode = json.JSONEncoder(ensure_ascii=False, check_circular=False).encode
+            for row in rows:
+                f.write(encode(dict(zip(columns, row))))
+                f.write('\n')
+                count += 1
+    return count
+
+def read_batches(path, fmt, known_columns, numeric_columns=()):
+    # Yields the file's columns that are in known_columns, then lists of
+    # row tuples holding just those columns, BATCH_SIZE rows at a time. CSV
+    # has no NULL, so empty cells in numeric_columns come back as None.
+    with open(path, encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            reader = csv.reader(f)
+            header = next(reader, [])
+            keep = [i for i, column in enumerate(header) if column in known_columns]
+            yield tuple(header[i] for i in keep)
+            nullable = [n for n, i in enumerate(keep) if header[i] in numeric_columns]
+            while True:
+                rows = [[row[i] for i in keep] for row in itertools.islice(reader, BATCH_SIZE)]
+                if not rows:
+                    break
+                for row in rows:
+                    for n in nullable:
+                        if row[n] == '':
+                            row[n] = None
+                yield rows
+        else:
+            # Decoding a batch of lines as one JSON array is noticeably
+            # faster than one json.loads() call per line.
+            columns = None
+            while True:
+                chunk = list(itertools.islice(f, BATCH_SIZE))
+                if not chunk:
+                    break
+                records = json.loads('[' + ','.join(line for line in chunk if line.strip()) + ']')
+                if columns is None and records:
+                    columns = tuple(column for column in records[0] if column in known_columns)
+                    yield columns
+                yield [tuple(map(record.get, columns)) for record in records]
+            if columns is None:
+                yield ()
+
+def report(action, table, count, seconds):
+    rate = count / seconds if seconds > 0 else 0.0
+    print(f"{action} {count} row(s) of {table} in {seconds:.2f}s ({rate:,.0f} rows/s)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import the app's data as NDJSON or CSV")
+    parser.add_argument('action', choices=('export', 'import'))
+    parser.add_argument('directory')
+    parser.add_argument('--format', choices=FORMATS, default='ndjson')
+    parser.add_argument('--db', default='database.db')
+    args = parser.parse_args()
+
+    from database import Database
+    db = Database(args.db)
+    try:
+        started = time.perf_counter()
+        if args.action == 'export':
+            counts = db.export_data(args.directory, args.format)
+        else:
+            counts = db.import_data(args.directory, args.format)
+        report(args.action.capitalize() + 'ed', 'all tables', sum(counts.values()), time.perf_counter() - started)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# Write-behind writer for the database.
+# Inserts are queued and committed from a dedicated thread in groups, so a
+# burst of writes (chat entry + mood entry, activity + note) costs one
+# transaction and one fsync, and the UI thread never waits on a commit.
+
+import queue
+import threading
+import time
+
+_WRITE = 'write'
+_BARRIER = 'barrier'
+_STOP = 'stop'
+
+class WriteBehindWriter:
+    def __init__(self, execute_batch, max_batch=256, max_delay=0.05):
+        # execute_batch([(sql, params), ...]) runs and commits one transaction.
+        self._execute_batch = execute_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+
+        self._batches = 0
+        self._statements = 0
+        self._failures = 0
+        self._max_batch_seen = 0
+        self._commit_time = 0.0
+
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, sql, params=()):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Write-behind writer is closed")
+            self._queue.put((_WRITE, sql, params))
+
+    def flush(self, callback=None, timeout=None):
+        # Barrier: everything submitted before this call is committed when it
+        # returns (or, with a callback, when the callback runs on the writer
+        # thread). Returns False if the wait timed out.
+        done = threading.Event()
+        with self._lock:
+            if self._closed:
+                if callback:
+                    callback()
+                return True
+            self._queue.put((_BARRIER, done, callback))
+        if callback:
+            return True
+        return done.wait(timeout)
+
+    def close(self, timeout=None):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            done = threading.Event()
+            self._queue.put((_STOP, done, None))
+        done.wait(timeout)
+        self._thread.join(timeout)
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            'pending': self.pending,
+            'batches': self._batches,
+            'statements': self._statements,
+            'failures': self._failures,
+            'avg_batch': (self._statements / self._batches) if self._batches else 0.0,
+            'max_batch': self._max_batch_seen,
+            'avg_commit_ms': (self._commit_time / self._batches * 1000) if self._batches else 0.0,
+        }
+
+    def _next_batch(self):
+        # Blocks for the first item, then keeps collecting until the batch is
+        # full, max_delay has passed, or a barrier/stop asks for a commit now.
+        first = self._queue.get()
+        batch = [first]
+        if first[0] != _WRITE:
+            return batch
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            if item[0] != _WRITE:
+                break
+        return batch
+
+    def _commit(self, statements):
+        if not statements:
+            return
+        started = time.perf_counter()
+        try:
+            self._execute_batch(statements)
+        except Exception as e:
+            # One bad statement shouldn't drop the rest of the group, so
+            # retry them one transaction at a time.
+            print(f"Write-behind batch of {len(statements)} failed ({e}), retrying individually")
+            for statement in statements:
+                try:
+                    self._execute_batch([statement])
+                except Exception as e:
+                    self._failures += 1
+                    print(f"Write-behind statement failed: {e}")
+        self._commit_time += time.perf_counter() - started
+        self._batches += 1
+        self._statements += len(statements)
+        self._max_batch_seen = max(self._max_batch_seen, len(statements))
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            self._commit([(item[1], item[2]) for item in batch if item[0] == _WRITE])
+
+            stop = False
+            for kind, *rest in batch:
+                if kind == _WRITE:
+                    continue
+                done, callback = rest
+                if callback:
+                    try:
+                        callback()
+                    except Exception as e:
+                        print(f"Write-behind flush callback failed: {e}")
+                done.set()
+                stop = stop or kind == _STOP
+            if stop:
+                return